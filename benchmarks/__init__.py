@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for `parallelqueue` (see `benchmarks.suite`). Not collected by pytest.
+"""
@@ -0,0 +1,78 @@
+"""
+Startup benchmark: the time and memory it takes a fresh interpreter to import the package, as measured by
+:code:`python -X importtime`, with the modules that cost the most. Workers of a replication farm or sweep pay this
+once per process, so heavy optional dependencies (pandas, pyarrow, multiprocessing) should only be imported by the
+features using them; the benchmark fails if one of `LAZY` is imported at startup.
+
+Usage
+-----
+.. code-block:: bash
+
+    python -m benchmarks.startup --repeat 5 -o startup.json
+    python -m benchmarks.startup --module parallelqueue.sweep --top 20
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+LAZY = ("pandas", "pyarrow", "multiprocessing", "concurrent.futures", "http.server")
+
+
+def Import(module):
+    """Imports a module in a fresh interpreter under :code:`-X importtime`, returning the parsed report: the total
+    import time in seconds, each module's (self, cumulative) time, in import order, and the peak RSS in MiB."""
+    code = (f"import {module}, resource, sys; peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss; "
+            "print(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10)")
+    done = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                          check=True)
+    modules = {}
+    for line in done.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own) / 1e6, int(cumulative) / 1e6)
+    return {"seconds": sum(own for own, _ in modules.values()), "modules": modules,
+            "peak_rss_mb": float(done.stdout)}
+
+
+def Run(module="parallelqueue.base_models", repeat=5, top=15, output=None, verbose=True):
+    """Imports a module in :code:`repeat` fresh interpreters, keeping the fastest, and returns (and optionally
+    writes to output) the results as a dict, with the :code:`top` modules by cumulative time and those of `LAZY`
+    which were imported.
+
+    :param module: The module to import.
+    :param repeat: Imports measured; the fastest is kept.
+    :param top: Number of modules to list.
+    :param output: Path of a JSON file to write.
+    """
+    best = min((Import(module) for _ in range(repeat)), key=lambda r: r["seconds"])
+    slowest = sorted(best["modules"].items(), key=lambda item: item[1][1], reverse=True)[:top]
+    results = {"module": module, "seconds": best["seconds"], "peak_rss_mb": best["peak_rss_mb"],
+               "slowest": {name: cumulative for name, (_, cumulative) in slowest},
+               "lazy": [name for name in LAZY if name in best["modules"]]}
+    if verbose:
+        print(f"import {module}: {results['seconds'] * 1e3:.1f} ms, peak RSS {results['peak_rss_mb']:.1f} MiB")
+        for name, cumulative in results["slowest"].items():
+            print(f"  {name:50s} {cumulative * 1e3:8.1f} ms")
+        for name in results["lazy"]:
+            print(f"  imported at startup: {name}")
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=1)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="parallelqueue.base_models", help="module to import")
+    parser.add_argument("--repeat", type=int, default=5, help="imports measured; the fastest is kept")
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list")
+    parser.add_argument("-o", "--output", help="JSON file to write")
+    args = parser.parse_args(argv)
+    results = Run(args.module, args.repeat, args.top, args.output)
+    return 1 if results["lazy"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Benchmarks of the models in `base_models` (JSQ(d), Redundancy-d and Threshold-(d,r)) over a grid of parallelism,
+load, d and engine. For each case, events per second and peak RSS are measured for a run without monitors, and the
+added time of each monitor is measured by a run with that monitor alone. Every run takes place in a fresh process
+(so peak RSS is its own) and results are stored as JSON, which a later run can be compared against.
+
+The suite also runs against versions of the package older than itself (put the reference version first on
+:code:`PYTHONPATH`): without `parallelqueue.distributions`, arrivals and service are drawn by
+:code:`random.expovariate`; without the :code:`engine` argument, only the SimPy cases run; monitors missing from the
+version are skipped; and without event hooks, throughput is measured in jobs rather than events per second.
+
+Usage
+-----
+.. code-block:: bash
+
+    PYTHONPATH=/path/to/reference python -m benchmarks.suite run --quick -o baseline.json
+    python -m benchmarks.suite run --quick -o current.json       # on the new version
+    python -m benchmarks.suite compare baseline.json current.json --tolerance 0.2
+
+:code:`compare` exits with status 1 (listing each case) if throughput fell or peak RSS grew by more than the
+tolerance, or if a monitor's run slowed down by more than it.
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import product
+
+from parallelqueue import base_models, monitors
+
+try:
+    from parallelqueue.distributions import Exponential
+except ImportError:  # A version before NumPy distributions
+    Exponential = None
+ENGINES = "engine" in inspect.signature(base_models.JSQd).parameters
+HOOKS = importlib.util.find_spec("parallelqueue.events") is not None
+
+MODELS = ("JSQd", "RedundancyQueueSystem", "Threshold")
+MONITORS = ("TimeQueueSize", "JobTime", "JobTotalStats", "TimeAverageQueueSize")
+GRIDS = {
+    "quick": {"model": MODELS, "parallelism": (10, 100), "load": (0.5, 0.9), "d": (2,), "engine": ("simpy", "fast"),
+              "jobs": 5000, "monitors": MONITORS[:2]},
+    "full": {"model": MODELS, "parallelism": (10, 100, 1000, 10000), "load": (0.5, 0.9, 0.99), "d": (2, 5),
+             "engine": ("simpy", "fast"), "jobs": 100000, "monitors": MONITORS},
+}
+
+
+class Counter(monitors.Monitor):
+    """Counts every event reported to the hooks of `events.EventBus`."""
+
+    def __init__(self):
+        super().__init__()
+        self.Events = 0
+
+    def on_arrival(self, system, now, job):
+        self.Events += 1
+
+    def on_route(self, system, now, job, choices):
+        self.Events += 1
+
+    def on_service_start(self, system, now, job, queue, arrive):
+        self.Events += 1
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.Events += 1
+
+    def on_cancel(self, system, now, job, queue):
+        self.Events += 1
+
+    @property
+    def Name(self):
+        return "Counter"
+
+    @property
+    def Data(self):
+        return self.Events
+
+
+def Cases(grid):
+    """Every case (dict of model, parallelism, load, d, engine and jobs) of a grid which this version can run."""
+    keys = ("model", "parallelism", "load", "d", "engine")
+    return [{**dict(zip(keys, values)), "jobs": grid["jobs"]} for values in product(*(grid[k] for k in keys))
+            if values[3] <= values[1] and (ENGINES or values[4] == "simpy")]
+
+
+def Key(case):
+    return "{model}-p{parallelism}-load{load:g}-d{d}-{engine}".format(**case)
+
+
+def Build(case, Monitors):
+    """The system of a case: unit-rate service, arrivals at rate load × parallelism and a finite number of jobs."""
+    model, rate = case["model"], case["load"] * case["parallelism"]
+    if Exponential is None:
+        samplers = dict(Arrival=random.expovariate, AArgs=rate, Service=random.expovariate, SArgs=1)
+    else:
+        samplers = dict(Arrival=Exponential(rate), AArgs=None, Service=Exponential(1), SArgs=None)
+    arguments = dict(parallelism=case["parallelism"], seed=1234, d=case["d"], Monitors=Monitors,
+                     numberJobs=case["jobs"], infiniteJobs=False, **samplers)
+    if ENGINES:
+        arguments["engine"] = case["engine"]
+    if model == "Threshold":
+        return base_models.RedundancyQueueSystem(r=2, **arguments)
+    return getattr(base_models, model)(**arguments)
+
+
+def PeakRSS():
+    """Peak resident set size of this process in MiB."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  # bytes on macOS, KiB on Linux
+
+
+def Measure(case, monitor=None):
+    """Times one run of a case (with a single monitor, if given). Meant to run in a fresh process.
+
+    :param case: One of `Cases`.
+    :param monitor: Name of a monitor of `parallelqueue.monitors`.
+    """
+    sim = Build(case, [getattr(monitors, monitor)] if monitor else [])
+    start = time.perf_counter()
+    sim.RunSim()
+    seconds = time.perf_counter() - start
+    result = {"seconds": seconds, "peak_rss_mb": PeakRSS(), "jobs_per_second": case["jobs"] / seconds}
+    if monitor is None and HOOKS:  # Count events in an untimed run
+        counted = Build(case, [Counter])
+        counted.RunSim()
+        result["events"] = counted.MonitorHolder["Counter"].Events
+        result["events_per_second"] = result["events"] / seconds
+    return result
+
+
+def Isolated(function, *args):
+    """Calls a function in a new process, so that its peak RSS is its own."""
+    with ProcessPoolExecutor(max_workers=1) as executor:  # A new executor, and so a new process, per call
+        return executor.submit(function, *args).result()
+
+
+def Best(function, repeat, *args):
+    """The fastest of several isolated measurements."""
+    return min((Isolated(function, *args) for _ in range(repeat)), key=lambda r: r["seconds"])
+
+
+def Environment():
+    """Versions describing where the benchmarks ran."""
+    import numpy
+    import simpy
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "numpy": numpy.__version__,
+            "simpy": simpy.__version__, "commit": commit, "time": datetime.now(timezone.utc).isoformat()}
+
+
+def Run(grid="quick", repeat=1, output=None, verbose=True):
+    """Runs every case of a grid, returning (and optionally writing to output) the results as a dict.
+
+    :param grid: Name of a grid in `GRIDS`, or a grid dict.
+    :param repeat: Runs per measurement; the fastest is kept.
+    :param output: Path of a JSON file to write.
+    """
+    grid = GRIDS[grid] if isinstance(grid, str) else grid
+    results = {"environment": Environment(), "cases": {}}
+    for case in Cases(grid):
+        result = {"case": case, **Best(Measure, repeat, case), "monitors": {}}
+        for monitor in [name for name in grid["monitors"] if hasattr(monitors, name)]:
+            timed = Best(Measure, repeat, case, monitor)
+            timed["overhead"] = timed["seconds"] - result["seconds"]
+            result["monitors"][monitor] = timed
+        results["cases"][Key(case)] = result
+        if verbose:
+            unit = "events" if "events_per_second" in result else "jobs"
+            print(f"{Key(case):45s} {result[unit + '_per_second']:12,.0f} {unit}/s {result['peak_rss_mb']:8.1f} MiB",
+                  flush=True)
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=1)
+    return results
+
+
+def Compare(baseline, current, tolerance=0.2):
+    """The regressions of current results with respect to a baseline (cases missing from either are skipped).
+    Throughput is compared in events per second, or in jobs per second if either side lacks events.
+
+    :param baseline: Results (as returned by `Run` or read from its JSON).
+    :param current: Results to check.
+    :param tolerance: Relative change tolerated.
+    :return: A list of messages, empty if nothing regressed.
+    """
+    regressions = []
+    for key, now in current["cases"].items():
+        before = baseline["cases"].get(key)
+        if before is None:
+            continue
+        unit = "events" if "events_per_second" in now and "events_per_second" in before else "jobs"
+        rate = unit + "_per_second"
+        if now[rate] < before[rate] * (1 - tolerance):
+            regressions.append(f"{key}: {now[rate]:,.0f} {unit}/s (was {before[rate]:,.0f})")
+        if now["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{key}: peak RSS {now['peak_rss_mb']:.1f} MiB (was {before['peak_rss_mb']:.1f})")
+        for monitor, timed in now["monitors"].items():
+            previous = before["monitors"].get(monitor)
+            if previous is not None and timed["seconds"] > previous["seconds"] * (1 + tolerance):
+                regressions.append(f"{key}: with {monitor} {timed['seconds']:.3f}s (was {previous['seconds']:.3f}s)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--quick", action="store_const", dest="grid", const="quick", default="full",
+                     help="small grid (seconds rather than hours)")
+    run.add_argument("--repeat", type=int, default=1, help="runs per measurement; the fastest is kept")
+    run.add_argument("-o", "--output", help="JSON file to write")
+    compare = commands.add_parser("compare", help="compare results against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        Run(args.grid, args.repeat, args.output)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = Compare(baseline, current, args.tolerance)
+    for message in regressions:
+        print(message)
+    print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
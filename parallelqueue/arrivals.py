@@ -1,5 +1,29 @@
+from math import inf
+
+
+def Batches(system, number):
+    """Yields the names of the jobs arriving together at each arrival time: a batch of :code:`system.Batches()` jobs
+    (see the :code:`batch` argument of `base_models.ParallelQueueSystem`), whose size is also set as
+    :code:`system.BatchSize` for the routers. Without infinite jobs, the last batch is cut short at job
+    :code:`number`; with them, names continue from :code:`number`.
+
+    :param system: System providing the batch sizes.
+    :type system: base_models.ParallelQueueSystem
+    :param number: Max numberJobs of jobs if infiniteJobs is false.
+    :type number: int
+    """
+    first, last = (number + 1, inf) if system.infiniteJobs else (1, number)
+    while first <= last:
+        size = system.Batches()
+        system.BatchSize = size
+        yield range(first, min(first + size - 1, last) + 1)
+        first += size
+
+
 def DefaultArrivals(router, system, env, number, queues, **kwargs):
-    """General arrival process; interarrival times are defined by the given distribution
+    """General arrival process; interarrival times are defined by the given distribution (or arrival process, see
+    `processes`, or replayed from a trace, see `traces`). Jobs arrive in batches (see `Batches`), one by default,
+    until the next arrival would be at infinity.
 
     :param router: Router process.
     :param system: System providing environment.
@@ -11,18 +35,38 @@ def DefaultArrivals(router, system, env, number, queues, **kwargs):
     :param queues: A list of all queues making up the parallel system.
     :type queues: List[simpy.Resource]
     """
-    if not system.infiniteJobs:
-        for i in range(number):
-            c = router(system, env, 'Job%02d' % (i + 1), queues, **kwargs)
-            env.process(c)
-            t = kwargs["Arrival"](kwargs["AArgs"])
-            yield env.timeout(t)
-    else:
-        while True:  # referring to until not being passed
-            number += 1
-            c = router(system, env, 'Job%02d' % number, queues, **kwargs)
+    for names in Batches(system, number):
+        for name in names:
+            c = router(system, env, name, queues, **kwargs)
             env.process(c)
-            t = kwargs["Arrival"](kwargs["AArgs"])
-            yield env.timeout(t)
+        if len(names) < system.BatchSize:  # The last jobs
+            return
+        t = kwargs["Arrival"](kwargs["AArgs"])
+        if t == inf:  # E.g. the end of a trace
+            return
+        yield env.timeout(t)
 
 
+def LazyArrivals(router, system, env, number, queues, **kwargs):
+    """Arrival process of `network.LazyNetwork`: the router is called directly at each arrival rather than started
+    as a process.
+
+    :param router: Router function.
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation
+    :type env: simpy.Environment
+    :param number: Max numberJobs of jobs if infiniteJobs is false.
+    :type number: int
+    :param queues: A list of all queues making up the parallel system.
+    :type queues: List[queues.LazyQueue]
+    """
+    for names in Batches(system, number):
+        for name in names:
+            router(system, env, name, queues, **kwargs)
+        if len(names) < system.BatchSize:  # The last jobs
+            return
+        t = kwargs["Arrival"](kwargs["AArgs"])
+        if t == inf:  # E.g. the end of a trace
+            return
+        yield env.timeout(t)
@@ -1,11 +1,24 @@
 import random
 from warnings import warn
 
-import pandas as pd
-from simpy import Environment, Resource
+import numpy as np
+from simpy import Environment
+from simpy.core import StopSimulation
 
 from parallelqueue import monitors
-from parallelqueue.network import Network
+from parallelqueue.checkpoint import Load
+from parallelqueue.convergence import Convergence
+from parallelqueue.distributions import Distribution, Function, JobSizes, Sampler, Streams
+from parallelqueue.events import EventBus
+from parallelqueue.fast import FastEngine
+from parallelqueue.instrumentation import Instrumentation
+from parallelqueue.network import Network, StagedNetwork
+from parallelqueue.processes import ArrivalProcess
+from parallelqueue.queues import QueueIndex
+from parallelqueue.replications import ReplicationRunner
+from parallelqueue.routers import POLICIES, Policy
+from parallelqueue.traces import Open, Trace
+from parallelqueue.variance import Routing
 
 
 class ParallelQueueSystem:
@@ -24,12 +37,39 @@ class ParallelQueueSystem:
     :param df: Whether or not a pandas.DataFrame of the queue sizes over time should be returned.
     :param d: Number of queues to parse.
     :param doPrint: If true, each event will trigger a statement to be printed.
-    :param Arrival: A kwarg specifying the arrival distribution to use (a function).
+    :param Arrival: A kwarg specifying the arrival distribution to use (a function), an arrival process (see
+        `processes`), or a `traces.Trace` to replay.
     :param AArgs: parameters needed by the function.
-    :param Service: A kwarg specifying the service distribution to use (a function).
+    :param Service: A kwarg specifying the service distribution to use (a function). Ignored if the trace given as
+        :code:`Arrival` has job sizes.
     :param SArgs: parameters needed by the function.
-    :param Monitors: Any monitor which overrides the methods of monitors.Monitor
-    :param Network: Network class which defines the structure of the system.
+    :param Monitors: Any monitor which overrides the methods of monitors.Monitor (subscribed to :code:`Events`,
+        an `events.EventBus`)
+    :param Network: Network class which defines the structure of the system (e.g. `network.LazyNetwork`, which
+        runs without a process per job).
+    :param engine: Either :code:`"simpy"` (default) or :code:`"fast"`, the latter running the default network without
+        SimPy (see `fast.FastEngine`).
+    :param instrument: If true, counts and times the events of each run (see `instrumentation.Instrumentation`,
+        kept as :code:`Instrumentation`).
+    :param cancel: When the other replicas of a job are cancelled: once one of them completes service
+        (:code:`"complete"`, the default) or as soon as one begins service (:code:`"start"`).
+    :param crn: If true, arrivals, job sizes and routing samples are drawn from streams of their own, one draw per
+        arriving job, so that systems with the same seed see the same arrival times and job sizes (common random
+        numbers; see `variance`). :code:`random.expovariate` is then drawn from the streams too; any other function of
+        the `random` module cannot be, and raises a :code:`ValueError` (use a `distributions.Distribution`).
+    :param antithetic: If true (with :code:`crn`), interarrival times and job sizes are drawn from mirrored uniforms,
+        as the antithetic twin of the run with the same seed.
+    :param speeds: Speed factor of each queue (an array of :code:`parallelism` values); a job is served for its size
+        (drawn from :code:`Service`) divided by the speed of its queue. All 1 by default.
+    :param capacities: Number of servers of each queue (an array of :code:`parallelism` integers). All 1 by default.
+    :param router: How a job without replicas chooses its queue, by name (see `routers.POLICIES`) or as a subclass
+        of `routers.Policy`: :code:`"jsq"` (the shortest of d sampled queues, by default), :code:`"speed"`
+        (speed-weighted JSQ(d)), :code:`"work"` (the least expected work of d), :code:`"jiq"` (Join-Idle-Queue),
+        :code:`"memory"` (power-of-d with memory), :code:`"round-robin"`, :code:`"lwl"` (least-work-left),
+        :code:`"batch-sampling"` or :code:`"batch-filling"`.
+    :param batch: Number of jobs arriving together at each arrival time (e.g. for the batch routers), or a
+        `distributions.Distribution` of positive integers (e.g. `distributions.Geometric`) from which it is drawn anew
+        at each arrival time, making compound arrivals. The batch routers plan each batch, whatever its size, at once.
 
     Example
     -------
@@ -58,8 +98,46 @@ class ParallelQueueSystem:
     """
 
     def __init__(self, parallelism, seed, d, r=None, maxTime=None, doPrint=False, infiniteJobs=True, Replicas=True,
-                 numberJobs=0, network=Network, **kwargs):
+                 numberJobs=0, network=Network, engine="simpy", instrument=False, cancel="complete", crn=False,
+                 antithetic=False, speeds=None, capacities=None, router="jsq", batch=1, **kwargs):
+        if engine not in ("simpy", "fast"):
+            raise ValueError(f"Unknown engine '{engine}'; expected 'simpy' or 'fast'.")
+        if engine == "fast" and network is not Network:
+            raise ValueError("The fast engine only supports the default network.Network.")
+        if cancel not in ("complete", "start"):
+            raise ValueError(f"Unknown cancellation policy '{cancel}'; expected 'complete' or 'start'.")
+        if antithetic and not crn:
+            raise ValueError("Antithetic runs require common random numbers (crn=True).")
+        if crn and any(name in kwargs and isinstance(Sampler(kwargs[name], kwargs.get(args)), Function)
+                       for name, args in (("Arrival", "AArgs"), ("Service", "SArgs"))):
+            raise ValueError("Common random numbers are drawn from streams of their own, by inversion; use a "
+                             "Distribution (or random.expovariate) rather than a function of the random module.")
+        if not (isinstance(router, type) and issubclass(router, Policy)) and router not in POLICIES:
+            raise ValueError(f"Unknown router '{router}'; expected one of {', '.join(POLICIES)} or a Policy.")
+        drawn = isinstance(batch, Distribution)  # Batch sizes drawn at each arrival time
+        if isinstance(batch, ArrivalProcess) or not drawn and (batch < 1 or batch != int(batch)):
+            raise ValueError("batch must be a positive integer, or a distribution of them.")
+        if router != "jsq" and Replicas:
+            raise ValueError("Replicas join every sampled queue (under the threshold); only 'jsq' applies.")
+        for name, values in (("speeds", speeds), ("capacities", capacities)):
+            if values is not None and (len(values) != parallelism or min(values) <= 0):
+                raise ValueError(f"{name} needs one positive value per queue.")
+        if capacities is not None and any(c != int(c) for c in capacities):
+            raise ValueError("capacities must be integers.")
+        if engine == "fast" and (router != "jsq" or capacities is not None and max(capacities) > 1):
+            raise ValueError("The fast engine only models single-server queues routed by 'jsq'.")
         self.network = network
+        self.engine = engine
+        self.cancel = cancel
+        self.crn = crn
+        self.antithetic = antithetic
+        self.speeds = None if speeds is None else [float(s) for s in speeds]
+        self.capacities = None if capacities is None else [int(c) for c in capacities]
+        self.router = router
+        self.batch = batch if drawn else int(batch)
+        self.Batches = None  # Sampler of batch sizes, bound for each run
+        self.BatchSize = 1  # Size of the latest batch
+        self.Policy = None
         if infiniteJobs and numberJobs > 0:
             warn("\n Conflicting settings. Setting infiniteJobs := False, \n"
                  f"  Will generate {numberJobs} Job(s)!")
@@ -76,36 +154,198 @@ class ParallelQueueSystem:
         self.Number = 0 if self.infiniteJobs else numberJobs
         self.kwargs = kwargs
         self.MonitorHolder = {} if "Monitors" in self.kwargs is not None else None
+        self.QueueState = None
+        self.Queues = None
+        self.Routing = None
+        self.halt = None
 
         if self.MonitorHolder is not None:
             for monitor in self.kwargs["Monitors"]:
                 m = monitor()  # initialize
                 self.MonitorHolder[m.Name] = m
+        self.Instrumentation = Instrumentation() if instrument else None
+        self.Subscribe()
+
+    def Subscribe(self):
+        """Subscribes the monitors to a new event bus, :code:`Events`."""
+        self.Events = EventBus(self.MonitorHolder.values() if self.MonitorHolder is not None else ())
+        if self.Instrumentation is not None:
+            self.Instrumentation.Wrap(self.Events)
 
-    def __sim_manager__(self):
-        """Manages the simulation by initializing and running it using the user-specified parameters."""
-        random.seed(self.seed)
-        env = Environment()
-        queues = {i: Resource(env, capacity=1) for i in range(self.parallelism)}
-        env.process(self.network().Arrivals(system=self, env=env, number=self.Number, queues=queues, **self.kwargs))
+    def __sim_manager__(self, checkpoint=None, every=None, resume=None):
+        """Manages the simulation by initializing and running it using the user-specified parameters. Returns the time
+        at which the run ended."""
         if self.doPrint:
             print(f"\n Running simulation with seed {self.seed}... \n")
-        if self.maxTime is not None:
-            env.run(until=self.maxTime)
+        if checkpoint is not None and self.engine != "fast":
+            raise ValueError("Checkpoints require engine='fast'; SimPy processes cannot be saved.")
+        if (checkpoint is not None or resume is not None) and isinstance(self.kwargs.get("Arrival"),
+                                                                         (Trace, ArrivalProcess)):
+            raise ValueError("Runs replaying a trace or driven by an arrival process cannot be checkpointed.")
+        buckets = self.d == self.parallelism and self.ReplicaDict is None and self.router == "jsq"
+        self.Policy = None if self.router == "jsq" else POLICIES.get(self.router, self.router)(self)
+        mean = None
+        if self.Policy is not None and self.Policy.work:
+            try:
+                mean = Sampler(self.kwargs["Service"], self.kwargs["SArgs"]).Mean
+            except NotImplementedError:
+                raise ValueError("Routing by work needs a service distribution with a known mean.") from None
+        self.QueueState = QueueIndex(self.parallelism, buckets, self.speeds, self.capacities, mean)
+        if self.Policy is not None and self.Policy.Update is not None:
+            self.QueueState.Watcher = self.Policy.Update
+        if self.Instrumentation is not None:
+            self.Instrumentation.Start()
+        if self.engine == "fast":
+            engine = FastEngine(self)
+            if resume is not None:
+                self.QueueState = engine.state = resume["queues"]
+                self.MonitorHolder = resume["monitors"]
+                self.Subscribe()
+                engine.Restore(resume["engine"])
+            if checkpoint is not None:
+                engine.Checkpoints(checkpoint, every)
+            self.halt = engine.Stop
+            engine.Run()
+            now = self.maxTime if self.maxTime is not None else engine.now
         else:
-            env.run()
+            random.seed(self.seed)
+            env = Environment()
+            self.QueueState.clock = env
+            network = self.network()
+            queues = network.Build(self, env)
+            self.Queues = queues
+            self.halt = lambda: Halt(env)
+            if self.Instrumentation is not None:
+                self.Instrumentation.Attach(network, env)
+            streams = Streams(self.seed, self.parallelism, self.crn, self.antithetic)
+            kwargs = Open(self.kwargs)  # A trace is replayed as it is
+            kwargs = streams.Bind(kwargs, self.d if self.ReplicaDict is not None else 1)  # Draw from substreams
+            sizes = kwargs["Service"] if isinstance(kwargs["Service"], JobSizes) else None
+            self.Batches = streams.Batches(self.batch)
+            if self.crn:
+                self.Routing = Routing(streams.Routing, self.parallelism, self.d)
+            if sizes is not None:
+                self.Events.Subscribe(sizes)  # Forgets the sizes of departed jobs
+            env.process(network.Arrivals(system=self, env=env, number=self.Number, queues=queues, **kwargs))
+            try:
+                if self.maxTime is not None:
+                    env.run(until=self.maxTime)
+                else:
+                    env.run()
+            finally:
+                if sizes is not None:
+                    self.Events.Unsubscribe(sizes)
+            now = env.now
+        self.halt = None
+        if self.Instrumentation is not None:
+            self.Instrumentation.Stop(now)
         if self.doPrint:
             print("\n Done \n")
+        return now
+
+    def RunSim(self, checkpoint=None, every=None, export=None):
+        """Runs the simulation.
+
+        :param checkpoint: If given, a file to which the state of the run is written every :code:`every` units of
+            simulated time (see `checkpoint`). Requires :code:`engine="fast"`.
+        :param every: Simulated time between checkpoints.
+        :param export: If given, a `live.LiveExport` streaming snapshots of the run while it runs.
+        """
+        if checkpoint is not None and not every:
+            raise ValueError("Checkpoints need a positive interval, every.")
+        if export is None:
+            self.__sim_manager__(checkpoint, every)
+            return
+        self.Events.Subscribe(export)
+        export.Start()
+        now = None
+        try:
+            now = self.__sim_manager__(checkpoint, every)
+        finally:
+            self.Events.Unsubscribe(export)
+            export.Stop(self, now)
+
+    def Resume(self, path, every=None):
+        """Continues a run from a checkpoint written by a system with the same arguments and seed; the output is
+        bit-identical to that of an uninterrupted run.
+
+        :param path: The checkpoint file.
+        :param every: If given, further checkpoints are written to the same file at this interval.
+
+        Example
+        -------
+        .. code-block:: python
+
+            sim = JSQd(maxTime=1e6, parallelism=5000, seed=1234, d=2, Arrival=random.expovariate, AArgs=4900,
+                       Service=random.expovariate, SArgs=1, engine="fast")
+            sim.RunSim(checkpoint="run.ckpt", every=1000.0)
+            ...  # after a crash, rebuild sim as above and
+            sim.Resume("run.ckpt", every=1000.0)
+        """
+        if self.engine != "fast":
+            raise ValueError("Checkpoints require engine='fast'; SimPy processes cannot be saved.")
+        self.__sim_manager__(path if every else None, every, resume=Load(path, self))
+
+    def Stop(self):
+        """Stops a running simulation at the current time; monitors keep what they observed until then."""
+        if self.halt is not None:
+            self.halt()
+
+    def RunToPrecision(self, precision=0.05, confidence=0.95, progress=None, **options):
+        """Runs the simulation until the mean response time is estimated to a relative precision (or until it would
+        otherwise end), discarding the warm-up period (see `convergence.Convergence`).
 
-    def RunSim(self):
-        """Runs the simulation."""
-        self.__sim_manager__()
+        :param precision: Relative half-width of the confidence interval at which to stop.
+        :param confidence: Confidence level of the interval.
+        :param progress: :code:`True` to print progress, :code:`"tqdm"` for a progress bar or a function called with
+            the estimate so far.
+        :param options: Further arguments of `convergence.Convergence` (e.g. batches, minimum and every).
+        :return: The final estimate (see `convergence.Convergence.Report`).
+
+        Example
+        -------
+        .. code-block:: python
+
+            sim = JSQd(parallelism=100, seed=1234, d=2, Arrival=random.expovariate, AArgs=90,
+                       Service=random.expovariate, SArgs=1, Monitors=[])
+            estimate = sim.RunToPrecision(0.01, progress=True)
+        """
+        stopping = Convergence(precision, confidence, progress=progress, **options)
+        self.Events.Subscribe(stopping)
+        try:
+            self.__sim_manager__()
+        finally:
+            self.Events.Unsubscribe(stopping)
+            stopping.Close()
+        return stopping.Report()
+
+    def RunReplications(self, n, workers=None):
+        """Runs n independent replications across a pool of workers (see `replications.ReplicationRunner`),
+        returning a compact summary of each.
+
+        :param n: Number of replications.
+        :param workers: Number of processes. Defaults to the number of CPUs.
+        """
+        return ReplicationRunner(self, workers=workers).Run(n)
+
+    def RunSharded(self, shards=None, window=None, timeout=None):
+        """Runs a large JSQ(d) system split into shards of queues, each simulated by a process of its own (see
+        `shards.ShardedRunner`), returning a summary of the run as `RunReplications` does of each replication.
+
+        :param shards: Number of shards (and processes). Defaults to the number of CPUs.
+        :param window: Simulated time between exchanges of the queues' numbers in system. Defaults to 0.05 mean
+            service times.
+        :param timeout: Seconds to wait for the shards to simulate a window before the run is stopped. Defaults to as
+            long as they are alive.
+        """
+        from parallelqueue.shards import ShardedRunner  # Imports multiprocessing only when used
+        return ShardedRunner(self, shards, window, timeout=timeout).Run()
 
     @property
     def DataFrame(self):
         """If :code:`TimeQueueSize` was a monitor, returns a dataframe of queue sizes over time."""
         if "TimeQueueSize" in self.MonitorHolder:
-            return pd.DataFrame(self.MonitorHolder["TimeQueueSize"].Data).transpose()
+            return self.MonitorHolder["TimeQueueSize"].DataFrame
         else:
             raise Exception("Error: 'TimeQueueSize' must be monitored!")
 
@@ -115,9 +355,18 @@ class ParallelQueueSystem:
         return {name: monitor.Data for name, monitor in self.MonitorHolder.items()}
 
 
+def Halt(env):
+    """Stops :code:`env.run()` once the events at the current time that are already scheduled are processed."""
+    event = env.event()
+    event.callbacks.append(StopSimulation.callback)
+    event.succeed()
+
+
 # New 0.0.5 - Base models rewritten with same base class
 def RedundancyQueueSystem(parallelism, seed, d, Arrival, AArgs, Service, SArgs, Monitors=[monitors.TimeQueueSize],
-                          r=None, maxTime=None, doPrint=False, infiniteJobs=True, numberJobs=0):
+                          r=None, maxTime=None, doPrint=False, infiniteJobs=True, numberJobs=0, engine="simpy",
+                          instrument=False, cancel="complete", network=Network, crn=False, speeds=None,
+                          capacities=None):
     """A queueing system wherein a Router chooses the smallest queue of d sampled (identical) queues to join,
     potentially replicating
     itself before enqueueing. For the sampled queues with sizes less than r, the job and/or its clones will join
@@ -137,6 +386,15 @@ def RedundancyQueueSystem(parallelism, seed, d, Arrival, AArgs, Service, SArgs,
     :param Service: A kwarg specifying the service distribution to use (a function).
     :param SArgs: parameters needed by the function.
     :param Monitors: List of monitors which overrides the methods of monitors.Monitor
+    :param engine: Either :code:`"simpy"` (default) or :code:`"fast"` (see `fast.FastEngine`).
+    :param instrument: If true, counts and times the events of each run (see `instrumentation`).
+    :param network: Network class which defines the structure of the system; `network.LazyNetwork` runs without a
+        process per job.
+    :param cancel: When the other replicas of a job are cancelled: once one of them completes service
+        (:code:`"complete"`) or begins it (:code:`"start"`).
+    :param crn: If true, draws arrivals, job sizes and routing samples as common random numbers (see `variance`).
+    :param speeds: Speed factor of each queue (job sizes are divided by it). All 1 by default.
+    :param capacities: Number of servers of each queue. All 1 by default.
 
     Example
     -------
@@ -155,11 +413,14 @@ def RedundancyQueueSystem(parallelism, seed, d, Arrival, AArgs, Service, SArgs,
         "Arrival": Arrival, "AArgs": AArgs, "Service": Service, "SArgs": SArgs, "Monitors": Monitors,
     }  # Pack to use as argument
     return ParallelQueueSystem(parallelism=parallelism, seed=seed, d=d, r=r, maxTime=maxTime, doPrint=doPrint,
-                               infiniteJobs=infiniteJobs, numberJobs=numberJobs, Replicas=True, **kwargs)
+                               infiniteJobs=infiniteJobs, numberJobs=numberJobs, Replicas=True, engine=engine,
+                               instrument=instrument, cancel=cancel, network=network, crn=crn, speeds=speeds,
+                               capacities=capacities, **kwargs)
 
 
 def JSQd(parallelism, seed, d, Arrival, AArgs, Service, SArgs, Monitors=[monitors.TimeQueueSize], r=None, maxTime=None,
-         doPrint=False, infiniteJobs=True, numberJobs=0):
+         doPrint=False, infiniteJobs=True, numberJobs=0, engine="simpy", instrument=False, network=Network,
+         crn=False, speeds=None, capacities=None, router="jsq", batch=1):
     """A queueing system wherein a Router chooses the smallest queue of d sampled (identical) queues to join for
     each arriving job.
 
@@ -176,9 +437,96 @@ def JSQd(parallelism, seed, d, Arrival, AArgs, Service, SArgs, Monitors=[monitor
     :param Service: A kwarg specifying the service distribution to use (a function).
     :param SArgs: parameters needed by the function.
     :param Monitors: List of monitors which overrides the methods of monitors.Monitor
+    :param engine: Either :code:`"simpy"` (default) or :code:`"fast"` (see `fast.FastEngine`).
+    :param instrument: If true, counts and times the events of each run (see `instrumentation`).
+    :param network: Network class which defines the structure of the system; `network.LazyNetwork` runs without a
+        process per job.
+    :param crn: If true, draws arrivals, job sizes and routing samples as common random numbers (see `variance`).
+    :param speeds: Speed factor of each queue (job sizes are divided by it). All 1 by default.
+    :param capacities: Number of servers of each queue. All 1 by default.
+    :param router: The routing policy, :code:`"jsq"` by default (see `ParallelQueueSystem` and `routers.POLICIES`).
+    :param batch: Number of jobs arriving together at each arrival time, or a distribution of it.
+
+    Example
+    -------
+    .. code-block:: python
+
+        # Two generations of servers: 50 single servers and 50 pairs of servers twice as fast
+        sim = JSQd(maxTime=100.0, parallelism=100, seed=1234, d=2,
+                   Arrival=random.expovariate, AArgs=200,
+                   Service=random.expovariate, SArgs=1,
+                   speeds=[1] * 50 + [2] * 50, capacities=[1] * 50 + [2] * 50, router="work")
+        sim.RunSim()
     """
     kwargs = {
         "Arrival": Arrival, "AArgs": AArgs, "Service": Service, "SArgs": SArgs, "Monitors": Monitors
     }  # Pack to use as argument
     return ParallelQueueSystem(parallelism=parallelism, seed=seed, d=d, r=r, maxTime=maxTime, doPrint=doPrint,
-                               infiniteJobs=infiniteJobs, numberJobs=numberJobs, Replicas=False, **kwargs)
+                               infiniteJobs=infiniteJobs, numberJobs=numberJobs, Replicas=False, engine=engine,
+                               instrument=instrument, network=network, crn=crn, speeds=speeds,
+                               capacities=capacities, router=router, batch=batch, **kwargs)
+
+
+def StagedQueueSystem(stages, seed, Arrival, AArgs, transitions=None, entry=None, Monitors=[monitors.TimeQueueSize],
+                      maxTime=None, doPrint=False, infiniteJobs=True, numberJobs=0, instrument=False, batch=1):
+    """A multi-stage queueing network (see `network.StagedNetwork`): each stage is a pool of queues with its own
+    routing policy and service distribution (see `network.Stage`), possibly forking each job into tasks which must
+    all be served before it moves on (fork-join). Jobs move between stages by a routing matrix.
+
+    :param stages: The stages, a list of `network.Stage`.
+    :param seed: Random number generation seed.
+    :param Arrival: A kwarg specifying the arrival distribution to use (a function), an arrival process (see
+        `processes`), or a `traces.Trace` to replay.
+    :param AArgs: parameters needed by the function.
+    :param transitions: Routing matrix between stages: a job served at stage i moves to stage j with probability
+        :code:`transitions[i][j]` and leaves the system with the rest of the row's probability. By default, the
+        stages form a pipeline (each job passes through every stage in order).
+    :param entry: Probability of each stage being the first of an arriving job. By default, the first stage.
+    :param Monitors: List of monitors which overrides the methods of monitors.Monitor. Their queues are numbered
+        across stages, stage after stage.
+    :param maxTime: If set, becomes the maximum allotted time for this simulation.
+    :param doPrint: If true, each event will trigger a statement to be printed.
+    :param infiniteJobs: If true, there will be no upper limit for the number of jobs generated.
+    :param numberJobs: Max number of jobs if infiniteJobs is False. Will be ignored if infiniteJobs is True.
+    :param instrument: If true, counts and times the events of each run (see `instrumentation`).
+    :param batch: Number of jobs arriving together at each arrival time, or a distribution of it.
+
+    Example
+    -------
+    .. code-block:: python
+
+        # A fan-out stage, a fork-join stage of 3 tasks per job and a backend tier which half the jobs revisit
+        stages = [Stage(20, random.expovariate, 2.0, d=2),
+                  Stage(60, random.expovariate, 4.0, d=6, router="batch-filling", fork=3),
+                  Stage(10, random.expovariate, 4.0, router="jiq")]
+        sim = StagedQueueSystem(stages, seed=1234, Arrival=random.expovariate, AArgs=15, maxTime=100.0,
+                                transitions=[[0, 1, 0], [0, 0, 1], [0, 0.5, 0]])
+        sim.RunSim()
+    """
+    stages = list(stages)
+    if not stages:
+        raise ValueError("A staged system needs at least one stage.")
+    n = len(stages)
+    if transitions is None:
+        transitions = np.eye(n, k=1)
+    transitions = np.asarray(transitions, dtype=float)
+    entry = np.asarray(entry if entry is not None else np.eye(n)[0], dtype=float)
+    if transitions.shape != (n, n) or entry.shape != (n,):
+        raise ValueError("transitions needs one row and one column per stage, and entry one value per stage.")
+    if (transitions < 0).any() or (transitions.sum(axis=1) > 1 + 1e-9).any():
+        raise ValueError("Each row of transitions must be nonnegative probabilities summing to at most 1.")
+    if (entry < 0).any() or abs(entry.sum() - 1) > 1e-9:
+        raise ValueError("entry must be probabilities summing to 1.")
+    speeds = capacities = None
+    if any(stage.speeds is not None for stage in stages):
+        speeds = [s for stage in stages for s in (stage.speeds or [1.0] * stage.parallelism)]
+    if any(stage.capacities is not None for stage in stages):
+        capacities = [c for stage in stages for c in (stage.capacities or [1] * stage.parallelism)]
+    kwargs = {
+        "Arrival": Arrival, "AArgs": AArgs, "Service": None, "SArgs": None, "Monitors": Monitors, "Stages": stages,
+        "Transitions": transitions.tolist(), "Entry": entry.tolist()
+    }  # Pack to use as argument
+    return ParallelQueueSystem(parallelism=sum(stage.parallelism for stage in stages), seed=seed, d=1,
+                               maxTime=maxTime, doPrint=doPrint, infiniteJobs=infiniteJobs, numberJobs=numberJobs,
+                               Replicas=False, network=StagedNetwork, instrument=instrument, speeds=speeds,
+                               capacities=capacities, batch=batch, **kwargs)
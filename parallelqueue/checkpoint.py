@@ -0,0 +1,60 @@
+"""
+Checkpoints of long runs, so that a crashed or preempted simulation picks up where it left off rather than starting
+over (see `base_models.ParallelQueueSystem.RunSim` and `base_models.ParallelQueueSystem.Resume`).
+
+A checkpoint is a single binary (pickle) file holding, as of the moment it was written:
+
+- the queue contents: per-server waiting jobs (with arrival times), jobs in service and their departure times
+  (i.e., remaining service), next-free times and pending replica sets;
+- the next arrival, the state of every random stream and the samples already drawn but not yet used;
+- the monitors (with their accumulators) and the `queues.QueueIndex`.
+
+A run resumed from a checkpoint produces output bit-identical to that of the uninterrupted run.
+
+Note
+----
+Only the fast engine (:code:`engine="fast"`) can be checkpointed: the SimPy engine keeps its state in the frames of
+live generators, which cannot be pickled. Monitors must be picklable (e.g. not spilling to Parquet).
+"""
+import os
+import pickle
+
+VERSION = 1
+
+
+def Identity(system):
+    """What a system must share with the one which wrote a checkpoint to continue it (its arguments and seed)."""
+    from parallelqueue.replications import Specification  # Avoid a circular import
+    from parallelqueue.sweep import Key
+    return Key({**Specification(system), "seed": system.seed})
+
+
+def Save(path, system, engine):
+    """Writes a checkpoint of a running system (atomically; a crash while writing keeps the previous one).
+
+    :param path: File to write.
+    :param system: The system being run.
+    :type system: base_models.ParallelQueueSystem
+    :param engine: Its engine.
+    :type engine: fast.FastEngine
+    """
+    checkpoint = {"version": VERSION, "identity": Identity(system), "engine": engine.State(),
+                  "queues": system.QueueState, "monitors": system.MonitorHolder}
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def Load(path, system):
+    """Reads a checkpoint written by a system with the same arguments as :code:`system`.
+
+    :return: The checkpoint (a dict with the engine state, queue index and monitors).
+    """
+    with open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get("version") != VERSION:
+        raise ValueError(f"Unsupported checkpoint version {checkpoint.get('version')}.")
+    if checkpoint["identity"] != Identity(system):
+        raise ValueError("The checkpoint was written by a system with different arguments (or seed).")
+    return checkpoint
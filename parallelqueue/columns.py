@@ -0,0 +1,162 @@
+"""
+Array-backed storage for monitors. A `ColumnStore` writes rows into preallocated NumPy chunks (one array per
+column), so long traces are kept as a handful of arrays rather than as Python objects. Full chunks can be streamed
+to a Parquet file as the simulation runs (requires :code:`pyarrow`).
+"""
+import numpy as np
+
+CHUNK = 65536  # Rows per chunk.
+
+
+def Arrow():
+    """Imports :code:`pyarrow` (an optional dependency)."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Arrow/Parquet export requires pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+
+class ColumnStore:
+    """Growable columnar buffer.
+
+    :param columns: Dict from column names to NumPy dtypes.
+    :param chunk: Number of rows per chunk.
+
+    Example
+    -------
+    .. code-block:: python
+
+        store = ColumnStore({"time": float, "queue": np.int32, "size": np.int32})
+        store.Append(0.5, 3, 1)
+        store.Spill("trace.parquet")  # full chunks now go straight to disk
+        ...
+        store.to_parquet("trace.parquet")  # writes what is left and closes the file
+    """
+
+    def __init__(self, columns, chunk=CHUNK):
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self.chunk = chunk
+        self.chunks = []  # Full chunks still held in memory
+        self.current = self.NewChunk()
+        self.size = 0  # Rows used in the current chunk
+        self.spilled = 0  # Rows already written to disk
+        self.writer = None
+        self.path = None
+
+    def __getstate__(self):
+        if self.writer is not None:
+            raise TypeError("A ColumnStore spilling to Parquet cannot be pickled.")
+        state = dict(self.__dict__)
+        state["current"] = {name: column[:self.size].copy() for name, column in self.current.items()}  # Rows used
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        current = self.NewChunk()
+        for name, column in state["current"].items():
+            current[name][:self.size] = column
+        self.current = current
+
+    def NewChunk(self):
+        return {name: np.empty(self.chunk, dtype=dtype) for name, dtype in self.columns.items()}
+
+    def __len__(self):
+        return self.spilled + len(self.chunks) * self.chunk + self.size
+
+    def Append(self, *row):
+        """Writes one row (values in the order of the columns)."""
+        for column, value in zip(self.current.values(), row):
+            column[self.size] = value
+        self.size += 1
+        if self.size == self.chunk:
+            self.Rotate()
+
+    def Extend(self, *columns):
+        """Writes several rows given as one array (or scalar) per column."""
+        n = max(np.size(c) for c in columns)
+        start = 0
+        while start < n:
+            take = min(n - start, self.chunk - self.size)
+            for column, values in zip(self.current.values(), columns):
+                column[self.size:self.size + take] = values[start:start + take] if np.ndim(values) else values
+            self.size += take
+            start += take
+            if self.size == self.chunk:
+                self.Rotate()
+
+    def Rotate(self):
+        """Stores the (full) current chunk, writing it out if spilling, and starts a new one."""
+        if self.writer is not None:
+            self.Write(self.current)
+            self.spilled += self.chunk
+        else:
+            self.chunks.append(self.current)
+        self.current = self.NewChunk()
+        self.size = 0
+
+    def Chunks(self):
+        """The in-memory chunks (views; the last one trimmed to the rows used)."""
+        chunks = list(self.chunks)
+        if self.size:
+            chunks.append({name: column[:self.size] for name, column in self.current.items()})
+        return chunks
+
+    def Columns(self):
+        """Dict of in-memory columns. Views without copying if at most one chunk is in use."""
+        chunks = self.Chunks()
+        if len(chunks) == 1:
+            return chunks[0]
+        return {name: np.concatenate([c[name] for c in chunks]) if chunks else np.empty(0, dtype=dtype)
+                for name, dtype in self.columns.items()}
+
+    def DataFrame(self):
+        """The in-memory rows as a :code:`pandas.DataFrame`."""
+        import pandas as pd
+        return pd.DataFrame(self.Columns(), copy=False)
+
+    def Table(self):
+        """The in-memory rows as a :code:`pyarrow.Table`, whose chunks share memory with this store."""
+        pa = Arrow()
+        return pa.Table.from_batches([self.Batch(c) for c in self.Chunks()], schema=self.Schema())
+
+    def Schema(self):
+        pa = Arrow()
+        return pa.schema([(name, pa.from_numpy_dtype(dtype) if dtype != object else pa.string())
+                          for name, dtype in self.columns.items()])
+
+    def Batch(self, chunk):
+        pa = Arrow()
+        return pa.RecordBatch.from_arrays([pa.array(chunk[name]) for name in self.columns], schema=self.Schema())
+
+    def Write(self, chunk):
+        self.writer.write_batch(self.Batch(chunk))
+
+    def Spill(self, path):
+        """Streams every full chunk (including those already held) to the Parquet file at path from now on."""
+        pa = Arrow()
+        self.writer = pa.parquet.ParquetWriter(path, self.Schema())
+        self.path = path
+        for chunk in self.chunks:
+            self.Write(chunk)
+            self.spilled += self.chunk
+        self.chunks = []
+
+    def to_parquet(self, path):
+        """Writes the rows to a Parquet file. If already spilling to path, writes the rest and closes it. A store
+        spilling elsewhere raises a :code:`ValueError`, as the rows on disk would be missing from the file."""
+        if self.writer is not None and path != self.path:
+            raise ValueError(f"The rows are being spilled to {self.path}; finish the store there.")
+        if self.writer is None and self.spilled:
+            raise ValueError(f"The rows were spilled to {self.path}, which is already finished.")
+        if self.writer is not None:
+            if self.size:
+                self.Write({name: column[:self.size] for name, column in self.current.items()})
+            self.writer.close()
+            self.writer = None
+            self.spilled += self.size
+            self.current = self.NewChunk()
+            self.size = 0
+            return
+        Arrow().parquet.write_table(self.Table(), path)
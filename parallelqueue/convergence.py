@@ -0,0 +1,151 @@
+"""
+Early stopping of long runs (e.g. with :code:`infiniteJobs=True`) once the mean response time is known to a requested
+relative precision, rather than guessing :code:`maxTime` (see `base_models.ParallelQueueSystem.RunToPrecision`).
+
+Response times are kept as means of consecutive groups of 5 jobs. At each check, the warm-up period is detected by
+MSER-5 (the truncation point minimising the marginal standard error of what remains, searched over the first half of
+the run) and the rest is split into a fixed number of batches whose means give a Student-t confidence interval.
+
+References
+----------
+    A Comparison of Five Steady-State Truncation Heuristics for Simulation
+        K. Preston White, Jr., Michael J. Cobb, Stephen C. Spratt (2000)
+        https://doi.org/10.1109/WSC.2000.899806
+"""
+from statistics import NormalDist
+
+import numpy as np
+
+from parallelqueue.monitors import Monitor
+
+GROUP = 5  # Jobs per MSER group.
+
+
+def StudentT(p, df):
+    """Quantile of Student's t-distribution (Cornish-Fisher expansion about the normal; close for df ≥ 5)."""
+    z = NormalDist().inv_cdf(p)
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2) \
+        + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+
+
+def MSER(means):
+    """The MSER truncation point of a series of group means (an index into it), searched over its first half.
+
+    :param means: The group means, in order.
+    :type means: numpy.ndarray
+    """
+    m = len(means)
+    tail = means[::-1]
+    sums = np.cumsum(tail)[::-1]  # sums[j] = means[j:].sum()
+    squares = np.cumsum(tail ** 2)[::-1]
+    remaining = np.arange(m, 0, -1)
+    statistic = (squares - sums ** 2 / remaining) / remaining ** 2
+    return int(np.argmin(statistic[:max(1, m // 2)]))
+
+
+def BatchMeans(means, batches, confidence):
+    """Mean and confidence half-width from a number of batches (of whole groups, dropping the oldest leftovers)."""
+    size = len(means) // batches
+    batched = means[len(means) - size * batches:].reshape(batches, size).mean(axis=1)
+    mean = float(batched.mean())
+    return mean, StudentT(0.5 + confidence / 2, batches - 1) * float(batched.std(ddof=1)) / float(np.sqrt(batches))
+
+
+class Convergence(Monitor):
+    """Estimates the mean response time online and stops the system once the confidence interval's half-width is
+    within :code:`precision` of the mean (calling :code:`system.Stop()`).
+
+    :param precision: Relative half-width at which to stop.
+    :param confidence: Confidence level of the interval.
+    :param batches: Number of batches for batch means.
+    :param minimum: Fewest jobs (after warm-up) before stopping.
+    :param progress: :code:`True` to print a line every :code:`every` jobs, :code:`"tqdm"` for a progress bar in
+        simulated time (or jobs), or a function called with `Report` every :code:`every` jobs.
+    :param every: Jobs between progress reports.
+    """
+
+    def __init__(self, precision=0.05, confidence=0.95, batches=20, minimum=1000, progress=None, every=1000):
+        super().__init__()
+        self.precision = precision
+        self.confidence = confidence
+        self.batches = batches
+        self.minimum = minimum
+        self.progress = progress
+        self.every = every
+        self.means = []  # Means of each group of GROUP jobs
+        self.group = 0.0
+        self.jobs = 0
+        self.now = 0.0
+        self.next = max(minimum, GROUP * 2 * batches)  # Jobs at which to check next
+        self.warmup = 0
+        self.mean = self.halfwidth = np.nan
+        self.Converged = False
+        self.bar = None
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.group += now - arrive
+        self.jobs += 1
+        self.now = now
+        if self.jobs % GROUP == 0:
+            self.means.append(self.group / GROUP)
+            self.group = 0.0
+        if self.progress is not None and self.jobs % self.every == 0:
+            self.Progress(system)
+        if self.jobs >= self.next and not self.Converged:
+            self.next = int(self.jobs * 1.1) + GROUP  # Checks grow sparser, so the total cost stays linear
+            self.Check()
+            if self.Converged:
+                if self.progress is not None:
+                    self.Progress(system)
+                system.Stop()
+
+    def Check(self):
+        """Updates the estimate from the jobs seen so far."""
+        means = np.asarray(self.means)
+        truncation = MSER(means)
+        self.warmup = truncation * GROUP
+        kept = means[truncation:]
+        if len(kept) < 2 * self.batches or truncation >= len(means) // 2 - 1:
+            return  # Too few batches, or still warming up
+        self.mean, self.halfwidth = BatchMeans(kept, self.batches, self.confidence)
+        self.Converged = bool(len(kept) * GROUP >= self.minimum and self.halfwidth <= self.precision * abs(self.mean))
+
+    def Progress(self, system):
+        if callable(self.progress):
+            self.progress(self.Report())
+        elif self.progress == "tqdm":
+            if self.bar is None:
+                try:
+                    from tqdm import tqdm
+                except ImportError as e:
+                    raise ImportError("progress='tqdm' requires tqdm (pip install tqdm).") from e
+                total = system.maxTime if system.maxTime is not None else (system.Number or None)
+                self.bar = tqdm(total=total, unit="t" if system.maxTime is not None else "jobs")
+            done = self.now if system.maxTime is not None else self.jobs
+            self.bar.update(done - self.bar.n)
+            self.bar.set_postfix(mean=f"{self.mean:.4g}", halfwidth=f"{self.halfwidth:.3g}")
+        else:
+            time = f"{self.now:9.2f}" + (f" ({self.now / system.maxTime:4.0%})" if system.maxTime else "")
+            print(f"{time} {self.jobs:10d} jobs — mean {self.mean:.4f} ± {self.halfwidth:.4f}"
+                  f" (warm-up {self.warmup} jobs)")
+
+    def Close(self):
+        """Closes the progress bar, if any."""
+        if self.bar is not None:
+            self.bar.close()
+            self.bar = None
+
+    def Report(self):
+        """The estimate so far: jobs seen, warm-up discarded, mean and half-width (also relative), whether the
+        precision was reached and the simulated time."""
+        return {"jobs": self.jobs, "warmup": self.warmup, "mean": self.mean, "halfwidth": self.halfwidth,
+                "relative": self.halfwidth / abs(self.mean) if self.mean else np.nan, "converged": self.Converged,
+                "time": self.now}
+
+    @property
+    def Name(self):
+        return "Convergence"
+
+    @property
+    def Data(self):
+        return self.Report()
@@ -0,0 +1,511 @@
+"""
+Interarrival and service time distributions which draw their samples in NumPy blocks. A `Distribution` can be passed
+wherever a model expects :code:`Arrival` or :code:`Service` (its parameters are given upon construction, so
+:code:`AArgs`/:code:`SArgs` are ignored). When a simulation runs, each stream is bound to a generator of its own
+(see `Streams`): one for arrivals, one per server for service and one for routing, so that changing one part of a
+model (e.g. d or the service distribution) leaves the samples of the other streams as they were. With common random
+numbers, service times are instead drawn per job upon arrival (see `JobSizes` and `variance`).
+
+Example
+-------
+.. code-block:: python
+
+    sim = JSQd(maxTime=1000.0, parallelism=100, seed=1234, d=2,
+               Arrival=Exponential(50), AArgs=None,
+               Service=HyperExponential([0.9, 0.1], [2, 0.2]), SArgs=None)
+    sim.RunSim()
+"""
+import hashlib
+import random
+from functools import partial
+from itertools import repeat
+
+import numpy as np
+
+BLOCK = 4096  # Number of samples pre-drawn at once.
+MINBLOCK = 64  # Smallest block of a per-server stream.
+HALF = 2.0 ** -54  # Shifts the uniforms of a generator (multiples of 2 ** -53) to midpoints, symmetric about 1/2.
+
+
+class Block:
+    """Hands out the samples of :code:`draw()` one at a time, calling it again once its buffer is exhausted.
+    Any arguments of a call are ignored.
+
+    :param draw: A function returning a new block (array) of samples.
+    """
+
+    __slots__ = ("draw", "samples")
+
+    def __init__(self, draw):
+        self.draw = draw
+        self.samples = iter(())
+
+    def __call__(self, *args):
+        for value in self.samples:  # Cheaper than catching StopIteration
+            return value
+        self.samples = iter(self.draw().tolist())
+        return next(self.samples)
+
+    def Remaining(self):
+        """The samples not yet handed out (e.g. to checkpoint them)."""
+        remaining = list(self.samples)
+        self.samples = iter(remaining)
+        return remaining
+
+    def Refill(self, samples):
+        """Replaces the samples not yet handed out."""
+        self.samples = iter(samples)
+
+
+class Distribution:
+    """Base class of the block-sampled distributions. Subclasses implement `Draw` (and `Mean`).
+
+    Calling an unbound distribution draws from a generator of its own (seeded by the OS); models bind it to their
+    streams when run.
+
+    :param block: Number of samples drawn per block.
+    """
+
+    def __init__(self, block=BLOCK):
+        self.block = block
+        self.sampler = None
+
+    def Draw(self, rng, size):
+        """A NumPy array of :code:`size` samples from the generator :code:`rng`."""
+        raise NotImplementedError
+
+    @property
+    def Mean(self):
+        raise NotImplementedError
+
+    def Bind(self, rng, block=None):
+        """A `Block` sampler of this distribution drawing from :code:`rng`.
+
+        :param rng: The stream's generator.
+        :type rng: numpy.random.Generator
+        :param block: Number of samples per block, if not that of the distribution.
+        """
+        return Block(partial(self.Draw, rng, block or self.block))
+
+    def __call__(self, *args):
+        if self.sampler is None:
+            self.sampler = self.Bind(np.random.default_rng())
+        return self.sampler()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["sampler"] = None  # Pickle the distribution, not its samples.
+        return state
+
+    def __repr__(self):
+        parameters = ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items() if k not in ("block", "sampler"))
+        return f"{type(self).__name__}({parameters})"
+
+
+class Exponential(Distribution):
+    """Exponential distribution.
+
+    :param rate: Rate (as in :code:`random.expovariate`).
+    """
+
+    def __init__(self, rate, block=BLOCK):
+        super().__init__(block)
+        self.rate = rate
+
+    def Draw(self, rng, size):
+        return rng.exponential(1 / self.rate, size)
+
+    @property
+    def Mean(self):
+        return 1 / self.rate
+
+
+class Deterministic(Distribution):
+    """Constant times.
+
+    :param value: The time.
+    """
+
+    def __init__(self, value, block=BLOCK):
+        super().__init__(block)
+        self.value = value
+
+    def Draw(self, rng, size):
+        return np.full(size, float(self.value))
+
+    @property
+    def Mean(self):
+        return self.value
+
+
+class Erlang(Distribution):
+    """Erlang distribution; the sum of k exponential phases.
+
+    :param k: Number of phases.
+    :param rate: Rate of each phase (so that the mean is k / rate).
+    """
+
+    def __init__(self, k, rate, block=BLOCK):
+        super().__init__(block)
+        self.k = k
+        self.rate = rate
+
+    def Draw(self, rng, size):
+        return rng.gamma(self.k, 1 / self.rate, size)
+
+    @property
+    def Mean(self):
+        return self.k / self.rate
+
+
+class HyperExponential(Distribution):
+    """Mixture of exponential distributions.
+
+    :param probabilities: Probability of each branch.
+    :param rates: Rate of each branch.
+    """
+
+    def __init__(self, probabilities, rates, block=BLOCK):
+        super().__init__(block)
+        if len(probabilities) != len(rates):
+            raise ValueError("HyperExponential needs one rate per probability.")
+        self.probabilities = list(probabilities)
+        self.rates = list(rates)
+
+    def Draw(self, rng, size):
+        branches = rng.choice(len(self.rates), size=size, p=self.probabilities)
+        return rng.exponential(1.0, size) / np.asarray(self.rates, dtype=float)[branches]
+
+    @property
+    def Mean(self):
+        return sum(p / rate for p, rate in zip(self.probabilities, self.rates))
+
+
+class LogNormal(Distribution):
+    """Log-normal distribution.
+
+    :param mu: Mean of the underlying normal distribution.
+    :param sigma: Standard deviation of the underlying normal distribution.
+    """
+
+    def __init__(self, mu, sigma, block=BLOCK):
+        super().__init__(block)
+        self.mu = mu
+        self.sigma = sigma
+
+    def Draw(self, rng, size):
+        return rng.lognormal(self.mu, self.sigma, size)
+
+    @property
+    def Mean(self):
+        return float(np.exp(self.mu + self.sigma ** 2 / 2))
+
+
+class Pareto(Distribution):
+    """Pareto (type I) distribution, with :code:`P(X > x) = (scale / x) ** alpha` for x ≥ scale.
+
+    :param alpha: Shape (tail index).
+    :param scale: Minimum value.
+    """
+
+    def __init__(self, alpha, scale=1.0, block=BLOCK):
+        super().__init__(block)
+        self.alpha = alpha
+        self.scale = scale
+
+    def Draw(self, rng, size):
+        return self.scale * (1 + rng.pareto(self.alpha, size))
+
+    @property
+    def Mean(self):
+        return self.alpha * self.scale / (self.alpha - 1) if self.alpha > 1 else np.inf
+
+
+class Geometric(Distribution):
+    """Geometric distribution on 1, 2, ... (e.g. of batch sizes): the number of trials up to the first success.
+
+    :param mean: Mean, at least 1 (the inverse of the probability of success).
+    """
+
+    def __init__(self, mean, block=BLOCK):
+        super().__init__(block)
+        if mean < 1:
+            raise ValueError("The mean of a geometric distribution is at least 1.")
+        self.mean = mean
+
+    def Draw(self, rng, size):
+        return np.maximum(1.0, np.ceil(np.log(1.0 - rng.random(size)) / np.log1p(-1 / self.mean)))
+
+    @property
+    def Mean(self):
+        return self.mean
+
+
+class Empirical(Distribution):
+    """Resamples (uniformly, with replacement) a given set of observed times.
+
+    :param values: The observations.
+    """
+
+    def __init__(self, values, block=BLOCK):
+        super().__init__(block)
+        self.values = np.asarray(values, dtype=float)
+        if not len(self.values):
+            raise ValueError("Empirical needs at least one value.")
+
+    def Draw(self, rng, size):
+        return self.values[rng.integers(0, len(self.values), size)]
+
+    @property
+    def Mean(self):
+        return float(self.values.mean())
+
+    def __repr__(self):
+        digest = hashlib.sha256(self.values.tobytes()).hexdigest()[:16]  # Tells apart samples (e.g. for sweep caches)
+        return f"Empirical(values=<{len(self.values)} values {digest}>)"
+
+
+class Function(Distribution):
+    """Buffers a distribution given the way `base_models` otherwise expects it, as :code:`func(args)`. The function
+    is called in Python (e.g. under the seed of the `random` module); only the buffering is shared with NumPy types.
+
+    :param func: Distribution function, e.g. :code:`random.paretovariate`.
+    :param args: Parameters needed by the function.
+    """
+
+    def __init__(self, func, args, block=BLOCK):
+        super().__init__(block)
+        self.func = func
+        self.args = args
+
+    def Draw(self, rng, size):
+        return np.fromiter((self.func(self.args) for _ in range(size)), dtype=float, count=size)
+
+
+def Sampler(func, args):
+    """The `Distribution` for a distribution given the way `base_models` expects it (i.e., :code:`func(args)`). The
+    exponential distribution of the `random` module is drawn by NumPy; any other function is evaluated in Python
+    (under the `random` seed) and merely buffered.
+
+    :param func: Distribution function, e.g. :code:`random.expovariate`, or a `Distribution` (returned as it is,
+        as are samplers already bound, e.g. a replayed trace, see `traces`).
+    :param args: Parameters needed by the function.
+    """
+    if isinstance(func, (Distribution, Block, JobSizes)):
+        return func
+    if getattr(func, "__func__", None) is random.Random.expovariate:
+        return Exponential(args)
+    return Function(func, args)
+
+
+class Inversion:
+    """Stands in for a :code:`numpy.random.Generator`, drawing the variates used by the distributions above by
+    inversion of uniforms (and normal variates as they are), so that an antithetic copy, drawing from :code:`1 - U`
+    (and :code:`-Z`), is negatively correlated with the original.
+
+    :param rng: The stream's generator.
+    :type rng: numpy.random.Generator
+    :param antithetic: Whether to mirror the uniforms (and normal variates).
+    """
+
+    def __init__(self, rng, antithetic=False):
+        self.rng = rng
+        self.antithetic = antithetic
+
+    @property
+    def bit_generator(self):
+        return self.rng.bit_generator
+
+    def random(self, size=None):
+        u = self.rng.random(size) + HALF
+        return 1.0 - u if self.antithetic else u
+
+    def standard_normal(self, size=None):
+        z = self.rng.standard_normal(size)
+        return -z if self.antithetic else z
+
+    def exponential(self, scale=1.0, size=None):
+        return -scale * np.log(self.random(size))
+
+    def gamma(self, shape, scale=1.0, size=None):
+        if shape != int(shape):
+            raise ValueError("Only integer shapes (Erlang) can be drawn by inversion.")
+        return -scale * np.log(self.random((int(shape), size))).sum(axis=0)
+
+    def pareto(self, a, size=None):
+        return self.random(size) ** (-1 / a) - 1
+
+    def lognormal(self, mean=0.0, sigma=1.0, size=None):
+        return np.exp(mean + sigma * self.standard_normal(size))
+
+    def integers(self, low, high=None, size=None):
+        low, high = (0, low) if high is None else (low, high)
+        return low + (self.random(size) * (high - low)).astype(np.int64)
+
+    def choice(self, a, size=None, p=None):
+        n = a if isinstance(a, int) else len(a)
+        cumulative = np.cumsum(p) if p is not None else np.arange(1, n + 1) / n
+        index = np.minimum(np.searchsorted(cumulative, self.random(size) * cumulative[-1], side="right"), n - 1)
+        return index if isinstance(a, int) else np.asarray(a)[index]
+
+
+class PerServer:
+    """A distribution bound separately to the stream of each server. Called directly (e.g. by a custom network
+    unaware of servers), it draws from the first server's stream.
+
+    :param distribution: The service distribution.
+    :type distribution: Distribution
+    :param rngs: One generator per server.
+    """
+
+    def __init__(self, distribution, rngs):
+        block = max(MINBLOCK, distribution.block // max(1, len(rngs)))
+        self.distribution = distribution
+        self.Servers = [distribution.Bind(rng, block) for rng in rngs]
+
+    def __call__(self, *args):
+        return self.Servers[0]()
+
+
+class JobSizes:
+    """A service distribution bound to streams of job sizes, for common random numbers: each arriving job draws one
+    size from each of the streams (whether or not it has that many replicas) and its k-th replica is served for the
+    k-th. Job n then has the same size (of its first replica) under every policy, wherever it is routed.
+
+    Sizes are kept from arrival until the job departs (see `on_departure`; the system subscribes it to its events).
+
+    :param distribution: The service distribution.
+    :type distribution: Distribution
+    :param rngs: One generator per replica.
+    """
+
+    def __init__(self, distribution, rngs):
+        self.distribution = distribution
+        self.Streams = [distribution.Bind(rng) for rng in rngs]
+        self.rows = {}
+
+    def Assign(self, name, choices):
+        """Draws the sizes of an arriving job, the k-th for its replica at :code:`choices[k]`."""
+        self.rows[name] = dict(zip(choices, [stream() for stream in self.Streams]))
+
+    def Size(self, name, queue):
+        """The size of the replica of job :code:`name` at :code:`queue`."""
+        return self.rows[name][queue]
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.rows.pop(job, None)
+
+    def __call__(self, *args):
+        return self.Streams[0]()
+
+
+class Streams:
+    """Independent generators for one run, spawned from :code:`numpy.random.SeedSequence(seed)` in the order
+    arrivals, service (then one child per server), routing, job sizes (one child per replica, with common random
+    numbers) and batch sizes.
+
+    :param seed: Seed of the run.
+    :param parallelism: Number of servers.
+    :param crn: Whether service times are drawn per job (see `JobSizes`), with every distribution drawn by inversion
+        (see `Inversion`) and :code:`random.expovariate` drawn from these streams as `Exponential`.
+    :param antithetic: Whether the distributions draw from mirrored uniforms (requires :code:`crn`).
+    """
+
+    def __init__(self, seed, parallelism, crn=False, antithetic=False):
+        if antithetic and not crn:
+            raise ValueError("Antithetic streams require common random numbers (crn=True).")
+        arrival, service, routing, sizes, batches = np.random.SeedSequence(seed).spawn(5)  # Each as if spawned alone
+        self.Arrival = np.random.default_rng(arrival)
+        self.Routing = np.random.default_rng(routing)
+        self.Batch = np.random.default_rng(batches)
+        self.service = service
+        self.sizes = sizes
+        self.parallelism = parallelism
+        self.crn = crn
+        self.antithetic = antithetic
+        self.servers = None
+        self.Sizes = []
+
+    @property
+    def Service(self):
+        """One generator per server (spawned on first use)."""
+        if self.servers is None:
+            self.servers = [np.random.default_rng(s) for s in self.service.spawn(self.parallelism)]
+        return self.servers
+
+    def Source(self, rng):
+        """What distributions draw from: the generator itself or, with common random numbers, its `Inversion`."""
+        return Inversion(rng, self.antithetic) if self.crn else rng
+
+    def State(self):
+        """The states of the generators (see :code:`numpy.random.BitGenerator.state`)."""
+        return {"Arrival": self.Arrival.bit_generator.state, "Routing": self.Routing.bit_generator.state,
+                "Batch": self.Batch.bit_generator.state, "Service": [rng.bit_generator.state for rng in self.Service],
+                "Sizes": [rng.bit_generator.state for rng in self.Sizes]}
+
+    def Restore(self, state):
+        """Sets the generators to a state returned by `State`."""
+        self.Arrival.bit_generator.state = state["Arrival"]
+        self.Routing.bit_generator.state = state["Routing"]
+        self.Batch.bit_generator.state = state["Batch"]
+        for rng, s in zip(self.Service, state["Service"]):
+            rng.bit_generator.state = s
+        for rng, s in zip(self.Sizes, state["Sizes"]):
+            rng.bit_generator.state = s
+
+    def Bind(self, kwargs, replicas=1):
+        """The model arguments with :code:`Arrival` and :code:`Service` bound to these streams, if distributions.
+
+        :param kwargs: The model arguments.
+        :param replicas: With common random numbers, the number of job sizes drawn per arrival (i.e., d for models
+            with replicas, else 1).
+        """
+        kwargs = dict(kwargs)
+        if self.crn:
+            for name, args in (("Arrival", "AArgs"), ("Service", "SArgs")):
+                kwargs[name] = Sampler(kwargs[name], kwargs.get(args))
+        if isinstance(kwargs.get("Arrival"), Distribution):
+            kwargs["Arrival"] = kwargs["Arrival"].Bind(self.Source(self.Arrival))
+        if isinstance(kwargs.get("Service"), Distribution):
+            if self.crn:
+                self.Sizes = [np.random.default_rng(s) for s in self.sizes.spawn(replicas)]
+                kwargs["Service"] = JobSizes(kwargs["Service"], [self.Source(rng) for rng in self.Sizes])
+            else:
+                kwargs["Service"] = PerServer(kwargs["Service"], self.Service)
+        return kwargs
+
+    def Batches(self, batch):
+        """A sampler of batch sizes: the size itself, if fixed, or else sizes drawn from a distribution (see
+        `BatchSizes`), bound to the stream of batch sizes.
+
+        :param batch: A number of jobs, or a `Distribution` of it.
+        """
+        if isinstance(batch, Distribution):
+            return Block(partial(BatchSizes, batch.Bind(self.Source(self.Batch)).draw))
+        return partial(next, repeat(batch))
+
+
+def BatchSizes(draw):
+    """A block of batch sizes, as integers, from a block of :code:`draw()`, which must be positive integers."""
+    sizes = draw()
+    if (sizes < 1).any() or (sizes != np.floor(sizes)).any():
+        raise ValueError("Batch sizes must be positive integers.")
+    return sizes.astype(np.int64)
+
+
+def ServiceTime(kwargs, queue, name=None):
+    """Draws a service time at a queue, from that server's stream if service is bound per server (or the size of job
+    :code:`name` there, with common random numbers)."""
+    service = kwargs["Service"]
+    if isinstance(service, PerServer):
+        return service.Servers[queue]()
+    if isinstance(service, JobSizes):
+        return service.Size(name, queue)
+    return service(kwargs["SArgs"])
+
+
+def DrawSizes(kwargs, name, choices):
+    """With common random numbers, draws the sizes of an arriving job routed to :code:`choices` (see `JobSizes`)."""
+    service = kwargs["Service"]
+    if isinstance(service, JobSizes):
+        service.Assign(name, choices)
@@ -0,0 +1,92 @@
+"""
+Event hooks through which models report to monitors. Rather than handing every monitor the whole frame of each
+process (via :code:`locals()`), routers and jobs call the hooks subscribed to the event at hand, with a few typed
+arguments each:
+
+- :code:`on_arrival(system, now, job)`
+- :code:`on_route(system, now, job, choices)`
+- :code:`on_service_start(system, now, job, queue, arrive)`
+- :code:`on_departure(system, now, job, queue, arrive, start)`
+- :code:`on_cancel(system, now, job, queue)`
+
+Arrival, route, departure and cancel hooks are called before the system state changes at that time. A monitor is
+only subscribed to the hooks it overrides, so an event nobody watches costs an empty loop.
+"""
+from parallelqueue.jobs import JobName
+from parallelqueue.monitors import Monitor
+
+HOOKS = ("on_arrival", "on_route", "on_service_start", "on_departure", "on_cancel")
+
+
+class EventBus:
+    """Lists of subscribed hooks, one per event (e.g. :code:`bus.on_departure`).
+
+    :param listeners: Monitors (or any objects overriding hooks of `monitors.Monitor`) to subscribe.
+    """
+
+    def __init__(self, listeners=()):
+        for hook in HOOKS:
+            setattr(self, hook, [])
+        for listener in listeners:
+            self.Subscribe(listener)
+
+    def Subscribe(self, listener):
+        """Subscribes the hooks a listener overrides; a monitor overriding only `Add` is wrapped in `LegacyAdapter`."""
+        hooks = [hook for hook in HOOKS if Overrides(listener, hook)]
+        if not hooks and Overrides(listener, "Add"):
+            listener = LegacyAdapter(listener)
+            hooks = LegacyAdapter.Hooks
+        for hook in hooks:
+            getattr(self, hook).append(getattr(listener, hook))
+
+    def Unsubscribe(self, listener):
+        """Removes every hook of a listener (or of the `LegacyAdapter` wrapping it)."""
+        for hook in HOOKS:
+            hooks = getattr(self, hook)
+            hooks[:] = [h for h in hooks if Owner(h) is not listener]
+
+    def __bool__(self):
+        return any(getattr(self, hook) for hook in HOOKS)
+
+
+def Overrides(listener, hook):
+    """Whether a listener provides its own version of a hook of `monitors.Monitor`."""
+    method = getattr(type(listener), hook, None)
+    return method is not None and method is not getattr(Monitor, hook, None)
+
+
+def Owner(hook):
+    """The listener whose hook this is (the monitor, for hooks of a `LegacyAdapter`)."""
+    listener = getattr(hook, "__self__", None)
+    return getattr(listener, "monitor", listener) if isinstance(listener, LegacyAdapter) else listener
+
+
+class LegacyAdapter:
+    """Feeds the events a monitor's `Add` used to see (arrival, route and departure) to it, as dicts with the inputs
+    it used to receive: :code:`env` (exposing :code:`now`), :code:`system`, :code:`queues`, :code:`name` (as printed,
+    see `jobs.JobName`) and :code:`arrive`; then :code:`choices` once routed, or :code:`choice`, :code:`wait`,
+    :code:`tib` and :code:`finish` when leaving.
+
+    :param monitor: Monitor overriding `Add`.
+    """
+
+    Hooks = ("on_arrival", "on_route", "on_departure")
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.now = 0.0
+
+    def Inputs(self, system, now, job, arrive, **inputs):
+        self.now = now
+        return {"env": self, "system": system, "queues": system.Queues, "name": JobName(job), "arrive": arrive,
+                **inputs}
+
+    def on_arrival(self, system, now, job):
+        self.monitor.Add(self.Inputs(system, now, job, now))
+
+    def on_route(self, system, now, job, choices):
+        self.monitor.Add(self.Inputs(system, now, job, now, choices=choices))
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.monitor.Add(self.Inputs(system, now, job, arrive, choice=queue, wait=start - arrive, tib=now - start,
+                                     finish=now - arrive))
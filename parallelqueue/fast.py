@@ -0,0 +1,335 @@
+"""
+An array-based alternative to the SimPy engine for the models built by `base_models`. Instead of one generator per
+job (and per replica), each FCFS single-server queue is reduced to plain per-server state (jobs in system, next-free
+time and remaining work) while time is moved forward with a heap of departure events. Interarrival times, service
+times and routing samples are pre-drawn in NumPy blocks (see `distributions`).
+
+Note
+----
+The fast engine covers the JSQ(d), Redundancy-d and Threshold-(d,r) models of the default `network.Network`. It draws
+from NumPy generators rather than the `random` module, so a given seed reproduces its own results exactly but does not
+retrace the sample path of the SimPy engine; the two agree in distribution. With common random numbers
+(:code:`crn=True`, see `variance`), both engines draw from the same streams in the same order and do retrace it.
+"""
+import heapq
+import random
+from collections import deque
+from functools import partial
+from warnings import warn
+
+import numpy as np
+
+from parallelqueue.checkpoint import Save
+from parallelqueue.distributions import BLOCK, Block, JobSizes, Sampler, Streams
+from parallelqueue.traces import Open
+
+
+def DrawChoices(rng, parallelism, d, size=BLOCK):
+    """A block of :code:`size` rows, each holding d distinct queues sampled uniformly from :code:`parallelism`."""
+    if 4 * d > parallelism:  # Dense case; permute directly.
+        return np.argsort(rng.random((size, parallelism)), axis=1)[:, :d]
+    choices = rng.integers(0, parallelism, size=(size, d))
+    if d > 1:
+        ordered = np.sort(choices, axis=1)
+        for row in np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1)):
+            choices[row] = rng.choice(parallelism, d, replace=False)
+    return choices
+
+
+class QueueView:
+    """Stand-in for a :code:`simpy.Resource` exposing the sizes which monitors read (:code:`put_queue`, :code:`users`).
+
+    :param engine: Engine holding the state.
+    :type engine: FastEngine
+    :param queue: The queue being viewed.
+    :type queue: int
+    """
+
+    __slots__ = ("engine", "queue")
+
+    def __init__(self, engine, queue):
+        self.engine = engine
+        self.queue = queue
+
+    @property
+    def users(self):
+        return range(self.engine.state.Busy[self.queue])
+
+    @property
+    def put_queue(self):
+        state = self.engine.state
+        return range(state.InSystem[self.queue] - state.Busy[self.queue])
+
+
+class FastEngine:
+    """Runs a `base_models.ParallelQueueSystem` without SimPy, reporting to the same hooks of :code:`system.Events`
+    as `network.Network` would. The engine itself plays the part of :code:`env` (i.e., exposes :code:`now`).
+
+    All of its state is plain data held as attributes, so a run can be checkpointed between events and resumed
+    (see `checkpoint`).
+
+    :param system: System providing the model parameters.
+    :type system: base_models.ParallelQueueSystem
+    """
+
+    def __init__(self, system):
+        self.system = system
+        self.now = 0.0
+        self.stopped = False
+        parallelism = system.parallelism
+        self.state = system.QueueState
+        system.Queues = {i: QueueView(self, i) for i in range(parallelism)}
+        if system.doPrint:
+            warn("\n The fast engine does not print individual events.")
+
+        random.seed(system.seed)  # For any distribution not drawn by NumPy.
+        self.streams = streams = Streams(system.seed, parallelism, system.crn, system.antithetic)
+        kwargs = Open(system.kwargs)  # A trace is replayed as it is
+        kwargs = streams.Bind({"Arrival": Sampler(kwargs["Arrival"], kwargs["AArgs"]),
+                               "Service": Sampler(kwargs["Service"], kwargs["SArgs"])},
+                              system.d if system.ReplicaDict is not None else 1)
+        self.Arrival = kwargs["Arrival"]
+        service = kwargs["Service"]
+        self.Sizes = service if isinstance(service, JobSizes) else None  # Sizes per job (with CRN or a trace)
+        self.Service = service.Streams if self.Sizes is not None else service.Servers  # One sampler per server
+        self.Choices = Block(partial(DrawChoices, streams.Routing, parallelism, system.d))
+        self.Uniform = Block(partial(streams.Routing.random, BLOCK))
+        self.Batches = system.Batches = streams.Batches(system.batch)
+
+        self.number, self.arrive = 1, 0.0  # The next arrival
+        self.left = 0  # Jobs left in the batch arriving at self.arrive, once its size is drawn
+        self.departures = []  # Heap of departures
+        self.starts = []  # JSQ(d): heap of service starts (if subscribed to)
+        self.free = [0.0] * parallelism  # JSQ(d): next-free time of each server
+        self.waiting = [deque() for _ in range(parallelism)]  # Redundancy: replicas waiting at each server
+        self.serving = [0] * parallelism  # Redundancy: job in service at each server; 0 if idle
+        self.jobs = {}  # Redundancy: number -> (arrive, choices) for each job with replicas in system
+        self.sequence = 0  # Redundancy: tie-breaker of departures
+        self.checkpoint = None  # Path of the checkpoint file, if any
+        self.every = None  # Simulated time between checkpoints
+        self.due = float("inf")  # Time of the next checkpoint
+
+    def Arrivals(self):
+        """Yields the (integer) name and arrival time of each job to be generated before the end of the simulation.
+        Checkpoints are written here, before a job is processed."""
+        system = self.system
+        until = system.maxTime if system.maxTime is not None else float("inf")
+        while (system.infiniteJobs or self.number <= system.Number) and self.arrive < until and not self.stopped:
+            if self.arrive >= self.due:
+                self.due = (self.arrive // self.every + 1) * self.every
+                Save(self.checkpoint, system, self)
+            if not self.left:
+                self.left = system.BatchSize = self.Batches()
+            yield self.number, self.arrive
+            self.left -= 1
+            if not self.left:
+                self.arrive += self.Arrival()
+            self.number += 1
+
+    def Sample(self):
+        """The queues parsed by the router for an arriving job."""
+        if self.system.d == self.system.parallelism:
+            return range(self.system.parallelism)
+        return self.Choices()
+
+    def Stop(self):
+        """Stops the simulation at the current time (after the event being processed)."""
+        self.stopped = True
+
+    def Checkpoints(self, path, every):
+        """Writes a checkpoint to path each time the simulation crosses a multiple of :code:`every`."""
+        self.checkpoint, self.every = path, every
+        self.due = (self.arrive // every + 1) * every
+
+    def Samplers(self):
+        samplers = {"Arrival": (self.Arrival, float), "Uniform": (self.Uniform, float),
+                    "Choices": (self.Choices, np.min_scalar_type(self.system.parallelism))}
+        if isinstance(self.Batches, Block):
+            samplers["Batches"] = (self.Batches, np.int64)
+        return samplers
+
+    def State(self):
+        """The state of the engine between events, as plain data."""
+        return {"now": self.now, "number": self.number, "arrive": self.arrive, "left": self.left,
+                "departures": self.departures, "starts": self.starts, "free": self.free,
+                "waiting": [list(w) for w in self.waiting], "serving": self.serving, "jobs": self.jobs,
+                "sequence": self.sequence,
+                "samples": {name: np.asarray(block.Remaining(), dtype=dtype)
+                            for name, (block, dtype) in self.Samplers().items()},
+                "service": [np.asarray(block.Remaining()) for block in self.Service], "streams": self.streams.State(),
+                "sizes": self.Sizes.rows if self.Sizes is not None else None, "random": random.getstate()}
+
+    def Restore(self, state):
+        """Continues from a state returned by `State` (of an engine with the same parameters)."""
+        for name in ("now", "number", "arrive", "left", "departures", "starts", "free", "serving", "jobs", "sequence"):
+            setattr(self, name, state[name])
+        self.waiting = [deque(w) for w in state["waiting"]]
+        for name, (block, _) in self.Samplers().items():
+            block.Refill(state["samples"][name].tolist())
+        for block, samples in zip(self.Service, state["service"]):
+            block.Refill(samples.tolist())
+        self.streams.Restore(state["streams"])
+        if self.Sizes is not None:
+            self.Sizes.rows = state["sizes"]
+        random.setstate(state["random"])
+
+    def Run(self):
+        """Runs the simulation (or continues it, if restored)."""
+        if self.system.ReplicaDict is not None:
+            self.RunRedundancy()
+        else:
+            self.RunJSQ()
+
+    def RunJSQ(self):
+        """JSQ(d): every job joins the shortest of its d sampled queues. As service is FCFS, a job's departure
+        is fixed upon arrival by the next-free time of its queue. Service starts only become events (on a heap of
+        their own) if a monitor subscribes to them."""
+        system = self.system
+        events = system.Events
+        state = self.state
+        InSystem = state.InSystem
+        free, departures, starts = self.free, self.departures, self.starts
+        crn = self.Sizes is not None
+        speeds = system.speeds
+        Uniform = self.Uniform
+        for number, arrive in self.Arrivals():
+            self.Advance(departures, starts, arrive)
+            self.now = arrive
+            for hook in events.on_arrival:
+                hook(system, arrive, number)
+            u = Uniform() if crn else None  # Common random numbers: one uniform per arrival, needed or not
+            if state.Buckets is not None:  # JSQ over all queues
+                shortest = state.Buckets.Shortest
+                choice = shortest[int((u if crn else Uniform()) * len(shortest))] if len(shortest) > 1 else shortest[0]
+                choices = [choice]
+            else:
+                sampled = self.Sample()
+                least = min(InSystem[i] for i in sampled)
+                choices = [i for i in sampled if InSystem[i] == least]
+                choice = choices[int((u if crn else Uniform()) * len(choices))] if len(choices) > 1 else choices[0]
+            for hook in events.on_route:
+                hook(system, arrive, number, choices)
+            start = free[choice] if free[choice] > arrive else arrive
+            size = self.Service[0]() if crn else self.Service[choice]()  # The job's size, with CRN
+            free[choice] = start + (size if speeds is None else size / speeds[choice])
+            state.Enqueue(choice)
+            if start == arrive:
+                state.Start(choice)
+                for hook in events.on_service_start:
+                    hook(system, arrive, number, choice, arrive)
+            elif events.on_service_start:
+                heapq.heappush(starts, (start, number, choice, arrive))
+            heapq.heappush(departures, (free[choice], number, choice, arrive, start))
+        until = system.maxTime if system.maxTime is not None else float("inf")
+        self.Advance(departures, starts, self.now if self.stopped else until, False)
+
+    def Advance(self, departures, starts, until, inclusive=True):
+        """Processes the JSQ(d) departures (and service starts) up to the given time."""
+        system = self.system
+        events = system.Events
+        state = self.state
+        while departures and not self.stopped:
+            if starts and starts[0][0] < departures[0][0]:  # At equal times, the departure frees the server first
+                start, number, choice, arrive = heapq.heappop(starts)
+                for hook in events.on_service_start:
+                    hook(system, start, number, choice, arrive)
+                continue
+            finish = departures[0][0]
+            if finish > until or (finish == until and not inclusive):
+                return
+            finish, number, choice, arrive, start = heapq.heappop(departures)
+            self.now = finish
+            for hook in events.on_departure:
+                hook(system, finish, number, choice, arrive, start)
+            state.Leave(choice)
+            if state.InSystem[choice]:
+                state.Start(choice)  # FCFS; the next job begins service
+
+    def StartNext(self, queue):
+        """Redundancy: the server is free; begins the next replica which is still needed. Under the cancel-on-start
+        policy, the other replicas of the job are cancelled (and left to be skipped in their queues)."""
+        line = self.waiting[queue]
+        jobs = self.jobs
+        while line:
+            number = line.popleft()
+            if number in jobs and queue in jobs[number][1]:
+                arrive, choices = jobs[number]
+                self.serving[queue] = number
+                self.state.Start(queue)
+                for hook in self.system.Events.on_service_start:
+                    hook(self.system, self.now, number, queue, arrive)
+                if self.system.cancel == "start" and len(choices) > 1:
+                    jobs[number] = (arrive, [queue])
+                    for other in choices:
+                        if other != queue:
+                            for hook in self.system.Events.on_cancel:
+                                hook(self.system, self.now, number, other)
+                            self.state.Leave(other, False)
+                self.sequence += 1
+                size = self.Sizes.Size(number, queue) if self.Sizes is not None else self.Service[queue]()
+                finish = self.now + (size if self.system.speeds is None else size / self.system.speeds[queue])
+                heapq.heappush(self.departures, (finish, self.sequence, queue, number, self.now))
+                return
+        self.serving[queue] = 0
+
+    def RunRedundancy(self):
+        """Redundancy-d and Threshold-(d,r): replicas join the sampled queues (with fewer than r jobs) and every
+        replica is cancelled once one of them completes service (or begins it, with :code:`cancel="start"`).
+        Cancelled replicas still waiting are skipped lazily upon reaching the front of their queue."""
+        system = self.system
+        events = system.Events
+        state = self.state
+        InSystem = state.InSystem
+        until = system.maxTime if system.maxTime is not None else float("inf")
+        waiting, serving, jobs, departures = self.waiting, self.serving, self.jobs, self.departures
+        Start = self.StartNext
+        crn = self.Sizes is not None
+
+        arrivals = self.Arrivals()
+        arrival = next(arrivals, None)
+        while (arrival is not None or departures) and not self.stopped:
+            if departures and (arrival is None or departures[0][0] <= arrival[1]):
+                finish, _, choice, number, start = heapq.heappop(departures)
+                if serving[choice] != number:
+                    continue  # replica was cancelled while in service
+                if finish >= until:
+                    break
+                self.now = finish
+                arrive, choices = jobs.pop(number)
+                if crn:
+                    del self.Sizes.rows[number]
+                for hook in events.on_departure:
+                    hook(system, finish, number, choice, arrive, start)
+                for queue in choices:
+                    served = serving[queue] == number
+                    if queue != choice:
+                        for hook in events.on_cancel:
+                            hook(system, finish, number, queue)
+                    state.Leave(queue, served)
+                    if served:
+                        Start(queue)
+            else:
+                number, arrive = arrival
+                self.now = arrive
+                for hook in events.on_arrival:
+                    hook(system, arrive, number)
+                u = self.Uniform() if crn else None  # Common random numbers: one uniform per arrival, needed or not
+                sampled = self.Sample()
+                if system.r:
+                    choices = [i for i in sampled if InSystem[i] <= system.r]
+                else:
+                    choices = list(sampled)
+                if len(choices) < 1:
+                    choices = [sampled[int((u if crn else self.Uniform()) * len(sampled))]]  # random choice
+                for hook in events.on_route:
+                    hook(system, arrive, number, choices)
+                jobs[number] = (arrive, choices)
+                if crn:
+                    self.Sizes.Assign(number, choices)
+                for queue in choices:
+                    state.Enqueue(queue)
+                    waiting[queue].append(number)
+                for queue in choices:  # Every replica is queued before any starts (and may cancel the others)
+                    if not serving[queue]:
+                        Start(queue)
+                arrival = next(arrivals, None)
@@ -0,0 +1,181 @@
+"""
+Opt-in instrumentation of simulation runs (:code:`ParallelQueueSystem(..., instrument=True)`). An instrumented
+system counts events per type, times the wall-clock spent in the processes of its `network.Network` (Arrivals,
+Router and Job) and in each monitor's hooks, samples the length of the SimPy event queue and reports the
+simulated-time to wall-time throughput of the run. Nothing is wrapped unless instrumentation is turned on.
+
+Example
+-------
+.. code-block:: python
+
+    sim = JSQd(maxTime=1000.0, parallelism=100, seed=1234, d=2,
+               Arrival=random.expovariate, AArgs=50,
+               Service=random.expovariate, SArgs=1, instrument=True)
+    sim.RunSim()
+    sim.Instrumentation.Report()
+
+Note
+----
+Process times are inclusive: a Router step also counts the monitor hooks it calls. SimPy scheduling is what remains
+of the wall time once processes are subtracted.
+"""
+from inspect import isgenerator
+from time import perf_counter
+
+from parallelqueue.events import HOOKS, Owner
+
+EVENTS = {"on_arrival": "arrival", "on_route": "route", "on_service_start": "service_start",
+          "on_departure": "departure", "on_cancel": "cancel"}
+
+
+class Timer:
+    """Accumulated wall time and number of timed calls (or process steps)."""
+
+    __slots__ = ("seconds", "calls")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+
+    def Add(self, seconds):
+        self.seconds += seconds
+        self.calls += 1
+
+    def Report(self):
+        return {"seconds": self.seconds, "calls": self.calls}
+
+
+def Timed(generator, timer, sample=None):
+    """Runs a process (generator), adding the wall time of each of its steps to a timer. Interrupts and other
+    exceptions thrown into the process are passed on to the generator.
+
+    :param generator: The process.
+    :param timer: Where to add the time of each step.
+    :type timer: Timer
+    :param sample: Called (untimed) before each step, if given.
+    """
+    step, value = generator.send, None
+    while True:
+        if sample is not None:
+            sample()
+        start = perf_counter()
+        try:
+            event = step(value)
+        except StopIteration as stop:
+            timer.Add(perf_counter() - start)
+            return stop.value
+        except BaseException:
+            timer.Add(perf_counter() - start)
+            raise
+        timer.Add(perf_counter() - start)
+        try:
+            value = yield event
+            step = generator.send
+        except BaseException as e:  # e.g. simpy.Interrupt
+            step, value = generator.throw, e
+
+
+def TimedHook(hook, timer):
+    """A monitor hook which adds its wall time to a timer."""
+
+    def timed(*args):
+        start = perf_counter()
+        hook(*args)
+        timer.Add(perf_counter() - start)
+
+    return timed
+
+
+class Instrumentation:
+    """Counters and timers of an instrumented system, filled in as it runs.
+
+    Attributes
+    ----------
+    Events : dict
+        Number of events of each type (arrival, route, service_start, departure, cancel).
+    Network : dict
+        `Timer` of each process type of the network (Arrivals, Router, Job).
+    Monitors : dict
+        `Timer` of each monitor, over all of its hooks.
+    """
+
+    def __init__(self):
+        self.Events = {name: 0 for name in EVENTS.values()}
+        self.Network = {name: Timer() for name in ("Arrivals", "Router", "Job")}
+        self.Monitors = {}
+        self.queue = []  # Sampled lengths of the SimPy event queue
+        self.env = None
+        self.wall = 0.0
+        self.start = None
+        self.simulated = 0.0
+
+    def Wrap(self, bus):
+        """Times the hooks subscribed to an `events.EventBus` and subscribes counters of each event (in place)."""
+        for hook in HOOKS:
+            hooks = getattr(bus, hook)
+            for i, subscribed in enumerate(hooks):
+                listener = Owner(subscribed)
+                name = getattr(listener, "Name", type(listener).__name__)
+                hooks[i] = TimedHook(subscribed, self.Monitors.setdefault(name, Timer()))
+            hooks.append(self.Counter(EVENTS[hook]))
+
+    def Counter(self, event):
+        events = self.Events
+
+        def count(*args):
+            events[event] += 1
+
+        return count
+
+    def Attach(self, network, env):
+        """Times the processes (or plain calls) of a network instance, sampling the event queue of :code:`env` at
+        each arrival."""
+        self.env = env
+        timers = self.Network
+
+        def Wrapped(method, name, sample=None):
+            def wrapped(*args, **kwargs):
+                start = perf_counter()
+                result = method(*args, **kwargs)
+                if isgenerator(result):  # A process; its steps are timed as it runs
+                    return Timed(result, timers[name], sample)
+                timers[name].Add(perf_counter() - start)  # A plain call (e.g. of a network.LazyNetwork)
+                return result
+
+            return wrapped
+
+        network.Job = Wrapped(network.Job, "Job")
+        network.Router = Wrapped(network.Router, "Router")
+        network.Arrivals = Wrapped(network.Arrivals, "Arrivals", self.Sample)
+
+    def Sample(self):
+        self.queue.append(len(self.env._queue))
+
+    def Start(self):
+        """Resets the counters and starts the wall clock."""
+        for event in self.Events:
+            self.Events[event] = 0
+        for timer in [*self.Network.values(), *self.Monitors.values()]:
+            timer.seconds, timer.calls = 0.0, 0
+        self.queue = []
+        self.start = perf_counter()
+
+    def Stop(self, now):
+        """Stops the wall clock at simulated time :code:`now`."""
+        self.wall = perf_counter() - self.start
+        self.simulated = now
+
+    def Report(self):
+        """The structured report of the last run: wall and simulated time, their ratio (throughput), event counts
+        and rate, time spent per network process and per monitor, and the sampled event queue length (:code:`None`
+        for the fast engine)."""
+        events = sum(self.Events.values())
+        return {
+            "wall": self.wall, "simulated": self.simulated,
+            "throughput": self.simulated / self.wall if self.wall else None,
+            "events": dict(self.Events), "events_per_second": events / self.wall if self.wall else None,
+            "network": {name: timer.Report() for name, timer in self.Network.items()},
+            "monitors": {name: timer.Report() for name, timer in self.Monitors.items()},
+            "event_queue": {"mean": sum(self.queue) / len(self.queue), "max": max(self.queue),
+                            "samples": len(self.queue)} if self.queue else None,
+        }
@@ -1,16 +1,77 @@
-from simpy import Interrupt
+from functools import partial
+
+from parallelqueue.distributions import ServiceTime
+
+
+def JobName(name):
+    """The printed name of a job, formatted from its integer identifier (only when printing or exporting)."""
+    return 'Job%02d' % name
+
+
+class JobRecord:
+    """Compact record of a replicated job, kept in :code:`base_models.ParallelQueueSystem.ReplicaDict` until one of
+    its replicas completes (or, cancelling on start, begins service).
+
+    :param name: Identifier for the job.
+    :type name: int
+    :param arrive: Time of job arrival (before replication).
+    :type arrive: float
+    :param choices: The queues holding a replica.
+    :type choices: List[int]
+    :param replicas: The requests of the replicas, added as each joins its queue (or their `queues.QueueEntry`
+        objects, with `network.LazyNetwork`).
+    :type replicas: List[queues.IndexedRequest]
+    """
+
+    __slots__ = ("name", "arrive", "choices", "replicas")
+
+    def __init__(self, name, arrive, choices, replicas):
+        self.name = name
+        self.arrive = arrive
+        self.choices = choices
+        self.replicas = replicas
+
+
+def Duration(system, kwargs, queue, name):
+    """The service time of a job at a queue: its size (see `distributions.ServiceTime`) over the queue's speed."""
+    size = ServiceTime(kwargs, queue, name)
+    return size if system.speeds is None else size / system.speeds[queue]
+
+
+def CancelSiblings(system, env, name, request):
+    """Cancels every other replica of a job through `queues.IndexedResource.Cancel` (or `queues.LazyQueue.Cancel`):
+    no interrupts are raised, and the replicas still waiting are skipped once they reach the front of their queue.
+
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation
+    :type env: simpy.Environment
+    :param name: Identifier for the job.
+    :type name: int
+    :param request: The request (or entry) of the replica which is kept.
+    """
+    record = system.ReplicaDict.pop(name, None)
+    for sibling in record.replicas if record is not None else ():
+        if sibling is not request:
+            queue = sibling.resource.queue
+            if system.doPrint:
+                print(f"    ↳ {JobName(name)}@{queue} - Cancelled")
+            for hook in system.Events.on_cancel:
+                hook(system, env.now, name, queue)
+            sibling.resource.Cancel(sibling)
 
 
 def DefaultJob(system, env, name, arrive, queues, choice, **kwargs):
     """For a redundancy model, this generator/process defines the behaviour of a job (replica or original) after
-    routing.
+    routing. Depending on :code:`system.cancel`, the other replicas of a job are cancelled once one of them completes
+    service (:code:`"complete"`) or begins it (:code:`"start"`); a cancelled replica's process simply ends.
 
     :param system: System providing environment.
     :type system: base_models.ParallelQueueSystem
     :param env: Environment for the simulation
     :type env: simpy.Environment
     :param name: Identifier for the job.
-    :type name: str
+    :type name: int
     :param queues: A list of queuesOverTime.
     :type queues: List[simpy.Resource]
     :param arrive: Time of job arrival (before replication).
@@ -18,38 +79,147 @@ def DefaultJob(system, env, name, arrive, queues, choice, **kwargs):
     :param choice: The queue which this replica is currently in
     :type choice: int
     """
+    replicated = system.ReplicaDict is not None
     with queues[choice].request() as request:
-        try:
-            # Wait in queue
-            Rename = f"{name}@{choice}"
-            if system.doPrint:
-                print(f'    ↳ {Rename}')
-            yield request
-            wait = env.now - arrive
-            # at server ⇒ Next job waits until finished.
-            if system.doPrint:
-                print(f'{env.now:7.4f} {Rename}: Waited {wait:6.3f}')
-            tib = kwargs["Service"](kwargs["SArgs"])
-            yield env.timeout(tib)
-            finish = env.now - arrive
+        if replicated:
+            system.ReplicaDict[name].replicas.append(request)
+        Rename = f"{JobName(name)}@{choice}" if system.doPrint else None
+        # Wait in queue
+        if system.doPrint:
+            print(f'    ↳ {Rename}')
+        yield request
+        if request.cancelled:
+            return  # Granted, but cancelled by a sibling before resuming
+        start = env.now
+        wait = start - arrive
+        # at server ⇒ Next job waits until finished.
+        if system.doPrint:
+            print(f'{env.now:7.4f} {Rename}: Waited {wait:6.3f}')
+        tib = Duration(system, kwargs, choice, name)
+        if system.QueueState.Work is not None:
+            queues[choice].Assign(request, tib)
+        if replicated and system.cancel == "start":
+            CancelSiblings(system, env, name, request)
+        for hook in system.Events.on_service_start:
+            hook(system, start, name, choice, arrive)
+        yield env.timeout(tib)
+        if request.cancelled:
+            return  # A sibling finished first
+        finish = env.now - arrive
+        if system.doPrint:
+            print(f'{env.now:7.4f} {Rename}: Finished — Total {finish:2.3f}')
+        for hook in system.Events.on_departure:
+            hook(system, env.now, name, choice, arrive, start)
+        if replicated:
+            CancelSiblings(system, env, name, request)  # The set is finished
+
+
+def LazyJob(system, env, queue, **kwargs):
+    """For `network.LazyNetwork`, called whenever a server of :code:`queue` may be free: begins service of the next
+    jobs still needed. A job in service has a single event, its departure (see `LazyDeparture`); waiting jobs have
+    none.
+
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation
+    :type env: simpy.Environment
+    :param queue: The queue.
+    :type queue: queues.LazyQueue
+    """
+    replicated = system.ReplicaDict is not None
+    while True:
+        entry = queue.Next()
+        if entry is None:
+            return
+        start = env.now
+        if system.doPrint:
+            print(f'{env.now:7.4f} {JobName(entry.name)}@{queue.queue}: Waited {start - entry.arrive:6.3f}')
+        tib = Duration(system, kwargs, queue.queue, entry.name)
+        if system.QueueState.Work is not None:
+            queue.Assign(entry, tib)
+        departure = env.timeout(tib)
+        if replicated and system.cancel == "start":
+            CancelSiblings(system, env, entry.name, entry)
+        for hook in system.Events.on_service_start:
+            hook(system, start, entry.name, queue.queue, entry.arrive)
+        departure.callbacks.append(partial(LazyDeparture, system, env, entry, start))
+
+
+def LazyDeparture(system, env, entry, start, event):
+    """Completes the service of an entry (unless it was cancelled meanwhile) and frees its server.
+
+    :param entry: The job served.
+    :type entry: queues.QueueEntry
+    :param start: Time its service began.
+    :param event: The departure event.
+    """
+    if entry.cancelled:
+        return  # A sibling finished first; the server was freed then
+    queue = entry.resource
+    if system.doPrint:
+        print(f'{env.now:7.4f} {JobName(entry.name)}@{queue.queue}: Finished — Total {env.now - entry.arrive:2.3f}')
+    for hook in system.Events.on_departure:
+        hook(system, env.now, entry.name, queue.queue, entry.arrive, start)
+    if system.ReplicaDict is not None:
+        CancelSiblings(system, env, entry.name, entry)  # The set is finished
+    queue.Release(entry)
+    queue.serve()
+
+
+def StageJob(system, env, pool, queue):
+    """For `network.StagedNetwork`, as `LazyJob`: called whenever a server of a stage's queue may be free, begins
+    service of the next tasks waiting there, each drawing its service time from the stage's distribution.
+
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation
+    :type env: simpy.Environment
+    :param pool: The stage of the queue.
+    :type pool: network.StagePool
+    :param queue: The queue.
+    :type queue: queues.LazyQueue
+    """
+    while True:
+        entry = queue.Next()
+        if entry is None:
+            return
+        start = env.now
+        if system.doPrint:
+            print(f'{env.now:7.4f} {JobName(entry.name)}@{queue.queue}: Waited {start - entry.arrive:6.3f}')
+        tib = Duration(system, pool.Service, queue.queue, entry.name)
+        if system.QueueState.Work is not None:
+            queue.Assign(entry, tib)
+        departure = env.timeout(tib)
+        for hook in system.Events.on_service_start:
+            hook(system, start, entry.name, queue.queue, entry.arrive)
+        departure.callbacks.append(partial(StageDeparture, system, env, pool, entry, start))
+
+
+def StageDeparture(system, env, pool, entry, start, event):
+    """Completes the service of a task at a stage and frees its server. Once every task of the job at the stage is
+    served (fork-join), the job moves on to the next stage drawn for it, by a plain call rather than a new process,
+    or leaves the system; only then are monitors told of its departure.
+
+    :param pool: The stage of the task.
+    :type pool: network.StagePool
+    :param entry: The task served.
+    :type entry: queues.QueueEntry
+    :param start: Time its service began.
+    :param event: The departure event.
+    """
+    queue = entry.resource
+    queue.Release(entry)
+    record = pool.Jobs[entry.name]
+    record.replicas.remove(entry)
+    if not record.replicas:
+        del pool.Jobs[entry.name]
+        following = pool.Successor()
+        if following is not None:
+            following.Enter(system, env, entry.name, record.arrive)
+        else:
             if system.doPrint:
-                print(f'{env.now:7.4f} {Rename}: Finished — Total {finish:2.3f}')
-            if system.ReplicaDict is not None:
-                for c in system.ReplicaDict[name]:
-                    try:
-                        c.interrupt()
-                    except:
-                        pass
-            if system.MonitorHolder is not None:
-                inputs = locals()
-                for monitor in system.MonitorHolder.values():
-                    monitor.Add(inputs)
-        except Interrupt:
-            if Rename is not None:
-                try:  # similar: simpy/examples/machine_shop
-                    if system.doPrint:
-                        print(f"    ↳ {Rename} - Interrupted")  # This would be normal with replications
-                except RuntimeError:
-                    Exception(f"Job error for {queues[choice].request()}")
-            else:
-                Exception(f"Request error for {queues[choice].request()}")
+                print(f'{env.now:7.4f} {JobName(entry.name)}@{queue.queue}: Finished — Total '
+                      f'{env.now - record.arrive:2.3f}')
+            for hook in system.Events.on_departure:
+                hook(system, env.now, entry.name, queue.queue, record.arrive, start)
+    queue.serve()
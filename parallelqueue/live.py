@@ -0,0 +1,266 @@
+"""
+Live metrics of a running simulation. A `LiveExport`, subscribed to a system's events (see
+`base_models.ParallelQueueSystem.RunSim`), closes a window of accumulators every :code:`every` units of simulated time
+and puts it, as a snapshot, into a bounded queue. A background thread takes snapshots off the queue and writes them to
+a sink: JSON lines (`JsonLines`), CSV (`CSVFile`) or a local HTTP endpoint in the Prometheus text format
+(`Prometheus`). The simulation never waits for the sink: if the queue is full, the window is coalesced with the
+next one (their counts and sums merged) until there is room. Nor does it wait for a sink which failed: later
+snapshots are dropped, and the sink's error is raised once the run is over.
+
+Each snapshot holds the window's start and end (in simulated time), the wall-clock time, the numbers of arrivals and
+departures in the window, the mean and maximum response time of the jobs which departed in it, the time-average
+number in system over it and, at its end, the number of jobs in system and the number of queues holding each number
+of jobs (:code:`lengths[k]` queues with k jobs).
+
+Example
+-------
+.. code-block:: python
+
+    sim = JSQd(maxTime=1e6, parallelism=1000, seed=1234, d=2, Arrival=random.expovariate, AArgs=950,
+               Service=random.expovariate, SArgs=1, engine="fast", Monitors=[])
+    sim.RunSim(export=LiveExport(Prometheus(port=9100), every=100.0))  # Scraped at http://127.0.0.1:9100/metrics
+"""
+import csv
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from parallelqueue.monitors import Monitor
+
+SCALARS = ("start", "end", "wall", "arrivals", "departures", "mean", "max", "average", "total", "coalesced")
+
+
+class LiveExport(Monitor):
+    """Streams snapshots of windows of a run to a sink (see the module description).
+
+    :param sink: Where snapshots are written, from a background thread: an object with :code:`Write(snapshot)` and
+        :code:`Close()` methods, such as `JsonLines`, `CSVFile` or `Prometheus`.
+    :param every: Simulated time per window.
+    :param capacity: Number of snapshots the queue holds before windows are coalesced.
+
+    Attributes
+    ----------
+    Coalesced : int
+        Number of times a snapshot was held back (to be merged with the next) because the queue was full.
+    Error : Exception
+        The first error raised by the sink, if any, after which snapshots are dropped.
+    """
+
+    def __init__(self, sink, every, capacity=16):
+        super().__init__()
+        if every <= 0:
+            raise ValueError("every must be positive.")
+        self.sink = sink
+        self.every = every
+        self.queue = queue.Queue(capacity)
+        self.thread = None
+        self.Coalesced = 0
+        self.Error = None
+        self.pending = None  # A snapshot not yet queued (the queue was full)
+        self.windows = 0
+        self.Open(0.0)
+
+    def Open(self, now):
+        """Starts a window at :code:`now`, which ends at the next multiple of :code:`every`."""
+        self.start = self.last = now
+        self.due = (self.windows + 1) * self.every  # Counted, as now // every may round down at a boundary
+        self.arrivals = self.departures = 0
+        self.sum = self.max = self.area = 0.0
+
+    def Start(self):
+        """Starts the thread writing to the sink."""
+        self.thread = threading.Thread(target=self.Consume, name="LiveExport", daemon=True)
+        self.thread.start()
+
+    def Consume(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+            if self.Error is None:  # Otherwise dropped, so that the queue keeps draining
+                try:
+                    self.sink.Write(snapshot)
+                except Exception as error:
+                    self.Error = error
+        try:
+            self.sink.Close()
+        except Exception as error:
+            if self.Error is None:
+                self.Error = error
+
+    def Put(self, item):
+        """Queues an item for the thread, waiting for room only while the thread is alive."""
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def Advance(self, system, now):
+        """Brings the window up to :code:`now`, closing it first if it is due."""
+        while now >= self.due:
+            self.Close(system, self.due)
+        self.area += system.QueueState.Total * (now - self.last)
+        self.last = now
+
+    def Close(self, system, end):
+        """Closes the window at :code:`end` and queues its snapshot (or coalesces it, if the queue is full)."""
+        state = system.QueueState
+        self.area += state.Total * (end - self.last)
+        snapshot = {"start": self.start, "end": end, "wall": time.time(), "arrivals": self.arrivals,
+                    "departures": self.departures, "sum": self.sum, "max": self.max, "area": self.area,
+                    "total": int(state.Total), "lengths": np.bincount(state.InSystem).tolist(), "coalesced": 0}
+        if self.pending is not None:
+            snapshot = Coalesce(self.pending, snapshot)
+        try:
+            self.queue.put_nowait(Publish(snapshot))
+            self.pending = None
+        except queue.Full:
+            self.pending = snapshot
+            self.Coalesced += 1
+        if end == self.due:
+            self.windows += 1
+        self.Open(end)
+
+    def on_arrival(self, system, now, job):
+        self.Advance(system, now)
+        self.arrivals += 1
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.Advance(system, now)
+        self.departures += 1
+        response = now - arrive
+        self.sum += response
+        if response > self.max:
+            self.max = response
+
+    def Stop(self, system, now):
+        """Closes the last window at :code:`now`, the end of the run (:code:`None` if it failed), then waits for the
+        sink to write what is queued and closes it. Raises the sink's error, if any, unless the run failed."""
+        if now is not None:
+            self.Advance(system, now)
+            if now > self.start or self.pending is not None:
+                self.Close(system, now)
+        if self.pending is not None:
+            self.Put(Publish(self.pending))  # The run is over; waiting is harmless
+            self.pending = None
+        self.Put(None)
+        self.thread.join()
+        if self.Error is not None and now is not None:
+            raise self.Error
+
+    @property
+    def Name(self):
+        return "LiveExport"
+
+
+def Coalesce(earlier, later):
+    """A snapshot of two consecutive windows."""
+    merged = dict(later)
+    merged["start"] = earlier["start"]
+    for key in ("arrivals", "departures", "sum", "area"):
+        merged[key] += earlier[key]
+    merged["max"] = max(earlier["max"], later["max"])
+    merged["coalesced"] = earlier["coalesced"] + 1
+    return merged
+
+
+def Publish(snapshot):
+    """The snapshot as written: means in place of sums."""
+    snapshot = dict(snapshot)
+    length = snapshot["end"] - snapshot["start"]
+    snapshot["mean"] = snapshot.pop("sum") / snapshot["departures"] if snapshot["departures"] else float("nan")
+    snapshot["average"] = snapshot.pop("area") / length if length > 0 else float("nan")
+    return snapshot
+
+
+class JsonLines:
+    """Writes each snapshot as a line of JSON.
+
+    :param path: The file (overwritten).
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "w")
+
+    def Write(self, snapshot):
+        self.file.write(json.dumps(snapshot) + "\n")
+        self.file.flush()
+
+    def Close(self):
+        self.file.close()
+
+
+class CSVFile:
+    """Writes each snapshot as a row of a CSV file, with the number of queues per length as JSON in
+    :code:`lengths`.
+
+    :param path: The file (overwritten).
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(SCALARS + ("lengths",))
+
+    def Write(self, snapshot):
+        self.writer.writerow([snapshot[key] for key in SCALARS] + [json.dumps(snapshot["lengths"])])
+        self.file.flush()
+
+    def Close(self):
+        self.file.close()
+
+
+class Prometheus:
+    """Serves the latest snapshot at :code:`http://host:port/metrics`, in the Prometheus text format, until closed
+    (totals since the start of the run as counters; the rest as gauges).
+
+    :param port: Port to listen on (0 for any free port, then given by :code:`port`).
+    :param host: Address to listen on; local only by default.
+    """
+
+    def __init__(self, port=9100, host="127.0.0.1"):
+        self.text = b""
+        self.arrivals = self.departures = 0
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.text
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="Prometheus", daemon=True).start()
+
+    def Write(self, snapshot):
+        self.arrivals += snapshot["arrivals"]
+        self.departures += snapshot["departures"]
+        lines = [f"parallelqueue_time {snapshot['end']}",
+                 f"parallelqueue_arrivals_total {self.arrivals}",
+                 f"parallelqueue_departures_total {self.departures}",
+                 f"parallelqueue_response_time_mean {snapshot['mean']}",
+                 f"parallelqueue_response_time_max {snapshot['max']}",
+                 f"parallelqueue_jobs {snapshot['total']}",
+                 f"parallelqueue_jobs_average {snapshot['average']}"]
+        lines += [f'parallelqueue_queues{{length="{k}"}} {count}' for k, count in enumerate(snapshot["lengths"])]
+        self.text = ("\n".join(lines) + "\n").encode()
+
+    def Close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,375 @@
+"""
+Mean-field estimates of the steady state of the models in `base_models` as the number of queues grows large. Rather
+than simulating, a single (tagged) queue is solved given the rate at which jobs join it at each queue length, and the
+queue-length distribution is iterated to a fixed point; this takes milliseconds whatever the parallelism.
+
+`JSQd` and `RedundancyQueueSystem` take the same arguments as their namesakes in `base_models` (simulation-only ones,
+such as :code:`maxTime` or :code:`Monitors`, are accepted and ignored), so that a model can be cross-checked against
+its mean-field limit:
+
+.. code-block:: python
+
+    kwargs = dict(parallelism=1000, seed=1234, d=2, Arrival=random.expovariate, AArgs=900,
+                  Service=distributions.Erlang(2, 2), SArgs=None)
+    estimate = meanfield.JSQd(**kwargs)  # {"mean": ..., "queue": ..., "distribution": ...}
+    sim = base_models.JSQd(maxTime=1000.0, engine="fast", **kwargs)
+
+Arrivals must be Poisson and service times phase-type: :code:`random.expovariate` or `distributions.Exponential`,
+`distributions.Erlang`, `distributions.HyperExponential`, or any phase-type distribution given as a tuple
+:code:`(alpha, S)` of its initial probabilities and sub-generator.
+
+Note
+----
+For JSQ(d) the fixed point is the exact mean-field limit (with exponential service, the queue-length tail is
+:math:`\\rho^{(d^k - 1)/(d - 1)}`). For Redundancy-d with exponential service, the mean response time is the exact
+limit of Gardner et al. Otherwise, replicas are taken to be cancelled at a constant rate (that at which their siblings
+complete service elsewhere): Redundancy-d with phase-type service is then within a few percent of simulation, as is
+Threshold-(d,r) for d = 2, while Threshold-(d,r) with larger d comes out some 10% optimistic.
+
+References
+----------
+    Load Balancing in Large-Scale Systems with Multiple Dispatchers
+        Tim Hellemans, Benny Van Houdt (2018)
+        https://arxiv.org/abs/1712.06530
+
+    Redundancy-d:The Power of d Choices for Redundancy
+        Kristen Gardner, Mor Harchol-Balter, Alan Scheller-Wolf,
+        Mark Velednitsky, Samuel Zbarsky (2017)
+        https://doi.org/10.1287/opre.2016.1582
+"""
+import random
+from math import comb
+
+import numpy as np
+
+from parallelqueue.distributions import Erlang, Exponential, HyperExponential
+
+LEVELS = 16  # Queue lengths solved for at first; doubled until the tail beyond them is negligible.
+MAXLEVELS = 1 << 16
+TOL = 1e-10
+ITERATIONS = 10000
+
+
+def ArrivalRate(Arrival, AArgs, parallelism):
+    """The arrival rate per queue of a Poisson arrival process given as a model expects it."""
+    if isinstance(Arrival, Exponential):
+        rate = Arrival.rate
+    elif getattr(Arrival, "__func__", None) is random.Random.expovariate:
+        rate = AArgs
+    else:
+        raise ValueError("Mean-field estimates require Poisson arrivals (random.expovariate or Exponential).")
+    return rate / parallelism
+
+
+def PhaseType(Service, SArgs):
+    """The phase-type representation :code:`(alpha, S)` of a service distribution given as a model expects it.
+
+    :param Service: :code:`random.expovariate`, `distributions.Exponential`, `distributions.Erlang`,
+        `distributions.HyperExponential` or a tuple :code:`(alpha, S)`.
+    :param SArgs: The rate, if :code:`Service` is :code:`random.expovariate`.
+    """
+    if isinstance(Service, tuple):
+        alpha, S = (np.asarray(x, dtype=float) for x in Service)
+        if alpha.ndim != 1 or S.shape != (len(alpha), len(alpha)):
+            raise ValueError("A phase-type distribution needs alpha of length m and an m x m sub-generator S.")
+        return alpha, S
+    if isinstance(Service, Exponential):
+        return np.ones(1), np.array([[-float(Service.rate)]])
+    if getattr(Service, "__func__", None) is random.Random.expovariate:
+        return np.ones(1), np.array([[-float(SArgs)]])
+    if isinstance(Service, Erlang):
+        alpha = np.zeros(Service.k)
+        alpha[0] = 1.0
+        return alpha, Service.rate * (np.eye(Service.k, k=1) - np.eye(Service.k))
+    if isinstance(Service, HyperExponential):
+        return np.asarray(Service.probabilities, dtype=float), -np.diag(np.asarray(Service.rates, dtype=float))
+    raise ValueError(f"{Service!r} is not a phase-type distribution.")
+
+
+def Stationary(Up, Within, Down, K):
+    """Stationary distribution of a level-dependent quasi-birth-death process, truncated at level K, by linear level
+    reduction. Level n holds the states of a queue with n jobs; level 0 is a single state.
+
+    :param Up: Function of n giving the rates from level n to level n + 1 (n = 0, ..., K - 1).
+    :param Within: Function of n giving the rates between states of level n (diagonal ignored).
+    :param Down: Function of n giving the rates from level n to level n - 1 (n = 1, ..., K).
+    :return: The probabilities of the states of each level, in a list.
+    """
+
+    def Local(n):
+        within = Within(n)
+        out = within.sum(axis=1) - np.diag(within) + Down(n).sum(axis=1) + (Up(n).sum(axis=1) if n < K else 0.0)
+        return within - np.diag(np.diag(within) + out)
+
+    rates = [None] * (K + 1)  # levels[n] = levels[n - 1] @ rates[n]
+    inner = Local(K)
+    for n in range(K, 0, -1):
+        rates[n] = Up(n - 1) @ np.linalg.inv(-inner)
+        if n > 1:
+            inner = Local(n - 1) + rates[n] @ Down(n)
+    levels = [np.ones(1)]
+    for n in range(1, K + 1):
+        levels.append(levels[-1] @ rates[n])
+    total = sum(level.sum() for level in levels)
+    return [level / total for level in levels]
+
+
+def BirthDeath(up, down):
+    """Stationary distribution of a birth-death process with rates up[n] (from n) and down[n] (from n + 1)."""
+    p = np.concatenate([[1.0], np.cumprod(up / down)])
+    return p / p.sum()
+
+
+def Tail(p):
+    """The fraction of queues with at least k jobs, for k = 0, ..., len(p), from their distribution."""
+    return np.concatenate([[1.0], np.clip(1 - np.cumsum(p), 0.0, 1.0)])
+
+
+def Load(lam, alpha, S):
+    """The load per queue, checking that it is below 1."""
+    rho = lam * float(alpha @ np.linalg.solve(-S, np.ones(len(alpha))))
+    if rho >= 1:
+        raise ValueError(f"The load per queue is {rho:.3f}; the system has no steady state.")
+    return rho
+
+
+def FixedPoint(Blocks, Update, guess, tol, memory=4):
+    """Iterates the tagged queue to a fixed point (with Anderson acceleration), adding levels until the tail beyond
+    them is negligible.
+
+    :param Blocks: Function of the current guess and of the number of levels returning the :code:`Up`,
+        :code:`Within` and :code:`Down` functions of `Stationary`.
+    :param Update: Function from the solution of `Stationary` to the next guess.
+    :param guess: Initial guess (an array of the non-negative quantities the tagged queue depends on).
+    :param memory: Number of previous iterations combined by the acceleration.
+    :return: The queue-length distribution and the solution of `Stationary`.
+    """
+    levels = LEVELS
+    guess = np.asarray(guess, dtype=float)
+    updates, residuals = [], []
+    for _ in range(ITERATIONS):
+        solution = Stationary(*Blocks(guess, levels), levels)
+        update = Update(solution)
+        p = np.array([level.sum() for level in solution])
+        if len(update) != len(guess):
+            guess, updates, residuals = update, [], []
+            continue
+        residual = update - guess
+        if np.abs(residual).max() < tol:
+            if p[-1] < tol or levels >= MAXLEVELS:
+                return p, solution
+            levels *= 2  # Carry on from here with a longer truncation
+            guess, updates, residuals = update, [], []
+            continue
+        updates, residuals = (updates + [update])[-memory - 1:], (residuals + [residual])[-memory - 1:]
+        guess = update
+        if len(residuals) > 1:  # Combination of the last updates whose residuals cancel best
+            F, G = np.diff(residuals, axis=0).T, np.diff(updates, axis=0).T
+            weights = np.linalg.lstsq(F, residual, rcond=None)[0]
+            accelerated = update - G @ weights
+            if (accelerated >= 0).all():
+                guess = accelerated
+    raise ValueError("The mean-field fixed point did not converge.")
+
+
+def Result(p, lam, copies):
+    """Mean response time, mean number per queue (replicas included) and queue-length distribution."""
+    queue = float(np.arange(len(p)) @ p)
+    return {"mean": queue / (lam * copies), "queue": queue, "distribution": p}
+
+
+def JSQd(parallelism, seed, d, Arrival, AArgs, Service, SArgs, r=None, tol=TOL, **simulation):
+    """The mean-field steady state of `base_models.JSQd`: each job joins the shortest of d queues sampled at random.
+
+    :param parallelism: Number of queues in parallel (the arrival rate is per queue, i.e. :code:`AArgs/parallelism`).
+    :param seed: Ignored.
+    :param d: Number of queues to parse.
+    :param Arrival: Poisson arrivals (see `ArrivalRate`).
+    :param AArgs: parameters needed by the function.
+    :param Service: A phase-type service distribution (see `PhaseType`).
+    :param SArgs: parameters needed by the function.
+    :param r: Ignored (as it is by JSQ(d)).
+    :param tol: Tolerance of the fixed point and of the truncated tail.
+    :param simulation: Further arguments of `base_models.JSQd`, ignored.
+    :return: A dict of the mean response time (:code:`"mean"`), the mean number of jobs per queue
+        (:code:`"queue"`) and the distribution of the number of jobs in a queue (:code:`"distribution"`).
+    """
+    lam = ArrivalRate(Arrival, AArgs, parallelism)
+    alpha, S = PhaseType(Service, SArgs)
+    rho = Load(lam, alpha, S)
+    d = min(d, parallelism)
+    k = np.arange(LEVELS)
+    while True:  # With exponential service, the tail is known in closed form
+        tail = rho ** (k if d == 1 else (float(d) ** k - 1) / (d - 1))
+        if tail[-1] < tol or len(k) >= MAXLEVELS:
+            break
+        k = np.arange(2 * len(k))
+    if len(alpha) == 1:
+        return Result(np.append(tail[:-1] - tail[1:], tail[-1]), lam, 1)
+    m = len(alpha)
+    exit, within, eye = -S.sum(axis=1), S - np.diag(np.diag(S)), np.eye(m)
+
+    def Blocks(tail, K):
+        # Jobs join a queue of length n when it is the shortest sampled (ties broken uniformly)
+        tail = np.pad(tail, (0, max(0, K + 2 - len(tail))))
+        above, below = tail[:K], tail[1:K + 1]
+        gap = above - below
+        up = np.where(gap > 0, lam * (above ** d - below ** d) / np.where(gap > 0, gap, 1.0),
+                      lam * d * above ** (d - 1))
+        return (lambda n: up[n] * (alpha[None, :] if n == 0 else eye), lambda n: within,
+                lambda n: exit[:, None] if n == 1 else np.outer(exit, alpha))
+
+    def Update(solution):
+        return Tail(np.array([level.sum() for level in solution]))
+
+    p, _ = FixedPoint(Blocks, Update, tail, tol)
+    return Result(p, lam, 1)
+
+
+def RedundancyQueueSystem(parallelism, seed, d, Arrival, AArgs, Service, SArgs, r=None, cancel="complete", tol=TOL,
+                          **simulation):
+    """The mean-field steady state of `base_models.RedundancyQueueSystem`: each job sends a replica to each of d
+    queues sampled at random (those with at most r jobs, if r is set, or else one of them) and the others are
+    cancelled once one of them completes service.
+
+    :param parallelism: Number of queues in parallel (the arrival rate is per queue, i.e. :code:`AArgs/parallelism`).
+    :param seed: Ignored.
+    :param d: Number of queues to parse.
+    :param Arrival: Poisson arrivals (see `ArrivalRate`).
+    :param AArgs: parameters needed by the function.
+    :param Service: A phase-type service distribution (see `PhaseType`).
+    :param SArgs: parameters needed by the function.
+    :param r: Threshold. Should be set to an integer, defaulting to :code:`None` otherwise.
+    :param cancel: Only :code:`"complete"` is supported.
+    :param tol: Tolerance of the fixed point and of the truncated tail.
+    :param simulation: Further arguments of `base_models.RedundancyQueueSystem`, ignored.
+    :return: A dict of the mean response time (:code:`"mean"`), the mean number of replicas per queue
+        (:code:`"queue"`) and the distribution of the number of replicas in a queue (:code:`"distribution"`).
+    """
+    if cancel != "complete":
+        raise ValueError("Mean-field estimates only cover cancellation on completion (cancel='complete').")
+    lam = ArrivalRate(Arrival, AArgs, parallelism)
+    alpha, S = PhaseType(Service, SArgs)
+    rho = Load(lam, alpha, S)
+    d = min(d, parallelism)
+    if d == 1:  # Random routing
+        return JSQd(1, seed, 1, Exponential(lam), None, (alpha, S), None, tol=tol)
+    if not r and len(alpha) == 1:  # The mean is exact; cancellations are set to match it
+        mu = -S[0, 0]
+        return Result(Calibrated(lam * d, mu, lam * d * Gardner(lam, mu, d), tol), lam, d)
+    if not r:
+        return Redundancy(lam, d, alpha, S, rho, tol)
+    return Threshold(lam, d, r, alpha, S, rho, tol)
+
+
+def Redundancy(lam, d, alpha, S, rho, tol):
+    """Redundancy-d with phase-type service: every job present is cancelled at the rate at which one of its d - 1
+    siblings completes service."""
+    m = len(alpha)
+    exit, within, eye = -S.sum(axis=1), S - np.diag(np.diag(S)), np.eye(m)
+
+    def Blocks(guess, K):
+        gamma = guess[0]
+        return (lambda n: lam * d * (alpha[None, :] if n == 0 else eye), lambda n: within,
+                lambda n: (exit + gamma)[:, None] if n == 1 else np.outer(exit + gamma, alpha) + (n - 1) * gamma * eye)
+
+    def Update(solution):
+        served = sum(level @ exit for level in solution[1:])
+        present = sum(n * level.sum() for n, level in enumerate(solution))
+        return np.array([(d - 1) * served / present])
+
+    p, _ = FixedPoint(Blocks, Update, [(d - 1) * lam / rho / 2], tol)
+    return Result(p, lam, d)
+
+
+def Threshold(lam, d, r, alpha, S, rho, tol):
+    """Threshold-(d,r) with phase-type service. A job has siblings unless it was the only one of its d sampled
+    queues with at most r jobs (or was sent to a random one, none having so few); the state of the tagged queue
+    counts the jobs with siblings, which (as they joined with at most r ahead) sit among its first r + 1 jobs."""
+    m, C = len(alpha), r + 2
+    exit, within = -S.sum(axis=1), np.kron(np.eye(C), S - np.diag(np.diag(S)))
+    counts = np.arange(C)
+
+    def Head(n):
+        return np.minimum(counts / min(n, r + 1), 1.0)  # Chance that the job in service has siblings
+
+    def Blocks(guess, K):
+        full, gamma = guess
+        alone = full ** (d - 1)  # None of the other sampled queues has at most r jobs
+        join = np.zeros((1, C * m))
+        join[0, :m], join[0, m:2 * m] = lam * d * alone * alpha, lam * d * (1 - alone) * alpha
+        ups = [join, np.kron(lam * d * (alone * np.eye(C) + (1 - alone) * np.eye(C, k=1)), np.eye(m)),
+               lam * alone * np.eye(C * m)]
+        downs = [None, np.repeat(counts * gamma, m)[:, None] + np.tile(exit, C)[:, None]]
+        for n in range(2, r + 3):  # The same from r + 2 jobs on
+            head, block = Head(n), np.zeros((C * m, C * m))
+            for c in counts:
+                rows = slice(c * m, (c + 1) * m)
+                block[rows, rows] += (1 - head[c]) * np.outer(exit, alpha)
+                if c:
+                    previous = slice((c - 1) * m, c * m)
+                    block[rows, previous] += head[c] * np.outer(exit + gamma, alpha)
+                    block[rows, previous] += (c - head[c]) * gamma * np.eye(m)
+            downs.append(block)
+        return (lambda n: ups[0 if n == 0 else 1 if n <= r else 2], lambda n: within,
+                lambda n: downs[min(n, r + 2)])
+
+    def Update(solution):
+        full = Tail(np.array([level.sum() for level in solution]))[r + 1]
+        served = sum((level.reshape(C, m) @ exit) @ Head(n) for n, level in enumerate(solution) if n)
+        siblings = sum(level.reshape(C, m).sum(axis=1) @ counts for level in solution[1:])
+        q = 1 - full
+        expected = (d - 1) * q / (1 - full ** (d - 1)) if full < 1 else 0.0  # Siblings, given there are some
+        return np.array([full, expected * served / siblings if siblings else 0.0])
+
+    p, solution = FixedPoint(Blocks, Update, [rho ** (r + 1), (d - 1) * lam / rho / 2], tol)
+    # Response times by Little's law, separately for jobs with and without siblings (whose times differ)
+    full = Tail(p)[r + 1]
+    copies = np.arange(d + 1)
+    k = np.array([comb(d, i) * (1 - full) ** i * full ** (d - i) for i in copies])
+    k[1] += k[0]  # With none at most r, one replica is sent at random
+    k[0] = 0.0
+    queue = float(np.arange(len(p)) @ p)
+    replicated = sum(level.reshape(C, m).sum(axis=1) @ counts for level in solution[1:])  # Replicas with siblings
+    mean = (queue - replicated) / lam  # Jobs without siblings (a fraction k[1] of them) have one replica each
+    if k[1] < 1:  # The others are taken to respond in a time inversely proportional to their number of replicas
+        mean += replicated / (lam * (1 - k[1])) * float(k[2:] @ (1 / copies[2:]))
+    return {"mean": float(mean), "queue": queue, "distribution": p}
+
+
+def Calibrated(up, mu, queue, tol):
+    """Queue-length distribution of a queue with Poisson arrivals (rate up), exponential service (rate mu) and
+    cancellations at the constant rate per job for which the mean number in queue is :code:`queue`."""
+    levels = LEVELS
+    while True:
+        low, high = 0.0, up
+        for _ in range(200):
+            gamma = (low + high) / 2
+            p = BirthDeath(np.full(levels, up), mu + gamma * np.arange(1, levels + 1))
+            if np.arange(len(p)) @ p > queue:
+                low = gamma
+            else:
+                high = gamma
+            if high - low < tol * high:
+                break
+        if p[-1] < tol or levels >= MAXLEVELS:
+            return p
+        levels *= 2
+
+
+def Gardner(lam, mu, d, points=32):
+    """Exact mean-field mean response time of Redundancy-d with exponential service (Gardner et al., 2017), where
+    :math:`P(T > t) = (\\rho + (1 - \\rho) e^{(d - 1) \\mu t})^{-d/(d - 1)}`."""
+    rho = lam / mu
+    nodes, weights = np.polynomial.legendre.leggauss(points)
+    # Substituting e^{-(d - 1) mu t} = z^{d - 1}, the integrand on [0, 1] peaks about z^{d - 1} = (1 - rho) / rho;
+    # Gauss-Legendre is applied on intervals doubling in length from there.
+    peak = min(1.0, ((1 - rho) / rho) ** (1 / (d - 1))) if rho > 0 else 1.0
+    edges = [0.0]
+    while edges[-1] < 1.0:
+        edges.append(min(1.0, peak * 2 ** (len(edges) - 1)))
+    total = 0.0
+    for a, b in zip(edges[:-1], edges[1:]):
+        z = a + (b - a) * (nodes + 1) / 2
+        total += (b - a) / 2 * weights @ (z ** (d - 1) * (1 - rho + rho * z ** (d - 1)) ** (-d / (d - 1)))
+    return float(total / mu)
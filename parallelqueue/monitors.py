@@ -2,8 +2,16 @@
 This module contains methods for monitoring and visualization. As simulations run, the `Monitor` class interacts with
 the main environment, gathering data at certain intervals. Moreover, the `Monitor` class was designed to be general
 enough
-so that one can build their own by overriding its `Name` and its data-gathering `Add` function.
+so that one can build their own by overriding its `Name` and the event hooks it needs (see `events.EventBus`).
+Monitors which only override the former data-gathering `Add` function still work through `events.LegacyAdapter`.
+Jobs are identified by integers as the simulation runs; the data keyed by job (:code:`Data`, :code:`DataFrame`)
+names them as printed, e.g. :code:`'Job01'` (see `jobs.JobName`).
 """
+import numpy as np
+
+from parallelqueue.columns import ColumnStore
+from parallelqueue.jobs import JobName
+
 
 # Base monitor class with overridable members.
 class Monitor:
@@ -22,8 +30,24 @@ class Monitor:
         self.toData = {}
 
     def Add(self, MonitorInputs: dict):
+        """Legacy interface: receives a dict of inputs for every event (see `events.LegacyAdapter`)."""
         return None
 
+    def on_arrival(self, system, now, job):
+        """A job arrives, before being routed."""
+
+    def on_route(self, system, now, job, choices):
+        """A job has chosen its queues (one per replica), before joining them."""
+
+    def on_service_start(self, system, now, job, queue, arrive):
+        """A job (or replica) which arrived at time :code:`arrive` enters service at :code:`queue`."""
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        """A job completes service at :code:`queue`, where it started at :code:`start`, before leaving it."""
+
+    def on_cancel(self, system, now, job, queue):
+        """A replica at :code:`queue` is cancelled, before leaving it."""
+
     @property
     def Data(self) -> dict:
         return self.toData
@@ -35,13 +59,77 @@ class Monitor:
 
 class TimeQueueSize(Monitor):
     """
-    Tracks queue sizes over time.
+    Tracks queue sizes (number waiting) over time, as read from :code:`system.QueueState`. Only the queues whose
+    size changed are written, as (time, queue, size) rows of a `columns.ColumnStore`, with a row (time, -1, -1) for an
+    event time at which none did; :code:`DataFrame` rebuilds the table of sizes (times by queues) from them. See
+    :code:`Spill` for streaming the rows to Parquet as the run goes.
     """
 
-    def Add(self, MonitorInputs: dict):  # Env always exists
-        if {"queues"} <= MonitorInputs.keys():  # Leaving system
-            queues = MonitorInputs["queues"]
-            self.toData[MonitorInputs["env"].now] = {i: len(queues[i].put_queue) for i in range(len(queues))}
+    def __init__(self):
+        super().__init__()
+        self.Store = ColumnStore({"time": float, "queue": np.int32, "size": np.int32})
+        self.Previous = None
+        self.Last = None
+
+    def Record(self, system, now):
+        sizes = system.QueueState.Waiting()
+        if self.Previous is None:
+            changed = np.arange(len(sizes))
+        else:
+            changed = np.flatnonzero(sizes != self.Previous)
+        if len(changed):
+            self.Store.Extend(now, changed, sizes[changed])
+        elif now != self.Last:  # Every event time has a row
+            self.Store.Append(now, -1, -1)
+        self.Last = now
+        self.Previous = sizes
+
+    def on_arrival(self, system, now, job):
+        self.Record(system, now)
+
+    def on_route(self, system, now, job, choices):
+        self.Record(system, now)
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.Record(system, now)
+
+    def Sizes(self):
+        """Event times and the matrix (times by queues) of queue sizes at each."""
+        if self.Store.spilled:
+            raise Exception("Error: part of 'TimeQueueSize' was spilled to disk; read it from there!")
+        rows = self.Store.Columns()
+        times = rows["time"][np.diff(rows["time"], prepend=-np.inf) != 0]  # Nondecreasing
+        rows = {name: column[rows["queue"] >= 0] for name, column in rows.items()}
+        queues = len(self.Previous) if self.Previous is not None else 0
+        index = np.searchsorted(times, rows["time"])
+        sizes = np.zeros((len(times), queues), dtype=np.int64)
+        sizes[index, rows["queue"]] = rows["size"]
+        written = np.zeros(sizes.shape, dtype=bool)
+        written[index, rows["queue"]] = True
+        last = np.where(written, np.arange(len(times))[:, None], 0)  # Carry each size forward until it changes
+        np.maximum.accumulate(last, axis=0, out=last)
+        return times, sizes[last, np.arange(queues)]
+
+    @property
+    def Data(self) -> dict:
+        """The sizes at each event time, as :code:`{time: {queue: size}}` (see :code:`DataFrame` for the table)."""
+        times, sizes = self.Sizes()
+        return {time: dict(enumerate(row)) for time, row in zip(times.tolist(), sizes.tolist())}
+
+    @property
+    def DataFrame(self):
+        import pandas as pd
+        times, sizes = self.Sizes()
+        return pd.DataFrame(sizes, index=times, copy=False)
+
+    def Spill(self, path):
+        """Streams the (time, queue, size) rows, those of event times included, to a Parquet file as chunks fill;
+        call :code:`to_parquet` with the same path after the run to finish it."""
+        self.Store.Spill(path)
+
+    def to_parquet(self, path):
+        """Writes the (time, queue, size) rows to a Parquet file."""
+        self.Store.to_parquet(path)
 
     @property
     def Name(self):
@@ -50,20 +138,19 @@ class TimeQueueSize(Monitor):
 
 class ReplicaSets(Monitor):
     """
-    Tracks replica sets generated over time, along with their times of creation and disposal.
+    Tracks replica sets generated over time, along with their times of creation and disposal, by job name.
     """
 
-    def Add(self, MonitorInputs: dict):
-        if {"choices", "name"} <= MonitorInputs.keys():
-            time = MonitorInputs["env"].now  # Env always exists
-            name = MonitorInputs["name"]
-            self.toData[name] = {"choices": MonitorInputs["choices"], "entry": time}
+    def on_route(self, system, now, job, choices):
+        self.toData[job] = {"choices": choices, "entry": now}
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        if job in self.toData:
+            self.toData[job]["exit"] = now
 
-        elif {"name"} <= MonitorInputs.keys():  # Leaving system
-            time = MonitorInputs["env"].now
-            name = MonitorInputs["name"]
-            if name in self.toData.keys():
-                self.toData[name]["exit"] = time
+    @property
+    def Data(self) -> dict:
+        return {JobName(job): record for job, record in self.toData.items()}
 
     @property
     def Name(self):
@@ -72,13 +159,37 @@ class ReplicaSets(Monitor):
 
 class JobTime(Monitor):
     """
-    Tracks time of job entry and exit.
+    Tracks time of job entry and exit, as (job, entry, exit) rows of a `columns.ColumnStore`, the job by its integer
+    identifier (as written to Parquet); :code:`Data` and :code:`DataFrame` name the jobs.
     """
 
-    def Add(self, MonitorInputs: dict):
-        if {"arrive", "wait", "name"} <= MonitorInputs.keys():  # `wait` is a dummy to know @ server
-            name = MonitorInputs["name"]
-            self.toData[name] = {"entry": MonitorInputs["arrive"], "exit": MonitorInputs["env"].now}
+    def __init__(self):
+        super().__init__()
+        self.Store = ColumnStore({"job": np.int64, "entry": float, "exit": float})
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.Store.Append(job, arrive, now)
+
+    @property
+    def Data(self) -> dict:
+        rows = self.Store.Columns()
+        return {JobName(job): {"entry": entry, "exit": exit_} for job, entry, exit_ in
+                zip(rows["job"].tolist(), rows["entry"].tolist(), rows["exit"].tolist())}
+
+    @property
+    def DataFrame(self):
+        frame = self.Store.DataFrame()
+        frame["job"] = [JobName(job) for job in frame["job"].tolist()]
+        return frame
+
+    def Spill(self, path):
+        """Streams the rows to a Parquet file as chunks fill; call :code:`to_parquet` with the same path after the
+        run to finish it."""
+        self.Store.Spill(path)
+
+    def to_parquet(self, path):
+        """Writes the rows to a Parquet file."""
+        self.Store.to_parquet(path)
 
     @property
     def Name(self):
@@ -87,7 +198,7 @@ class JobTime(Monitor):
 
 class JobTotal(Monitor):
     """
-    Tracks total time each job/set spends in system.
+    Tracks total time each job/set spends in system, by job name.
     To get the mean time each job/set spends:
 
     Example
@@ -105,11 +216,173 @@ class JobTotal(Monitor):
 
     """
 
-    def Add(self, MonitorInputs: dict):
-        if {"finish", "name"} <= MonitorInputs.keys():
-            name = MonitorInputs["name"]
-            self.toData[name] = MonitorInputs["finish"]
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.toData[job] = now - arrive
+
+    @property
+    def Data(self) -> dict:
+        return {JobName(job): total for job, total in self.toData.items()}
 
     @property
     def Name(self):
         return "JobTotal"
+
+
+# Streaming monitors: running accumulators only, i.e. O(parallelism) memory whatever the horizon.
+class TimeAverageQueueSize(Monitor):
+    """
+    Time-weighted mean and variance of the number in system, per queue and overall, read from
+    :code:`system.QueueState`. The statistics run up to the last event observed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.Last = 0.0
+        self.Area = None  # per queue, of n and n^2
+        self.Square = None
+        self.TotalArea = 0.0
+        self.TotalSquare = 0.0
+
+    def Advance(self, system, now):  # Hooks precede any change at this time
+        state = system.QueueState
+        if self.Area is None:
+            self.Area = np.zeros(len(state.InSystem))
+            self.Square = np.zeros(len(state.InSystem))
+        elapsed = now - self.Last
+        if elapsed > 0:
+            n = state.InSystem
+            self.Area += n * elapsed
+            self.Square += n * n * elapsed
+            self.TotalArea += state.Total * elapsed
+            self.TotalSquare += state.Total * state.Total * elapsed
+            self.Last = now
+
+    def on_arrival(self, system, now, job):
+        self.Advance(system, now)
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.Advance(system, now)
+
+    @property
+    def Data(self) -> dict:
+        if self.Area is None or self.Last == 0:
+            return {}
+        mean, total = self.Area / self.Last, self.TotalArea / self.Last
+        return {"mean": mean, "variance": self.Square / self.Last - mean ** 2,
+                "total_mean": total, "total_variance": self.TotalSquare / self.Last - total ** 2}
+
+    @property
+    def Name(self):
+        return "TimeAverageQueueSize"
+
+
+class JobTotalStats(Monitor):
+    """
+    Online (Welford) mean and variance of the total time each job/set spends in system.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.Count = 0
+        self.Mean = 0.0
+        self.M2 = 0.0
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        x = now - arrive
+        self.Count += 1
+        delta = x - self.Mean
+        self.Mean += delta / self.Count
+        self.M2 += delta * (x - self.Mean)
+
+    @property
+    def Data(self) -> dict:
+        return {"count": self.Count, "mean": self.Mean if self.Count else float("nan"),
+                "variance": self.M2 / (self.Count - 1) if self.Count > 1 else float("nan")}
+
+    @property
+    def Name(self):
+        return "JobTotalStats"
+
+
+class P2Quantile:
+    """
+    Streaming estimate of the p-quantile using five markers (the P² algorithm).
+
+    References
+    ----------
+    The P² Algorithm for Dynamic Calculation of Quantiles and Histograms Without Storing Observations
+            Raj Jain, Imrich Chlamtac (1985)
+            https://doi.org/10.1145/4372.4378
+    """
+
+    __slots__ = ("p", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def Add(self, x):
+        h, n = self.heights, self.positions
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= h[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                q = h[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                                                        + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < q < h[i + 1]:  # Parabolic estimate out of order; fall back to linear
+                    q = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = q
+                n[i] += d
+
+    @property
+    def Value(self):
+        h = self.heights
+        if len(h) == 5:
+            return h[2]
+        return sorted(h)[min(int(self.p * len(h)), len(h) - 1)] if h else float("nan")
+
+
+class JobTotalQuantiles(Monitor):
+    """
+    Streaming (P²) quantiles of the total time each job/set spends in system. Override :code:`Quantiles` in a
+    subclass to track others.
+    """
+
+    Quantiles = (0.5, 0.9, 0.95, 0.99)
+
+    def __init__(self):
+        super().__init__()
+        self.Estimators = [P2Quantile(p) for p in self.Quantiles]
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        for estimator in self.Estimators:
+            estimator.Add(now - arrive)
+
+    @property
+    def Data(self) -> dict:
+        return {estimator.p: estimator.Value for estimator in self.Estimators}
+
+    @property
+    def Name(self):
+        return "JobTotalQuantiles"
@@ -3,9 +3,17 @@ Basic building components (generators/processes) for parallel models. In general
 a model by defining an arrival, routing, and job/servicing process such that work is introduced in the order of
 Arrivals->Router->Job/Servicing.
 """
-from parallelqueue.arrivals import DefaultArrivals
-from parallelqueue.jobs import DefaultJob
-from parallelqueue.routers import DefaultRouter
+from functools import partial
+from itertools import repeat
+
+import numpy as np
+
+from parallelqueue.arrivals import DefaultArrivals, LazyArrivals
+from parallelqueue.distributions import BLOCK, Block, Distribution, PerServer, Sampler, Streams
+from parallelqueue.jobs import DefaultJob, JobName, LazyJob, StageJob
+from parallelqueue.queues import IndexedResource, LazyQueue, QueueIndex, StageState
+from parallelqueue.replications import Rebind
+from parallelqueue.routers import POLICIES, DefaultRouter, LazyRouter, Policy, StageRouter
 
 
 class Network:
@@ -13,13 +21,22 @@ class Network:
     The Network constructor allows a user to create a queueing network by overriding each member.
     Upon generation, jobs flow through a network in the order of: Arrivals → Router → Job. By default, the Network class
     can be used to handle JSQd, Redundancy-d, and Threshold-(d,r) models with general arrival and service distributions.
+    Its queues are built by :code:`Queue`.
     """
 
+    Queue = IndexedResource
+
     def __init__(self, **kwargs):
         self.network_args = {}  # Allow user to pass anything they deem fit.
         for k, v in kwargs.items():
             self.network_args[k] = v
 
+    def Build(self, system, env):
+        """Builds the queues of a run of the system (by :code:`Queue`), by their position in
+        :code:`system.QueueState`."""
+        capacities = system.capacities or [1] * system.parallelism
+        return {i: self.Queue(env, system.QueueState, i, capacities[i]) for i in range(system.parallelism)}
+
     @staticmethod
     def Job(system, env, name, arrive, queues, choice, **kwargs):
         """This generator/process defines the behaviour of a job (replica or original) after routing."""
@@ -32,3 +49,216 @@ class Network:
     def Arrivals(self, system, env, number, queues, **kwargs):
         """This generator/process defines how jobs enter the network"""
         return DefaultArrivals(self.Router, system, env, number, queues, **kwargs)
+
+
+class LazyNetwork(Network):
+    """
+    The default network without a process per job: Router and Job are plain function calls, waiting jobs are
+    entries of a `queues.LazyQueue` and a job in service has a single scheduled event (its departure). The number of
+    live generators and the size of the SimPy event queue then stay proportional to the number of busy servers
+    rather than to the number of jobs (and replicas) in the system.
+
+    Example
+    -------
+    .. code-block:: python
+
+        sim = ParallelQueueSystem(maxTime=100.0, parallelism=1000, seed=1234, d=3, Replicas=True,
+                                  Arrival=random.expovariate, AArgs=900,
+                                  Service=random.expovariate, SArgs=1, network=LazyNetwork)
+        sim.RunSim()
+    """
+
+    Queue = LazyQueue
+
+    @staticmethod
+    def Job(system, env, queue, **kwargs):
+        """Begins service at a queue whose server may be free (a function, not a process)."""
+        return LazyJob(system, env, queue, **kwargs)
+
+    def Router(self, system, env, name, queues, **kwargs):
+        """Routes a job (a function, not a process)."""
+        return LazyRouter(system, env, name, queues, **kwargs)
+
+    def Arrivals(self, system, env, number, queues, **kwargs):
+        """This generator/process defines how jobs enter the network"""
+        for queue in queues.values():
+            queue.serve = partial(self.Job, system, env, queue, **kwargs)
+        return LazyArrivals(self.Router, system, env, number, queues, **kwargs)
+
+
+class Stage:
+    """One stage of a `StagedNetwork`: a pool of queues with its own routing policy and service distribution.
+
+    :param parallelism: Number of queues.
+    :param Service: Service distribution of the stage (a function, or a `distributions.Distribution`).
+    :param SArgs: Parameters needed by the function.
+    :param d: Number of queues sampled by the router.
+    :param router: The routing policy of the stage, by name or as a subclass of `routers.Policy` (see
+        `routers.POLICIES`); :code:`"jsq"` by default.
+    :param fork: Number of tasks a job forks into at this stage (fork-join): each is routed in turn by the stage's
+        policy (the batch policies plan them together) and the job leaves the stage once all of them are served.
+    :param speeds: Speed factor of each queue (service times are divided by it). All 1 by default.
+    :param capacities: Number of servers of each queue. All 1 by default.
+    """
+
+    def __init__(self, parallelism, Service, SArgs=None, d=2, router="jsq", fork=1, speeds=None, capacities=None):
+        if parallelism < 1 or not 1 <= d <= parallelism:
+            raise ValueError("A stage needs at least one queue and 1 <= d <= parallelism.")
+        if not (isinstance(router, type) and issubclass(router, Policy)) and router not in POLICIES:
+            raise ValueError(f"Unknown router '{router}'; expected one of {', '.join(POLICIES)} or a Policy.")
+        if fork < 1 or fork != int(fork):
+            raise ValueError("fork must be a positive integer.")
+        for name, values in (("speeds", speeds), ("capacities", capacities)):
+            if values is not None and (len(values) != parallelism or min(values) <= 0):
+                raise ValueError(f"{name} needs one positive value per queue.")
+        self.parallelism = parallelism
+        self.Service = Service
+        self.SArgs = SArgs
+        self.d = d
+        self.router = router
+        self.fork = int(fork)
+        self.speeds = speeds
+        self.capacities = capacities
+        self.BatchSize = self.fork  # As read by the routing policies (see routers.BatchSampling)
+        self.Routing = None  # Policies sample with the random module
+
+    def __repr__(self):
+        return (f"Stage(parallelism={self.parallelism}, Service={self.Service!r}, SArgs={self.SArgs!r}, d={self.d}, "
+                f"router={self.router!r}, fork={self.fork})")
+
+
+def Transition(rng, probabilities):
+    """Draws outcomes (indices) with the given probabilities in NumPy blocks; an outcome which is certain is returned
+    without drawing."""
+    probabilities = np.asarray(probabilities, dtype=float)
+    if probabilities.max() == 1.0:
+        return partial(next, repeat(int(probabilities.argmax())))
+    return Block(partial(rng.choice, len(probabilities), BLOCK, p=probabilities / probabilities.sum()))
+
+
+class StagePool:
+    """The queues of a `Stage` during a run of a `StagedNetwork`.
+
+    :param stage: The stage.
+    :type stage: Stage
+    :param number: Its position among the stages.
+    :param state: Its slice of the system's queue index.
+    :type state: queues.StageState
+    :param queues: Its queues (numbered within the stage).
+    :type queues: List[queues.LazyQueue]
+    :param service: Its service distribution, as model arguments (:code:`Service` and :code:`SArgs`).
+    :param pools: The pools of every stage, indexed by position.
+
+    Attributes
+    ----------
+    Policy : routers.Policy
+        The stage's routing policy.
+    Jobs : dict
+        The `jobs.JobRecord` of each job at the stage, holding its tasks not yet served.
+    Next : callable
+        Draws the position of the next stage of a job leaving this one, or the number of stages if it leaves the
+        system (see `Transition`).
+    """
+
+    def __init__(self, stage, number, state, queues, service, pools):
+        self.Stage = stage
+        self.number = number
+        self.State = state
+        self.offset = state.offset
+        self.Queues = queues
+        self.Service = service
+        self.Policy = POLICIES.get(stage.router, stage.router)(stage)
+        self.Jobs = {}
+        self.Next = None
+        self.pools = pools
+
+    def Enter(self, system, env, name, arrive):
+        """A job enters the stage (see `routers.StageRouter`)."""
+        StageRouter(system, env, name, arrive, self)
+
+    def Successor(self):
+        """The stage a job leaving this one enters next, or :code:`None` if it leaves the system."""
+        following = self.Next()
+        return self.pools[following] if following < len(self.pools) else None
+
+
+class StagedNetwork(LazyNetwork):
+    """
+    A network of stages, each a pool of queues with its own routing policy and service (see `Stage`), as built by
+    `base_models.StagedQueueSystem`. An arriving job enters the stage drawn from :code:`Entry`; once served there (all
+    of its tasks, at a fork-join stage) it moves to stage j with probability :code:`Transitions[i][j]`, or leaves the
+    system with the rest of the row's probability. Stages are drawn in NumPy blocks per row. The queues of all
+    stages make up :code:`system.QueueState`, stage after stage, so monitors see the whole network.
+
+    As in `LazyNetwork`, there is no process per job: moving between stages is a plain call, and a task in service has
+    a single scheduled event, so deep pipelines scale as a single stage does. Monitors are told of a job's arrival
+    and departure from the system, of the queues it joins at each stage and of the start of each task's service.
+    """
+
+    def Build(self, system, env):
+        """Builds the queues of every stage, their index and policies."""
+        if "Stages" not in system.kwargs:
+            raise ValueError("A StagedNetwork needs Stages (see base_models.StagedQueueSystem).")
+        if system.crn:
+            raise ValueError("Staged networks do not draw common random numbers.")
+        stages = system.kwargs["Stages"]
+        policies = [POLICIES.get(stage.router, stage.router) for stage in stages]
+        mean = None
+        if any(policy.work for policy in policies):
+            mean = np.concatenate([np.full(stage.parallelism, StageMean(stage) if policy.work else np.nan)
+                                   for stage, policy in zip(stages, policies)])
+        index = system.QueueState = QueueIndex(system.parallelism, False, system.speeds, system.capacities, mean, env)
+        capacities = system.capacities or [1] * system.parallelism
+        streams = Streams(system.seed, system.parallelism)
+        self.Pools, offset, queues = [], 0, {}
+        for number, stage in enumerate(stages):
+            pool = [self.Queue(env, index, offset + i, capacities[offset + i]) for i in range(stage.parallelism)]
+            service = Rebind(stage.Service)
+            if isinstance(service, Distribution):
+                service = PerServer(service, streams.Service)  # By the queue's position in the system
+            self.Pools.append(StagePool(stage, number, StageState(index, offset, stage.parallelism), pool,
+                                        {"Service": service, "SArgs": stage.SArgs}, self.Pools))
+            queues.update(enumerate(pool, offset))
+            offset += stage.parallelism
+        for pool, row in zip(self.Pools, system.kwargs["Transitions"]):
+            pool.Next = Transition(streams.Routing, list(row) + [max(0.0, 1 - sum(row))])
+        self.Entry = Transition(streams.Routing, system.kwargs["Entry"])
+        self.owner = [pool for pool in self.Pools for _ in range(pool.Stage.parallelism)]
+        if any(pool.Policy.Update is not None for pool in self.Pools):
+            index.Watcher = self.Watch
+        return queues
+
+    def Watch(self, state, queue):
+        """Tells the policy of a queue's stage of a change at the queue (see `queues.QueueIndex.Watcher`)."""
+        pool = self.owner[queue]
+        if pool.Policy.Update is not None:
+            pool.Policy.Update(pool.State, queue - pool.offset)
+
+    @staticmethod
+    def Job(system, env, pool, queue):
+        """Begins service at a queue of a stage whose server may be free (a function, not a process)."""
+        return StageJob(system, env, pool, queue)
+
+    def Router(self, system, env, name, queues, **kwargs):
+        """Routes an arriving job to its first stage (a function, not a process)."""
+        arrive = env.now
+        for hook in system.Events.on_arrival:
+            hook(system, arrive, name)
+        if system.doPrint:
+            print(f'{arrive:7.4f} {JobName(name)}: Arrival')
+        self.Pools[self.Entry()].Enter(system, env, name, arrive)
+
+    def Arrivals(self, system, env, number, queues, **kwargs):
+        """This generator/process defines how jobs enter the network"""
+        for pool in self.Pools:
+            for queue in pool.Queues:
+                queue.serve = partial(self.Job, system, env, pool, queue)
+        return LazyArrivals(self.Router, system, env, number, queues, **kwargs)
+
+
+def StageMean(stage):
+    """The mean service time of a stage, for the policies routing by work."""
+    try:
+        return Sampler(Rebind(stage.Service), stage.SArgs).Mean
+    except NotImplementedError:
+        raise ValueError("Routing by work needs a service distribution with a known mean.") from None
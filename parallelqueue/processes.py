@@ -0,0 +1,290 @@
+"""
+Arrival processes whose rate varies over time: non-homogeneous Poisson arrivals (`NHPP`), with a piecewise-constant
+rate (e.g. a daily cycle) or any rate function below a bound, and Markov-modulated Poisson arrivals (`MMPP`), whose
+rate switches with the state of a hidden Markov chain (e.g. flash crowds). Each can be passed as :code:`Arrival`
+wherever a `distributions.Distribution` can, and with a batch size distribution (the :code:`batch` argument of
+`base_models.ParallelQueueSystem`) makes a compound process.
+
+Unlike a distribution, a process is not drawn independently: it keeps a clock, which starts with the run. As with
+any arrival distribution, the first job arrives at time 0; the process then gives the times of the jobs after it.
+
+Arrivals are generated in NumPy blocks by time change: the rate, integrated over time, maps a unit-rate Poisson
+process (cumulative sums of exponential variates) onto the process, so each arrival is found by a binary search
+over the pieces of the rate and no sample is wasted, however large the ratio of the peak rate to the mean. A rate
+function which is not piecewise-constant is handled by thinning the arrivals of a piecewise-constant bound; the cost
+per arrival is then the ratio of the bound to the rate, which a bound with pieces that follow the rate keeps close
+to 1.
+
+Example
+-------
+.. code-block:: python
+
+    # A daily cycle (in hours): 20 jobs an hour at night, 200 by day and 500 at the evening peak
+    daily = NHPP([20, 200, 500, 20], times=[0, 7, 18, 21], period=24)
+    # Flash crowds: a rate of 1000 for about 10 minutes an hour, else 100
+    bursts = MMPP([[-1, 1], [6, -6]], [100, 1000])
+    sim = JSQd(maxTime=24 * 30, parallelism=100, seed=1234, d=2, Arrival=daily, AArgs=None,
+               Service=Exponential(3), SArgs=None, batch=Geometric(2.5))
+"""
+from bisect import bisect_right
+from math import ceil, inf
+
+import numpy as np
+
+from parallelqueue.distributions import BLOCK, Block, Distribution
+
+
+class ArrivalProcess(Distribution):
+    """Base class of the arrival processes, whose successive interarrival times depend on time (or on a hidden
+    state). Subclasses implement `Blocks`, which keeps the state of the process between blocks; each `Bind` starts
+    the process anew.
+
+    :param block: Number of arrivals generated per block (at least).
+    """
+
+    def Blocks(self, rng, size):
+        """Yields blocks of consecutive interarrival times, drawn from the generator :code:`rng`, the first being
+        the time of the first arrival after time 0."""
+        raise NotImplementedError
+
+    def Draw(self, rng, size):
+        raise TypeError(f"{type(self).__name__} is a process; its interarrival times are not drawn independently "
+                        "(see Bind).")
+
+    def Bind(self, rng, block=None):
+        return Block(Gaps(self.Blocks(rng, block or self.block)).__next__)
+
+
+def Gaps(blocks):
+    """Interarrival times from blocks of arrival times (after time 0)."""
+    last = 0.0
+    for times in blocks:
+        yield np.diff(times, prepend=last) if last != inf else np.full(len(times), inf)
+        last = times[-1]
+
+
+def Events(rng, size, chunks):
+    """Yields the arrival times of a Poisson process with a piecewise-constant rate, a block of at least
+    :code:`size` at a time, and the rate at each arrival. Unit-rate arrivals (cumulative sums of exponential
+    variates) are mapped onto the process by inverting its integrated rate: a binary search over the pieces of the
+    current chunk, and a division. If the rate falls to 0 forever, the last arrival is at infinity.
+
+    :param rng: The stream's generator.
+    :param size: Number of unit-rate arrivals drawn at once.
+    :param chunks: Iterable of consecutive chunks of the rate, each a tuple (starts, rates, end) of the start time
+        and rate of each of its pieces (NumPy arrays) and the time it ends (the next one's start). Each should hold
+        enough pieces for about :code:`size` arrivals, so as to keep the blocks large.
+    """
+    level = 0.0  # Integrated rate at the start of the chunk
+    targets = np.cumsum(rng.exponential(1.0, size))  # Unit-rate arrivals yet to be mapped
+    times, rates, count = [], [], 0
+    for starts, pieces, end in chunks:
+        widths = np.diff(starts, append=end)
+        with np.errstate(invalid="ignore"):
+            integrals = pieces * widths
+        if end == inf:
+            integrals[-1] = inf if pieces[-1] > 0 else 0.0
+        levels = level + np.concatenate(([0.0], np.cumsum(integrals[:-1])))
+        top = levels[-1] + integrals[-1]
+        while True:
+            inside = np.searchsorted(targets, top, side="right")
+            if inside:
+                mapped = targets[:inside]
+                piece = np.searchsorted(levels, mapped, side="right") - 1
+                times.append(starts[piece] + (mapped - levels[piece]) / pieces[piece])
+                rates.append(pieces[piece])
+                count += inside
+            if count >= size:
+                yield np.concatenate(times), np.concatenate(rates)
+                times, rates, count = [], [], 0
+            if inside < len(targets):
+                targets = targets[inside:]
+                break
+            targets = targets[-1] + np.cumsum(rng.exponential(1.0, size))
+        if end == inf:  # The rate is 0 from the last piece on
+            break
+        level = top
+    times.append([inf])
+    rates.append([0.0])
+    yield np.concatenate(times), np.concatenate(rates)
+    while True:
+        yield np.array([inf]), np.array([0.0])
+
+
+class NHPP(ArrivalProcess):
+    """Non-homogeneous Poisson arrivals. The rate is either piecewise-constant (given by :code:`times`), generated
+    by time change, or a function of time below a :code:`bound`, generated by thinning the arrivals at the bound's
+    rate (see the module description).
+
+    :param rate: The rate of each piece (with :code:`times`), or a function of time, which is called with NumPy arrays
+        of times and returns the rate at each.
+    :param times: Start time of each piece of a piecewise-constant rate, from 0 in increasing order. The last piece
+        lasts until the end of the period or, without one, forever.
+    :param period: If given, the rate repeats with this period (e.g. 24 for a daily cycle in hours).
+    :param bound: With a rate function, a bound on it: a rate, or a piecewise-constant `NHPP`. Each arrival at the
+        bound's rate is kept with probability rate / bound, so the closer the bound, the fewer are drawn. A rate found
+        above its bound raises a :code:`ValueError`.
+    """
+
+    def __init__(self, rate, times=None, period=None, bound=None, block=BLOCK):
+        super().__init__(block)
+        if times is None:
+            if not callable(rate):
+                raise ValueError("NHPP needs either the start times of the pieces of its rate, or a rate function.")
+            if bound is None:
+                raise ValueError("A rate function needs a bound to be thinned from.")
+            if not isinstance(bound, NHPP):
+                bound = NHPP([bound], times=[0.0])
+            if bound.times is None:
+                raise ValueError("The bound of a rate function must be piecewise-constant.")
+        else:
+            rate = np.asarray(rate, dtype=float)
+            times = np.asarray(times, dtype=float)
+            if rate.ndim != 1 or len(rate) != len(times) or not len(rate):
+                raise ValueError("NHPP needs one rate per start time.")
+            if times[0] != 0 or (np.diff(times) <= 0).any():
+                raise ValueError("The start times of the pieces must increase from 0.")
+            if (rate < 0).any():
+                raise ValueError("Rates must be nonnegative.")
+            if period is not None:
+                if period <= times[-1]:
+                    raise ValueError("The period must end after the start of the last piece.")
+                if not (rate * np.diff(times, append=period)).sum() > 0:
+                    raise ValueError("A periodic rate must not be 0 over a whole period.")
+        self.rate = rate
+        self.times = times
+        self.period = period
+        self.bound = bound
+
+    def Chunks(self, size):
+        """Yields consecutive chunks of the piecewise-constant rate (see `Events`), each holding about :code:`size`
+        arrivals (or a whole number of periods)."""
+        times, rate = self.times, self.rate
+        if self.period is not None:
+            mean = (rate * np.diff(times, append=self.period)).sum()
+            periods = max(1, min(ceil(size / mean), ceil(size / len(times))))
+            offsets = np.repeat(np.arange(periods) * self.period, len(times))
+            starts, rates = np.tile(times, periods) + offsets, np.tile(rate, periods)
+            length = periods * self.period
+            start = 0.0
+            while True:
+                yield starts + start, rates, start + length
+                start += length
+        if len(times) > 1:
+            yield times[:-1], rate[:-1], times[-1]
+        start, last = times[-1], rate[-1]
+        if last == 0:
+            yield np.array([start]), np.array([0.0]), inf
+            return
+        length = size / last
+        while True:  # At the last rate from here on
+            yield np.array([start]), np.array([last]), start + length
+            start += length
+
+    def Blocks(self, rng, size):
+        if self.times is not None:
+            for times, _ in Events(rng, size, self.Chunks(size)):
+                yield times
+            return
+        for times, bounds in Events(rng, size, self.bound.Chunks(size)):
+            if times[0] == inf:
+                yield times
+                continue
+            finite = times != inf  # The bound may fall to 0
+            rates = np.broadcast_to(np.asarray(self.rate(times[finite]), dtype=float), finite.sum())
+            if (rates > bounds[finite] * (1 + 1e-9)).any():
+                at = times[finite][np.argmax(rates > bounds[finite] * (1 + 1e-9))]
+                raise ValueError(f"The rate exceeds its bound at time {at}.")
+            kept = np.ones(len(times), dtype=bool)
+            kept[finite] = rng.random(finite.sum()) * bounds[finite] < rates
+            if kept.any():
+                yield times[kept]
+
+    @property
+    def Mean(self):
+        """Mean interarrival time in the long run (of a piecewise-constant rate)."""
+        if self.times is None:
+            raise NotImplementedError
+        if self.period is None:
+            return 1 / self.rate[-1] if self.rate[-1] > 0 else inf
+        return self.period / (self.rate * np.diff(self.times, append=self.period)).sum()
+
+    def __repr__(self):
+        rate = self.rate.tolist() if isinstance(self.rate, np.ndarray) else self.rate
+        times = self.times.tolist() if self.times is not None else None
+        return f"NHPP(rate={rate!r}, times={times!r}, period={self.period!r}, bound={self.bound!r})"
+
+
+class MMPP(ArrivalProcess):
+    """Markov-modulated Poisson arrivals: Poisson arrivals at :code:`rates[i]` while a continuous-time Markov chain
+    is in state i. The chain's path is drawn a chunk of sojourns at a time, and arrivals over it by time change (see
+    the module description), so the cost is O(1) per arrival and per change of state.
+
+    :param generator: Generator matrix of the chain (each row's off-diagonal rates of leaving the state for the others
+        summing to minus its diagonal entry).
+    :param rates: Arrival rate in each state.
+    :param initial: Distribution of the chain's initial state; its stationary distribution by default.
+    """
+
+    def __init__(self, generator, rates, initial=None, block=BLOCK):
+        super().__init__(block)
+        generator = np.asarray(generator, dtype=float)
+        rates = np.asarray(rates, dtype=float)
+        states = len(rates)
+        if generator.shape != (states, states):
+            raise ValueError("MMPP needs a square generator matrix with one row per rate.")
+        off = generator - np.diag(np.diag(generator))
+        if (off < 0).any() or not np.allclose(generator.sum(axis=1), 0):
+            raise ValueError("A generator matrix has nonnegative off-diagonal entries and rows summing to 0.")
+        if (rates < 0).any():
+            raise ValueError("Rates must be nonnegative.")
+        self.generator = generator
+        self.rates = rates
+        self.initial = self.Stationary() if initial is None else np.asarray(initial, dtype=float)
+        if len(self.initial) != states or (self.initial < 0).any() or not np.isclose(self.initial.sum(), 1):
+            raise ValueError("The initial distribution needs a probability per state.")
+
+    def Stationary(self):
+        """The stationary distribution of the chain (the least-squares solution, if not unique)."""
+        states = len(self.rates)
+        system = np.vstack([self.generator.T, np.ones(states)])
+        pi = np.linalg.lstsq(system, np.append(np.zeros(states), 1.0), rcond=None)[0]
+        pi = np.clip(pi, 0, None)
+        return pi / pi.sum()
+
+    def Chunks(self, rng, size):
+        """Yields the path of the chain in chunks of :code:`size` sojourns (see `Events`)."""
+        leave = -np.diag(self.generator) + 0.0  # Not -0.0 where absorbing
+        jumps = self.generator / np.where(leave > 0, leave, 1)[:, None]
+        np.fill_diagonal(jumps, 0)
+        cumulative = [np.cumsum(row).tolist() for row in jumps]
+        state = min(bisect_right(np.cumsum(self.initial).tolist(), float(rng.random())), len(self.rates) - 1)
+        start = 0.0
+        while True:
+            path = []
+            for u in rng.random(size).tolist():
+                path.append(state)
+                if not leave[state]:
+                    break  # Absorbed
+                state = min(bisect_right(cumulative[state], u * cumulative[state][-1]), len(self.rates) - 1)
+            path = np.array(path)
+            with np.errstate(divide="ignore"):
+                holding = rng.exponential(1.0, len(path)) / leave[path]
+            starts = start + np.concatenate(([0.0], np.cumsum(holding[:-1])))
+            start = starts[-1] + holding[-1]
+            yield starts, self.rates[path], start
+            if start == inf:
+                return
+
+    def Blocks(self, rng, size):
+        for times, _ in Events(rng, size, self.Chunks(rng, size)):
+            yield times
+
+    @property
+    def Mean(self):
+        """Mean interarrival time in the long run."""
+        rate = float(self.Stationary() @ self.rates)
+        return 1 / rate if rate > 0 else inf
+
+    def __repr__(self):
+        return f"MMPP(generator={self.generator.tolist()!r}, rates={self.rates.tolist()!r})"
@@ -0,0 +1,364 @@
+"""
+Shared queue state of a parallel system. A `QueueIndex` holds the occupancy of every queue in NumPy arrays which are
+updated incrementally on enqueue, service start and departure (rather than recomputed from the resources), so that
+routers read d sampled queues in O(d) and monitors take full snapshots as array copies. It also holds the speed and
+number of servers of each queue and, if routing needs it, each queue's remaining work.
+"""
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+from simpy import Resource
+from simpy.resources.resource import Request
+
+
+class MinBuckets:
+    """Queues bucketed by their number in system, each bucket kept sorted, so that JSQ over all queues finds the
+    shortest queues without a linear scan.
+
+    :param parallelism: Number of queues (all initially empty).
+    """
+
+    def __init__(self, parallelism):
+        self.levels = [list(range(parallelism))]
+        self.least = 0
+
+    def Move(self, queue, old, new):
+        """Moves a queue from the bucket of :code:`old` jobs to that of :code:`new` (:code:`old ± 1`) jobs."""
+        level = self.levels[old]
+        del level[bisect_left(level, queue)]
+        if new == len(self.levels):
+            self.levels.append([])
+        insort(self.levels[new], queue)
+        if new < self.least:
+            self.least = new
+        elif old == self.least and not level:
+            self.least = new
+
+    @property
+    def Shortest(self):
+        """The (sorted) queues with the least number in system. Not to be modified."""
+        return self.levels[self.least]
+
+
+class QueueIndex:
+    """Occupancy of each queue in a system.
+
+    :param parallelism: Number of queues in parallel.
+    :param buckets: If true, also maintains `MinBuckets` (for JSQ over all queues).
+    :param speeds: Speed factor of each queue's servers (service takes a job's size divided by it); 1 by default.
+    :param capacities: Number of servers of each queue; 1 by default.
+    :param mean: If given, the mean job size, and the remaining work of each queue is tracked (see `Remaining`).
+    :param clock: Object exposing the current time as :code:`now` (e.g. the :code:`simpy.Environment`), needed to
+        track work.
+
+    Attributes
+    ----------
+    InSystem : numpy.ndarray
+        Number of jobs (or replicas) at each queue, waiting or in service.
+    Busy : numpy.ndarray
+        Number of jobs in service at each queue.
+    Total : int
+        Number of jobs (or replicas) in the whole system.
+    Speed : numpy.ndarray
+        Speed factor of each queue.
+    Capacity : numpy.ndarray
+        Number of servers of each queue.
+    Rate : numpy.ndarray
+        Total speed of each queue's servers (:code:`Speed * Capacity`).
+    Expected : list
+        Mean service time at each queue (if work is tracked).
+    """
+
+    def __init__(self, parallelism, buckets=False, speeds=None, capacities=None, mean=None, clock=None):
+        self.InSystem = np.zeros(parallelism, dtype=np.int64)
+        self.Busy = np.zeros(parallelism, dtype=np.int64)
+        self.Total = 0
+        self.Buckets = MinBuckets(parallelism) if buckets else None
+        self.Speed = np.ones(parallelism) if speeds is None else np.asarray(speeds, dtype=float)
+        self.Capacity = np.ones(parallelism, dtype=np.int64) if capacities is None else np.asarray(capacities)
+        self.Rate = self.Speed * self.Capacity
+        self.clock = clock
+        self.Watcher = None  # Called with each queue which changed (e.g. routers.Policy.Update)
+        if mean is not None:
+            self.Expected = (mean / self.Speed).tolist()
+            self.Work = [0.0] * parallelism  # Work at each queue as of its last update, drained by its busy servers
+            self.Updated = [0.0] * parallelism
+        else:
+            self.Expected = self.Work = self.Updated = None
+
+    def Sync(self, queue):
+        """Brings the remaining work of a queue up to the current time (before the number of busy servers changes)."""
+        now = self.clock.now
+        self.Work[queue] -= self.Busy[queue] * (now - self.Updated[queue])
+        self.Updated[queue] = now
+
+    def Remaining(self, queue):
+        """Remaining work at a queue, in units of its service time: the residual service of its jobs in service and
+        the mean service time of each job waiting (whose size is not yet drawn). Computed in O(1)."""
+        work = self.Work[queue] - self.Busy[queue] * (self.clock.now - self.Updated[queue])
+        return work if work > 0 else 0.0
+
+    def Enqueue(self, queue):
+        """A job joins the queue."""
+        self.InSystem[queue] += 1
+        self.Total += 1
+        if self.Buckets is not None:
+            n = self.InSystem[queue]
+            self.Buckets.Move(queue, n - 1, n)
+        if self.Work is not None:
+            self.Work[queue] += self.Expected[queue]
+        if self.Watcher is not None:
+            self.Watcher(self, queue)
+
+    def Start(self, queue):
+        """A job at the queue enters service."""
+        if self.Work is not None:
+            self.Sync(queue)
+        self.Busy[queue] += 1
+        if self.Watcher is not None:
+            self.Watcher(self, queue)
+
+    def Assign(self, queue, time):
+        """A job which entered service at the queue will be served for :code:`time` (replacing its mean)."""
+        if self.Work is not None:
+            self.Work[queue] += time - self.Expected[queue]
+            if self.Watcher is not None:
+                self.Watcher(self, queue)
+
+    def Leave(self, queue, served=True, residual=0.0):
+        """A job leaves the queue, either from service or (e.g. if cancelled) from waiting.
+
+        :param residual: Service time it had left, if leaving service early (:code:`None` if it was never assigned
+            one).
+        """
+        if self.Work is not None:
+            self.Sync(queue)
+            self.Work[queue] -= self.Expected[queue] if not served or residual is None else residual
+        self.InSystem[queue] -= 1
+        self.Total -= 1
+        if served:
+            self.Busy[queue] -= 1
+        if self.Buckets is not None:
+            n = self.InSystem[queue]
+            self.Buckets.Move(queue, n + 1, n)
+        if self.Watcher is not None:
+            self.Watcher(self, queue)
+
+    def Waiting(self):
+        """Number of jobs waiting at each queue (a new array)."""
+        return self.InSystem - self.Busy
+
+    def Snapshot(self):
+        """Number in system at each queue (a new array)."""
+        return self.InSystem.copy()
+
+
+class StageState:
+    """The queues of one stage of a `network.StagedNetwork` as its routing policy reads them: a slice of the
+    system's `QueueIndex`, with queues numbered within the stage. Its arrays are views of the index's, so they are
+    never out of date.
+
+    :param index: The index of all the queues of the system.
+    :type index: QueueIndex
+    :param offset: Position of the stage's first queue in the index.
+    :param parallelism: Number of queues of the stage.
+    """
+
+    Buckets = None  # JSQ over all of a stage's queues parses them
+
+    def __init__(self, index, offset, parallelism):
+        part = slice(offset, offset + parallelism)
+        self.index = index
+        self.offset = offset
+        self.InSystem = index.InSystem[part]
+        self.Busy = index.Busy[part]
+        self.Speed = index.Speed[part]
+        self.Capacity = index.Capacity[part]
+        self.Rate = index.Rate[part]
+        self.Expected = index.Expected[part] if index.Expected is not None else None
+        self.clock = index.clock
+
+    def Remaining(self, queue):
+        """Remaining work at a queue of the stage (see `QueueIndex.Remaining`)."""
+        return self.index.Remaining(self.offset + queue)
+
+
+class PutQueue(deque):
+    """Waiting requests of an `IndexedResource`. Cancelled requests stay put until they reach the front (where they
+    are dropped), but no longer count towards its length."""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = 0
+
+    def __len__(self):
+        return deque.__len__(self) - self.cancelled
+
+
+class IndexedRequest(Request):
+    """A request of an `IndexedResource`, which may be cancelled (see `IndexedResource.Cancel`)."""
+
+    cancelled = False
+    finish = None  # Time its service ends, once assigned
+
+    def cancel(self):
+        if not self.cancelled:
+            super().cancel()
+
+
+class IndexedResource(Resource):
+    """A :code:`simpy.Resource` which keeps its entry of a `QueueIndex` up to date.
+
+    :param env: Environment for the simulation.
+    :type env: simpy.Environment
+    :param index: The index to update.
+    :type index: QueueIndex
+    :param queue: This resource's position in the index.
+    :type queue: int
+    :param capacity: Number of servers.
+    """
+
+    PutQueue = PutQueue
+
+    def __init__(self, env, index, queue, capacity=1):
+        super().__init__(env, capacity=capacity)
+        self.index = index
+        self.queue = queue
+
+    def request(self):
+        self.index.Enqueue(self.queue)
+        return IndexedRequest(self)
+
+    def Assign(self, request, time):
+        """Records the service time of a request which entered service (for the remaining work of the index)."""
+        request.finish = self._env.now + time
+        self.index.Assign(self.queue, time)
+
+    def Cancel(self, request):
+        """Withdraws a request (e.g. a replica no longer needed) in O(1), without interrupting its process. A waiting
+        request is skipped once it reaches the front of the queue; one in service frees its server at once. The
+        process holding a cancelled request is never resumed while waiting; if in service, it should check
+        :code:`request.cancelled` when it resumes.
+
+        :param request: A request of this resource which has not been released.
+        :type request: IndexedRequest
+        """
+        request.cancelled = True
+        if request in self.users:
+            self.users.remove(request)
+            self.index.Leave(self.queue, True, Residual(request, self._env))
+            self._trigger_put(None)
+        else:
+            self.put_queue.cancelled += 1
+            self.index.Leave(self.queue, False)
+
+    def _trigger_put(self, get_event):
+        queue = self.put_queue
+        while deque.__len__(queue) and len(self.users) < self.capacity:
+            event = queue.popleft()
+            if event.cancelled:
+                queue.cancelled -= 1
+                continue
+            self.users.append(event)
+            event.usage_since = self._env.now
+            event.succeed()
+            self.index.Start(self.queue)
+
+    def _do_get(self, event):
+        if event.request.cancelled:  # Already left
+            event.succeed()
+            return
+        served = event.request in self.users
+        super()._do_get(event)
+        self.index.Leave(self.queue, served)
+
+
+def Residual(request, env):
+    """Service time a request (or entry) in service has left, or :code:`None` if it was not yet assigned one."""
+    return request.finish - env.now if request.finish is not None else None
+
+
+class QueueEntry:
+    """A job (or replica) waiting in or served by a `LazyQueue`; plain data, with no process of its own.
+
+    :param resource: The queue it joined.
+    :type resource: LazyQueue
+    :param name: Identifier for the job.
+    :type name: int
+    :param arrive: Time of arrival.
+    :type arrive: float
+    """
+
+    __slots__ = ("resource", "name", "arrive", "cancelled", "finish")
+
+    def __init__(self, resource, name, arrive):
+        self.resource = resource
+        self.name = name
+        self.arrive = arrive
+        self.cancelled = False
+        self.finish = None
+
+
+class LazyQueue:
+    """A FCFS queue of `QueueEntry` objects for `network.LazyNetwork`, keeping its entry of a `QueueIndex` up to date.
+    Waiting jobs are entries of a deque; only jobs in service have anything scheduled (their departure). It exposes
+    :code:`put_queue` and :code:`users` as a :code:`simpy.Resource` does, for monitors.
+
+    :param env: Environment for the simulation.
+    :type env: simpy.Environment
+    :param index: The index to update.
+    :type index: QueueIndex
+    :param queue: This queue's position in the index.
+    :type queue: int
+    :param capacity: Number of servers.
+    """
+
+    def __init__(self, env, index, queue, capacity=1):
+        self.env = env
+        self.index = index
+        self.queue = queue
+        self.capacity = capacity
+        self.put_queue = PutQueue()
+        self.users = []
+        self.serve = None  # Called whenever a server may have become free (set by the network)
+
+    def Join(self, entry):
+        self.index.Enqueue(self.queue)
+        self.put_queue.append(entry)
+
+    def Next(self):
+        """Moves the next entry still needed into service and returns it, or :code:`None` if every server is busy
+        or nothing is waiting."""
+        queue = self.put_queue
+        while deque.__len__(queue) and len(self.users) < self.capacity:
+            entry = queue.popleft()
+            if entry.cancelled:
+                queue.cancelled -= 1
+                continue
+            self.users.append(entry)
+            self.index.Start(self.queue)
+            return entry
+        return None
+
+    def Assign(self, entry, time):
+        """Records the service time of an entry which entered service (for the remaining work of the index)."""
+        entry.finish = self.env.now + time
+        self.index.Assign(self.queue, time)
+
+    def Release(self, entry):
+        """Removes an entry which completed service."""
+        self.users.remove(entry)
+        self.index.Leave(self.queue, True)
+
+    def Cancel(self, entry):
+        """Withdraws an entry in O(1), as `IndexedResource.Cancel` does a request: a waiting entry is skipped once it
+        reaches the front of the queue; one in service frees its server at once (its departure is then ignored)."""
+        entry.cancelled = True
+        if entry in self.users:
+            self.users.remove(entry)
+            self.index.Leave(self.queue, True, Residual(entry, self.env))
+            self.serve()
+        else:
+            self.put_queue.cancelled += 1
+            self.index.Leave(self.queue, False)
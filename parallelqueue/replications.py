@@ -0,0 +1,227 @@
+"""
+Independent replications of a `base_models.ParallelQueueSystem`, spread across a process pool. Each replication is
+given its own seed through :code:`numpy.random.SeedSequence.spawn` (so results do not depend on the number of workers)
+and sends back only a compact summary of its run. With common random numbers, replications can be run in antithetic
+pairs and corrected by an M/M/1 control variate (see `variance`).
+"""
+import random
+from os import cpu_count
+from statistics import NormalDist
+
+import numpy as np
+
+from parallelqueue.monitors import Monitor
+from parallelqueue.variance import Baseline, BaselineMean, ControlVariate
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Summary(Monitor):
+    """
+    Keeps what a replication reports: response times and the time-integral of the number in system, read from
+    :code:`system.QueueState` (so replicas count towards the queues they wait in).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.Times = []
+        self.Area = 0.0
+        self.Last = 0.0
+
+    def Advance(self, now, total):
+        self.Area += total * (now - self.Last)
+        self.Last = now
+
+    def on_arrival(self, system, now, job):  # Hooks precede any change at this time
+        self.Advance(now, system.QueueState.Total)
+
+    def on_departure(self, system, now, job, queue, arrive, start):
+        self.Advance(now, system.QueueState.Total)
+        self.Times.append(now - arrive)
+
+    def Report(self, system, quantiles=QUANTILES):
+        """The summary of a finished run: number of jobs served, mean and quantiles of their response times and the
+        time-average number in system per queue.
+
+        :param system: The system observed.
+        :type system: base_models.ParallelQueueSystem
+        :param quantiles: Response time quantiles to report.
+        """
+        if system.maxTime is not None:
+            self.Advance(system.maxTime, system.QueueState.Total)
+        times = np.asarray(self.Times)
+        report = {"jobs": len(times), "mean": float(times.mean()) if len(times) else np.nan}
+        for q in quantiles:
+            report[f"q{q:g}"] = float(np.quantile(times, q)) if len(times) else np.nan
+        report["queue"] = self.Area / self.Last / system.parallelism if self.Last > 0 else np.nan
+        return report
+
+    @property
+    def Name(self):
+        return "Summary"
+
+
+def Rebind(value):
+    """Functions bound to a :code:`random.Random` instance (e.g. :code:`random.expovariate`) are pickled along with a
+    copy of it; point them back at the module-level generator, which the system seeds."""
+    if isinstance(getattr(value, "__self__", None), random.Random) and hasattr(random, value.__name__):
+        return getattr(random, value.__name__)
+    return value
+
+
+def Specification(system):
+    """The (picklable) arguments which rebuild :code:`system` up to its seed and monitors."""
+    kwargs = {k: v for k, v in system.kwargs.items() if k != "Monitors"}
+    return {"parallelism": system.parallelism, "d": system.d, "r": system.r, "maxTime": system.maxTime,
+            "infiniteJobs": system.infiniteJobs, "numberJobs": system.Number,
+            "Replicas": system.ReplicaDict is not None, "network": system.network, "engine": system.engine,
+            "cancel": system.cancel, "crn": system.crn, "antithetic": system.antithetic, "speeds": system.speeds,
+            "capacities": system.capacities, "router": system.router, "batch": system.batch, "kwargs": kwargs}
+
+
+TEMPLATE = None  # Specification prepared by Prepare for the replications run in this process
+
+
+def Template(specification):
+    """The specification with its model arguments rebound (see `Rebind`), ready to build systems from."""
+    template = dict(specification)
+    template["kwargs"] = {k: Rebind(v) for k, v in specification["kwargs"].items()}
+    return template
+
+
+def Prepare(specification=None):
+    """Initializer of worker processes: imports the models once per process rather than in the first task and, if
+    given, prepares the specification shared by every replication the process runs (passed to `Replicate` as
+    :code:`None`), which is then neither pickled nor rebound once per task.
+
+    :param specification: Output of :code:`Specification`.
+    """
+    global TEMPLATE
+    import parallelqueue.base_models  # noqa: F401
+    TEMPLATE = None if specification is None else Template(specification)
+
+
+def Replicate(specification, replication, seed, quantiles=QUANTILES, control=False, antithetic=None):
+    """Runs a single replication and returns its summary.
+
+    :param specification: Output of :code:`Specification`, or :code:`None` for the one prepared by `Prepare`.
+    :param replication: Index of the replication.
+    :param seed: Seed of this replication.
+    :param quantiles: Response time quantiles to report.
+    :param control: Whether to report the mean response time of the M/M/1 baseline, as :code:`"baseline"` (see
+        `variance.Baseline`).
+    :param antithetic: If given, whether this replication is an antithetic twin (in place of the specification's).
+    """
+    from parallelqueue.base_models import ParallelQueueSystem  # Avoid a circular import
+
+    spec = dict(TEMPLATE if specification is None else Template(specification))
+    kwargs = spec.pop("kwargs")
+    if antithetic is not None:
+        spec["antithetic"] = antithetic
+    sim = ParallelQueueSystem(seed=seed, Monitors=[Summary], **spec, **kwargs)
+    sim.RunSim()
+    report = sim.MonitorHolder["Summary"].Report(sim, quantiles)
+    if control:
+        report["baseline"] = Baseline(sim)
+    return {"replication": replication, "seed": seed, "antithetic": sim.antithetic, **report}
+
+
+def Seeds(seed, n):
+    """Seeds for n replications, each from its own child of :code:`numpy.random.SeedSequence(seed)`."""
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n)]
+
+
+class ReplicationRunner:
+    """Runs independent replications of a system in a :code:`concurrent.futures.ProcessPoolExecutor`.
+
+    :param system: The system to replicate; its own seed is the root of every replication's seed.
+    :type system: base_models.ParallelQueueSystem
+    :param workers: Number of processes. Defaults to the number of CPUs; with 1, replications run in this process.
+    :param quantiles: Response time quantiles to report.
+    :param antithetic: If true, replications are run in pairs sharing a seed, the second being the antithetic twin of
+        the first (the system must use common random numbers).
+    :param control: If true, each replication also reports its M/M/1 baseline (see `variance.Baseline`), by which
+        `Estimate` corrects the mean response time.
+
+    Example
+    -------
+    .. code-block:: python
+
+        sim = JSQd(maxTime=1000.0, parallelism=100, seed=1234, d=2,
+                   Arrival=random.expovariate, AArgs=50,
+                   Service=random.expovariate, SArgs=1)
+        runner = ReplicationRunner(sim, workers=4)
+        summaries = runner.Run(100)
+        mean, halfwidth = Interval([s["mean"] for s in summaries])
+
+        # With variance reduction
+        sim = JSQd(maxTime=1000.0, parallelism=100, seed=1234, d=2,
+                   Arrival=random.expovariate, AArgs=50,
+                   Service=random.expovariate, SArgs=1, crn=True)
+        runner = ReplicationRunner(sim, workers=4, antithetic=True, control=True)
+        mean, halfwidth = runner.Estimate(runner.Run(20))
+    """
+
+    def __init__(self, system, workers=None, quantiles=QUANTILES, antithetic=False, control=False):
+        if (antithetic or control) and not system.crn:
+            raise ValueError("Antithetic replications and control variates need common random numbers (crn=True).")
+        if control:
+            BaselineMean(system)  # Checks the baseline applies
+        self.system = system
+        self.workers = workers if workers is not None else cpu_count()
+        self.quantiles = quantiles
+        self.antithetic = antithetic
+        self.control = control
+
+    def Run(self, n):
+        """Runs n replications (an even number, if antithetic), returning their summaries in order of replication."""
+        specification = Specification(self.system)
+        if self.antithetic:
+            if n % 2:
+                raise ValueError("Antithetic replications come in pairs; n must be even.")
+            seeds = [seed for seed in Seeds(self.system.seed, n // 2) for _ in range(2)]
+            twins = [bool(i % 2) for i in range(n)]
+        else:
+            seeds = Seeds(self.system.seed, n)
+            twins = [None] * n
+        args = (range(n), seeds, [self.quantiles] * n, [self.control] * n, twins)
+        if self.workers <= 1:
+            return list(map(Replicate, [specification] * n, *args))
+        from concurrent.futures import ProcessPoolExecutor  # Only imported for a pool
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=Prepare, initargs=(specification,)) as executor:
+            return list(executor.map(Replicate, [None] * n, *args, chunksize=max(1, n // (4 * self.workers))))
+
+    def Estimate(self, summaries, statistic="mean", confidence=0.95):
+        """Mean and confidence half-width of a statistic over the summaries returned by `Run`, averaging antithetic
+        pairs and correcting the mean response time by the control variate, as configured.
+
+        :param summaries: Output of `Run`.
+        :param statistic: The statistic of each summary to estimate.
+        :param confidence: Confidence level of the interval.
+        """
+        values = [s[statistic] for s in summaries]
+        if self.control and statistic == "mean":
+            controls = [s["baseline"] for s in summaries]
+            if self.antithetic:
+                values, controls = Pairs(values), Pairs(controls)
+            return ControlVariate(values, controls, BaselineMean(self.system), confidence)
+        return Interval(values, confidence, paired=self.antithetic)
+
+
+def Pairs(values):
+    """The means of consecutive pairs of values (e.g. of antithetic replications)."""
+    values = np.asarray(values, dtype=float)
+    return (values[0::2] + values[1::2]) / 2
+
+
+def Interval(values, confidence=0.95, paired=False):
+    """Mean and normal-approximation confidence half-width of a sample of replication statistics.
+
+    :param values: The statistic of each replication.
+    :param confidence: Confidence level of the interval.
+    :param paired: Whether the replications are antithetic pairs, whose means are the independent observations.
+    """
+    values = Pairs(values) if paired else np.asarray(values, dtype=float)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    halfwidth = z * values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else np.inf
+    return float(values.mean()), float(halfwidth)
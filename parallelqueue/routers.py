@@ -1,8 +1,15 @@
+import heapq
 import random
+from collections import deque
+
+from parallelqueue.distributions import DrawSizes
+from parallelqueue.jobs import JobName, JobRecord
+from parallelqueue.queues import QueueEntry
 
 
 def NoInSystem(R):
-    """Total number of Jobs in the resource R."""
+    """Total number of Jobs in the resource R. Routers read :code:`system.QueueState` (see `queues.QueueIndex`)
+    instead."""
     return len(R.put_queue) + len(R.users)
 
 
@@ -14,27 +21,255 @@ def QueueSelector(d, parallelism, counters):
         return range(parallelism)
 
 
-def DefaultRouter(job, system, env, name, queues, **kwargs):
-    """Specifies the scheduling system used. If replication is enabled, this router tracks
-    each set of replicas using a :code:`base_models.ParallelQueueSystem.ReplicaDict` which can be accessed
-    by :code:`network.Network.Job` processes.
+def Pick(n, u):
+    """A uniformly random index below n, from the `random` module or, with common random numbers, from the uniform u
+    drawn for the arrival."""
+    return random.sample(range(n), 1)[0] if u is None else int(u * n)
+
+
+def Sample(system, queues):
+    """The d queues sampled for an arriving job (from :code:`system.Routing`, with common random numbers)."""
+    routing = system.Routing
+    if routing is None or system.d == system.parallelism:
+        return QueueSelector(system.d, system.parallelism, queues)
+    return routing.Choices()
+
+
+class Policy:
+    """Base class of the routing policies of jobs without replicas, selected by the :code:`router` argument of
+    `base_models.ParallelQueueSystem` (see `POLICIES`) and applied by the routers of every network through `Choose`.
+    A policy keeps whatever structure it needs to decide in O(d) per arrival (or better), whatever the parallelism;
+    if it defines `Update`, the `queues.QueueIndex` calls it after each change at a queue.
+
+    :param system: The system routed (built anew for each run).
+    :type system: base_models.ParallelQueueSystem
+    """
+
+    work = False  # Whether the policy reads the remaining work of the queues (see queues.QueueIndex.Remaining)
+    Update = None  # Called as Update(state, queue) after every change at a queue, if defined
+
+    def __init__(self, system):
+        self.system = system
+
+    def Select(self, state, queues, arrive, u):
+        """The queue an arriving job joins.
+
+        :param state: The system's queue index.
+        :type state: queues.QueueIndex
+        :param queues: The queues of the system.
+        :param arrive: Time of arrival.
+        :param u: With common random numbers, the uniform drawn for this arrival (see `Pick`); else :code:`None`.
+        """
+        raise NotImplementedError
+
+
+class LeastCost(Policy):
+    """Joins the sampled queue of least `Cost`, breaking ties uniformly at random."""
+
+    def Cost(self, state, queue):
+        raise NotImplementedError
+
+    def Select(self, state, queues, arrive, u):
+        Cost = self.Cost
+        parsed = {i: Cost(state, i) for i in Sample(self.system, queues)}
+        least = min(parsed.values())
+        choices = [i for i, value in parsed.items() if value == least]
+        return choices[Pick(len(choices), u)] if len(choices) > 1 else choices[0]
+
+
+class ShortestQueue(LeastCost):
+    """JSQ(d): the fewest jobs. (Applied by `Choose` itself when selected by name.)"""
+
+    def Cost(self, state, queue):
+        return int(state.InSystem[queue])
+
+
+class SpeedWeighted(LeastCost):
+    """Speed-weighted JSQ(d): the fewest jobs, counting the arriving one, per unit of service rate."""
+
+    def Cost(self, state, queue):
+        return (state.InSystem[queue] + 1) / state.Rate[queue]
+
+
+class ExpectedWork(LeastCost):
+    """Least expected work: the soonest expected completion of the arriving job, i.e. the remaining work of a queue
+    (see `queues.QueueIndex.Remaining`) per server plus the job's own mean service time there."""
+
+    work = True
+
+    def Cost(self, state, queue):
+        return state.Remaining(queue) / state.Capacity[queue] + state.Expected[queue]
+
+
+class JoinIdleQueue(Policy):
+    """Join-Idle-Queue: joins a queue with an idle server if there is any, or else a queue chosen uniformly at random.
+    Queues with an idle server are kept in FIFO order of becoming idle (in a deque, with a flag per queue), so each
+    arrival takes O(1) amortized time."""
+
+    def __init__(self, system):
+        super().__init__(system)
+        self.idle = deque(range(system.parallelism))
+        self.listed = [True] * system.parallelism
+
+    def Update(self, state, queue):
+        if not self.listed[queue] and state.InSystem[queue] < state.Capacity[queue]:
+            self.idle.append(queue)
+            self.listed[queue] = True
+
+    def Select(self, state, queues, arrive, u):
+        idle, listed = self.idle, self.listed
+        while idle:
+            queue = idle.popleft()
+            listed[queue] = False
+            if state.InSystem[queue] < state.Capacity[queue]:  # Still idle
+                return queue
+        return Pick(self.system.parallelism, u)
+
+
+class PowerOfDMemory(Policy):
+    """Power-of-d with memory: joins the shortest of the d sampled queues and the queue remembered from the previous
+    arrival, then remembers the shortest of them (counting the job just routed)."""
+
+    def __init__(self, system):
+        super().__init__(system)
+        self.memory = None
+
+    def Select(self, state, queues, arrive, u):
+        InSystem = state.InSystem
+        parsed = {i: int(InSystem[i]) for i in Sample(self.system, queues)}
+        if self.memory is not None and self.memory not in parsed:
+            parsed[self.memory] = int(InSystem[self.memory])
+        least = min(parsed.values())
+        choices = [i for i, value in parsed.items() if value == least]
+        choice = choices[Pick(len(choices), u)] if len(choices) > 1 else choices[0]
+        parsed[choice] += 1
+        self.memory = min(parsed, key=parsed.get)
+        return choice
+
+
+class RoundRobin(Policy):
+    """Round-robin: the queues in turn."""
+
+    def __init__(self, system):
+        super().__init__(system)
+        self.next = 0
+
+    def Select(self, state, queues, arrive, u):
+        queue = self.next
+        self.next = (queue + 1) % self.system.parallelism
+        return queue
+
+
+class LeastWorkLeft(Policy):
+    """Least-work-left over all queues: joins the queue whose remaining work (per server) runs out first. The time
+    each queue's work would run out only changes upon events at that queue, so the queues are kept in a heap by that
+    time, updated lazily (stale entries are dropped upon reaching the top, and the heap is rebuilt once mostly
+    stale): O(log parallelism) amortized per event. Exact for single-server queues; with several servers, a queue
+    whose servers are not all busy counts its work as if they were."""
+
+    work = True
+
+    def __init__(self, system):
+        super().__init__(system)
+        self.due = [0.0] * system.parallelism
+        self.heap = [(0.0, queue) for queue in range(system.parallelism)]
+
+    def Update(self, state, queue):
+        due = state.clock.now + state.Remaining(queue) / state.Capacity[queue]
+        self.due[queue] = due
+        heapq.heappush(self.heap, (due, queue))
+        if len(self.heap) > 4 * len(self.due):
+            self.heap = [(due, queue) for queue, due in enumerate(self.due)]
+            heapq.heapify(self.heap)
+
+    def Select(self, state, queues, arrive, u):
+        heap, due = self.heap, self.due
+        while heap[0][0] != due[heap[0][1]]:
+            heapq.heappop(heap)
+        return heap[0][1]
+
+
+class BatchSampling(Policy):
+    """Batch-sampling, for jobs arriving in batches (see the :code:`batch` argument of
+    `base_models.ParallelQueueSystem`; the size of the latest batch is :code:`system.BatchSize`): upon the first job
+    of a batch, d queues are sampled per job of the batch and its jobs are planned to the shortest of them, one each
+    (more than one only if fewer queues were sampled than jobs), in a single decision. The rest of the batch follows
+    the plan."""
+
+    def __init__(self, system):
+        super().__init__(system)
+        self.plan = deque()
+        self.epoch = None
+
+    def Select(self, state, queues, arrive, u):
+        if not self.plan or self.epoch != arrive:
+            self.epoch = arrive
+            batch = self.system.BatchSize
+            sampled = dict.fromkeys(i for _ in range(batch) for i in Sample(self.system, queues))
+            self.plan = deque(self.Plan(state, list(sampled), batch))
+        return self.plan.popleft()
+
+    def Plan(self, state, sampled, batch):
+        """The queues of the jobs of a batch, given the queues sampled for it."""
+        InSystem = state.InSystem
+        shortest = sorted(sampled, key=lambda i: InSystem[i])[:batch]
+        return [shortest[k % len(shortest)] for k in range(batch)]
+
+
+class BatchFilling(BatchSampling):
+    """Batch-filling (water-filling): as `BatchSampling`, but each job of a batch is planned in turn to the sampled
+    queue with the fewest jobs, counting those planned before it."""
+
+    def Plan(self, state, sampled, batch):
+        heap = [(int(state.InSystem[i]), k, i) for k, i in enumerate(sampled)]
+        heapq.heapify(heap)
+        plan = []
+        for _ in range(batch):
+            count, k, queue = heap[0]
+            plan.append(queue)
+            heapq.heapreplace(heap, (count + 1, k, queue))
+        return plan
+
+
+POLICIES = {"jsq": ShortestQueue, "speed": SpeedWeighted, "work": ExpectedWork, "jiq": JoinIdleQueue,
+            "memory": PowerOfDMemory, "round-robin": RoundRobin, "lwl": LeastWorkLeft,
+            "batch-sampling": BatchSampling, "batch-filling": BatchFilling}  # The routing policies, by name
+
+
+def Choose(system, arrive, name, queues):
+    """The routing decision shared by the routers: samples d queues (reading :code:`system.QueueState`), tells the
+    monitors of the arrival and of the queues considered, and returns the queues the job joins (those holding a
+    replica, with replication, or else the one chosen). Without replication, the queue is chosen by
+    :code:`system.Policy`, unless routing by JSQ(d) (see `Policy`). With common random numbers, the samples are drawn
+    from :code:`system.Routing` (see `variance.Routing`).
 
-    :param job: Job process.
     :param system: System providing environment.
     :type system: base_models.ParallelQueueSystem
-    :param env: Environment for the simulation.
-    :type env: simpy.Environment
+    :param arrive: Time of arrival.
+    :type arrive: float
     :param name: Identifier for the job.
-    :type name: str
+    :type name: int
     :param queues: A list of queues to consider.
-    :type queues: List[simpy.Resource]
     """
-    arrive = env.now
-    parsed = {i: NoInSystem(queues[i]) for i in QueueSelector(system.d, system.parallelism, queues)}
-    if system.MonitorHolder is not None:
-        inputs = locals()
-        for monitor in system.MonitorHolder.values():
-            monitor.Add(inputs)
+    state = system.QueueState
+    routing = system.Routing
+    u = routing.Uniform() if routing is not None else None  # One uniform per arrival, needed or not
+    if system.Policy is not None:
+        choice = system.Policy.Select(state, queues, arrive, u)
+        for hook in system.Events.on_arrival:
+            hook(system, arrive, name)
+        if system.doPrint:
+            print(f'{arrive:7.4f} {JobName(name)}: Arrival')
+        for hook in system.Events.on_route:
+            hook(system, arrive, name, [choice])
+        return [choice]
+    if state.Buckets is None:
+        InSystem = state.InSystem
+        parsed = {i: int(InSystem[i]) for i in Sample(system, queues)}
+    else:
+        parsed = None  # JSQ over all queues; the shortest are kept by state.Buckets
+    for hook in system.Events.on_arrival:
+        hook(system, arrive, name)
 
     choices = []
     if system.ReplicaDict is not None:  # Replication chosen
@@ -46,29 +281,117 @@ def DefaultRouter(job, system, env, name, queues, **kwargs):
             for i in parsed:
                 choices.append(i)  # For no threshold
         if len(choices) < 1:
-            choices = random.sample(list(parsed.keys()), 1)  # random choice
+            choices = [list(parsed.keys())[Pick(len(parsed), u)]]  # random choice
         if system.doPrint:
-            print(f'{arrive:7.4f} {name}: Arrival for {len(choices)} copies')
-        replicas = []
-        for choice in choices:
-            c = job(system, env, name, arrive, queues, choice, **kwargs)
-            replicas.append(env.process(c))
-        system.ReplicaDict[name] = replicas
-        if system.MonitorHolder is not None:
-            inputs = locals()
-            for monitor in system.MonitorHolder.values():
-                monitor.Add(inputs)
-        yield from replicas  # Stronger than `for i in replicas: yield i` ∵ bijective
-    else:  # Shortest queue case
-        if system.doPrint:
-            print(f'{arrive:7.4f} {name}: Arrival')
+            print(f'{arrive:7.4f} {JobName(name)}: Arrival for {len(choices)} copies')
+        for hook in system.Events.on_route:
+            hook(system, arrive, name, choices)
+        return choices
+    if system.doPrint:
+        print(f'{arrive:7.4f} {JobName(name)}: Arrival')
+    if parsed is not None:
         for key, value in parsed.items():
             if value in [0, min(parsed.values())]:
                 choices.append(key)  # the chosen queue number; can be > 1
-        choice = random.sample(choices, 1)[0] if len(choices) > 1 else choices[0]
-        c = job(system, env, name, arrive, queues, choice, **kwargs)
-        if system.MonitorHolder is not None:
-            inputs = locals()
-            for monitor in system.MonitorHolder.values():
-                monitor.Add(inputs)
-        env.process(c)
+        choice = choices[Pick(len(choices), u)] if len(choices) > 1 else choices[0]
+    else:  # Same draw as sampling from the (sorted) tied queues themselves
+        shortest = state.Buckets.Shortest
+        choice = shortest[Pick(len(shortest), u)] if len(shortest) > 1 else shortest[0]
+        choices.append(choice)
+    for hook in system.Events.on_route:
+        hook(system, arrive, name, choices)
+    return [choice]
+
+
+def DefaultRouter(job, system, env, name, queues, **kwargs):
+    """Specifies the scheduling system used. If replication is enabled, this router tracks
+    each set of replicas using a :code:`base_models.ParallelQueueSystem.ReplicaDict` which can be accessed
+    by :code:`network.Network.Job` processes.
+
+    :param job: Job process.
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation.
+    :type env: simpy.Environment
+    :param name: Identifier for the job.
+    :type name: int
+    :param queues: A list of queues to consider.
+    :type queues: List[simpy.Resource]
+
+    Note
+    ----
+    Queue sizes are read from :code:`system.QueueState`, so parsing costs O(d). With d equal to the parallelism
+    (and no replicas), the shortest queues are found from its buckets without parsing at all. Monitors are told of
+    the arrival and of the chosen queues through :code:`system.Events`.
+    """
+    arrive = env.now
+    choices = Choose(system, arrive, name, queues)
+    DrawSizes(kwargs, name, choices)
+    if system.ReplicaDict is not None:
+        system.ReplicaDict[name] = JobRecord(name, arrive, choices, [])  # Replicas add their requests
+    for choice in choices:
+        env.process(job(system, env, name, arrive, queues, choice, **kwargs))
+    yield from ()  # Routers run as processes; there is nothing to wait for.
+
+
+def LazyRouter(system, env, name, queues, **kwargs):
+    """The router of `network.LazyNetwork`, called as a plain function rather than run as a process. The job (or
+    each of its replicas) becomes an entry of its queue (see `queues.LazyQueue`) and free servers begin serving.
+
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation.
+    :type env: simpy.Environment
+    :param name: Identifier for the job.
+    :type name: int
+    :param queues: A list of queues to consider.
+    :type queues: List[queues.LazyQueue]
+    """
+    arrive = env.now
+    choices = Choose(system, arrive, name, queues)
+    DrawSizes(kwargs, name, choices)
+    entries = [QueueEntry(queues[choice], name, arrive) for choice in choices]
+    if system.ReplicaDict is not None:
+        system.ReplicaDict[name] = JobRecord(name, arrive, choices, entries)
+    for entry in entries:  # Every replica is queued before any starts (and may cancel the others)
+        if system.doPrint:
+            print(f'    ↳ {JobName(name)}@{entry.resource.queue}')
+        entry.resource.Join(entry)
+    for entry in entries:
+        entry.resource.serve()
+
+
+def StageRouter(system, env, name, arrive, pool):
+    """Routes a job into a stage of `network.StagedNetwork` (a function, not a process), as `LazyRouter` routes it
+    into a single pool: each of the job's :code:`fork` tasks at the stage is routed in turn by the stage's policy and
+    joins its queue as a `queues.QueueEntry` (so that the next task sees it), then free servers begin serving. The job
+    is kept in :code:`pool.Jobs` until all of its tasks there are served. Monitors are told of the queues joined,
+    numbered as in the system.
+
+    :param system: System providing environment.
+    :type system: base_models.ParallelQueueSystem
+    :param env: Environment for the simulation.
+    :type env: simpy.Environment
+    :param name: Identifier for the job.
+    :type name: int
+    :param arrive: Time the job arrived in the system.
+    :type arrive: float
+    :param pool: The stage entered.
+    :type pool: network.StagePool
+    """
+    now = env.now
+    queues, state, policy = pool.Queues, pool.State, pool.Policy
+    entries = []
+    for _ in range(pool.Stage.fork):
+        queue = queues[policy.Select(state, queues, now, None)]
+        entry = QueueEntry(queue, name, arrive)
+        queue.Join(entry)
+        entries.append(entry)
+    record = JobRecord(name, arrive, [entry.resource.queue for entry in entries], entries)
+    pool.Jobs[name] = record
+    if system.doPrint:
+        print(f'{now:7.4f} {JobName(name)}: Stage {pool.number} for {len(entries)} tasks')
+    for hook in system.Events.on_route:
+        hook(system, now, name, record.choices)
+    for entry in entries:
+        entry.resource.serve()
@@ -0,0 +1,250 @@
+"""
+Sharded runs of one large JSQ(d) system across processes. Under power-of-d routing, queues interact only through the
+router's samples, so the queues are split into shards, each simulated by a worker process with an event loop of its
+own, while this process routes the arrivals. Time is cut into windows: the arrivals of a window are routed (in NumPy,
+all at once) on the numbers in system of their sampled queues as of the window's start, read from an array in shared
+memory (:code:`multiprocessing.shared_memory`) to which every shard writes its own queues, and are dispatched to the
+shards in one batch each. The shards simulate the window and report back before the next one is routed. If a shard
+fails (or dies), the run stops: the other shards are terminated and its error is raised.
+
+Routing on numbers up to a window old is the only departure from the model, so with windows short against service
+times the results are statistically equivalent to those of a single process (they agree in distribution, not path by
+path), while wall-clock time falls with the number of cores. Arrivals and service times are drawn from the streams of
+`distributions.Streams` as the fast engine draws them (see `fast`).
+
+Example
+-------
+.. code-block:: python
+
+    sim = JSQd(maxTime=100.0, parallelism=100000, seed=1234, d=2, Arrival=random.expovariate, AArgs=95000,
+               Service=random.expovariate, SArgs=1)
+    report = sim.RunSharded(shards=8)
+"""
+import heapq
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count
+
+import numpy as np
+
+from parallelqueue.distributions import BLOCK, Function, PerServer, Sampler, Streams
+from parallelqueue.fast import DrawChoices
+from parallelqueue.replications import QUANTILES
+
+WINDOW = 0.05  # Default window, in mean service times.
+BINS = np.geomspace(1e-6, 1e9, 7501)  # Response time histogram of the shards (bins 0.46% wide), for quantiles
+
+
+class ShardedRunner:
+    """Runs a JSQ(d) system (single-server queues, without replicas) split into shards of queues, one worker process
+    each (see the module description), reporting as `replications.Summary` does. Monitors are not called: their
+    hooks would need every event in one process.
+
+    :param system: The system, with a :code:`maxTime` and distributions drawn by NumPy (`distributions.Distribution`
+        types or :code:`random.expovariate`).
+    :type system: base_models.ParallelQueueSystem
+    :param shards: Number of shards (and worker processes). Defaults to the number of CPUs.
+    :param window: Length of the routing windows, in simulated time. Defaults to 0.05 mean service times.
+    :param quantiles: Response time quantiles to report (from histograms of bins 0.46% wide).
+    :param timeout: Seconds to wait for the shards to simulate a window (or report) before the run is stopped with a
+        :code:`TimeoutError`. By default, the wait is as long as the shards are alive.
+    """
+
+    def __init__(self, system, shards=None, window=None, quantiles=QUANTILES, timeout=None):
+        if system.ReplicaDict is not None or system.router != "jsq" or system.capacities is not None:
+            raise ValueError("Sharded runs model JSQ(d) over single-server queues, without replicas.")
+        if system.maxTime is None or system.crn or system.batch != 1:
+            raise ValueError("Sharded runs need a maxTime, and neither common random numbers nor batches.")
+        self.arrival = Sampler(system.kwargs["Arrival"], system.kwargs["AArgs"])
+        self.service = Sampler(system.kwargs["Service"], system.kwargs["SArgs"])
+        if isinstance(self.arrival, Function) or isinstance(self.service, Function):
+            raise ValueError("Sharded runs draw from NumPy streams; use a Distribution (or random.expovariate).")
+        if window is None:
+            try:
+                window = WINDOW * self.service.Mean
+            except NotImplementedError:
+                raise ValueError("The service distribution has no known mean; give a window.") from None
+        if window <= 0:
+            raise ValueError("window must be positive.")
+        self.system = system
+        self.shards = min(shards or cpu_count(), system.parallelism)
+        self.window = window
+        self.quantiles = quantiles
+        self.timeout = timeout
+
+    def Run(self):
+        """Runs the system and returns its summary: number of jobs served, mean and quantiles of their response times
+        and the time-average number in system per queue."""
+        system = self.system
+        parallelism = system.parallelism
+        bounds = np.linspace(0, parallelism, self.shards + 1).astype(np.int64)
+        memory = SharedMemory(create=True, size=8 * parallelism)
+        counts = np.ndarray(parallelism, dtype=np.int64, buffer=memory.buf)
+        counts[:] = 0
+        workers = []
+        try:
+            for shard in range(self.shards):
+                ours, theirs = multiprocessing.Pipe()
+                worker = multiprocessing.Process(target=Shard, daemon=True, args=(
+                    memory.name, parallelism, bounds[shard], bounds[shard + 1], system.seed, self.service,
+                    system.speeds, system.maxTime, theirs))
+                worker.start()
+                workers.append((worker, ours))
+            self.Coordinate(counts, bounds, workers)
+            reports = self.Receive(workers)
+            for worker, _ in workers:
+                worker.join()
+        finally:
+            for worker, _ in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            del counts  # Releases the buffer
+            memory.close()
+            memory.unlink()
+        return self.Report(reports)
+
+    def Coordinate(self, counts, bounds, workers):
+        """Routes the arrivals window by window, dispatching them to the shards."""
+        system = self.system
+        parallelism, d = system.parallelism, system.d
+        streams = Streams(system.seed, parallelism)
+        routing = streams.Routing
+        times = Arrivals(self.arrival, streams.Arrival)
+        pending = next(times)
+        now = 0.0
+        while now < system.maxTime:
+            end = min(now + self.window, system.maxTime)
+            batch = []
+            while pending[-1] < end:
+                batch.append(pending)
+                pending = next(times)
+            cut = np.searchsorted(pending, end)
+            batch.append(pending[:cut])
+            pending = pending[cut:]
+            arrive = np.concatenate(batch)
+            if d == parallelism:  # The shortest queues as of the window's start, uniformly
+                shortest = np.flatnonzero(counts == counts.min())
+                queues = shortest[routing.integers(0, len(shortest), len(arrive))]
+            else:
+                sampled = DrawChoices(routing, parallelism, d, len(arrive))
+                keys = counts[sampled] + routing.random(sampled.shape)  # Ties broken uniformly at random
+                queues = sampled[np.arange(len(arrive)), keys.argmin(axis=1)]
+            shard = np.searchsorted(bounds, queues, side="right") - 1
+            for k, (_, pipe) in enumerate(workers):
+                mine = shard == k
+                pipe.send((arrive[mine], queues[mine] - bounds[k], end))
+            self.Receive(workers)  # Every shard has simulated the window and written its numbers in system
+            now = end
+        for _, pipe in workers:
+            pipe.send(None)
+
+    def Receive(self, workers):
+        """Returns a message from every shard, in order, waiting at most :code:`timeout` seconds. Raises the error of a
+        shard which failed, and a :code:`RuntimeError` if one exited without a message."""
+        messages = [None] * len(workers)
+        waiting = dict(enumerate(workers))
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while waiting:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready = set(wait([pipe for _, pipe in waiting.values()] +
+                             [worker.sentinel for worker, _ in waiting.values()], left))
+            if not ready:
+                raise TimeoutError(f"The shards took longer than {self.timeout} s to simulate a window.")
+            for k, (worker, pipe) in list(waiting.items()):
+                if pipe in ready:
+                    message = pipe.recv()
+                    if isinstance(message, BaseException):
+                        raise message
+                    messages[k] = message
+                    del waiting[k]
+                elif worker.sentinel in ready and not pipe.poll():
+                    worker.join()  # It has exited; this sets its exit code
+                    raise RuntimeError(f"Shard {k} exited with code {worker.exitcode}.")
+        return messages
+
+    def Report(self, reports):
+        """Merges the reports of the shards."""
+        jobs = sum(report["jobs"] for report in reports)
+        histogram = sum(report["histogram"] for report in reports)
+        report = {"jobs": jobs, "mean": sum(report["total"] for report in reports) / jobs if jobs else np.nan}
+        cumulative = np.cumsum(histogram)
+        for q in self.quantiles:
+            i = np.searchsorted(cumulative, q * jobs)
+            report[f"q{q:g}"] = float(np.sqrt(BINS[i] * BINS[i + 1])) if jobs else np.nan
+        report["queue"] = sum(report["area"] for report in reports) / self.system.maxTime / self.system.parallelism
+        return report
+
+
+def Arrivals(arrival, rng):
+    """Yields arrays of consecutive arrival times (the first at time 0), a block at a time, as the fast engine
+    draws them."""
+    draw = arrival.Bind(rng, BLOCK).draw  # Blocks of interarrival times, of an arrival process too
+    now = 0.0
+    while True:
+        gaps = draw()
+        times = now + np.concatenate(([0.0], np.cumsum(gaps[:-1])))
+        now = times[-1] + gaps[-1]
+        yield times
+
+
+def Shard(name, parallelism, low, high, seed, service, speeds, until, pipe):
+    """The event loop of a shard, simulating queues :code:`low` to :code:`high` (exclusive) of the system. Each
+    server draws its service times from its own stream, as in `distributions.Streams`. Acknowledges each window and
+    reports the jobs which departed before :code:`until` through the pipe, or sends the error it failed with.
+
+    :param name: Name of the shared memory holding the number in system of every queue.
+    """
+    memory = SharedMemory(name=name)
+    shared = np.ndarray(parallelism, dtype=np.int64, buffer=memory.buf)[low:high]
+    try:
+        servers = PerServer(service, [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(1, queue)))
+                                      for queue in range(low, high)]).Servers
+        speed = [1.0] * (high - low) if speeds is None else speeds[low:high]
+        insystem = [0] * (high - low)
+        free = [0.0] * (high - low)
+        departures = []
+        histogram = np.zeros(len(BINS) - 1, dtype=np.int64)
+        jobs, total, area, last, present = 0, 0.0, 0.0, 0.0, 0
+        while True:
+            message = pipe.recv()
+            if message is None:
+                break
+            arrive, queues, end = message
+            responses = []
+            for now, queue in zip(arrive.tolist(), queues.tolist()):
+                while departures and departures[0][0] <= now:
+                    finish, served, entered = heapq.heappop(departures)
+                    area += present * (finish - last)
+                    last, present = finish, present - 1
+                    insystem[served] -= 1
+                    responses.append(finish - entered)
+                start = free[queue] if free[queue] > now else now
+                free[queue] = start + servers[queue]() / speed[queue]
+                heapq.heappush(departures, (free[queue], queue, now))
+                area += present * (now - last)
+                last, present = now, present + 1
+                insystem[queue] += 1
+            while departures and (departures[0][0] <= end if end < until else departures[0][0] < end):
+                finish, served, entered = heapq.heappop(departures)
+                area += present * (finish - last)
+                last, present = finish, present - 1
+                insystem[served] -= 1
+                responses.append(finish - entered)
+            shared[:] = insystem
+            responses = np.asarray(responses)
+            jobs += len(responses)
+            total += float(responses.sum())
+            histogram += np.histogram(responses, BINS)[0]
+            pipe.send(None)
+        area += present * (until - last)
+        pipe.send({"jobs": jobs, "total": total, "histogram": histogram, "area": area})
+    except Exception as error:
+        try:
+            pipe.send(error)
+        except Exception:  # E.g. an error which cannot be pickled
+            pipe.send(RuntimeError(f"Shard of queues {low} to {high} failed: {error!r}"))
+    finally:
+        del shared
+        memory.close()
@@ -0,0 +1,127 @@
+"""
+Parameter sweeps over grids of model arguments (e.g. d, r, AArgs and parallelism). Grid points run in parallel and
+each point's summary is cached on disk under a hash of its full configuration, so rerunning a partly finished sweep
+(or widening its grid) only computes the new points.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from os import cpu_count
+
+from parallelqueue.distributions import Distribution
+from parallelqueue.replications import Prepare, Replicate, Seeds, Specification, QUANTILES
+
+
+def Describe(value):
+    """A JSON-friendly description of a model argument; distributions are described by their parameters, other
+    functions and classes by their qualified names (so the cache cannot tell apart two lambdas)."""
+    if isinstance(value, (list, tuple)):
+        return [Describe(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): Describe(v) for k, v in value.items()}
+    if isinstance(value, Distribution):
+        return repr(value)
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+    return value
+
+
+def Key(configuration):
+    """Hash identifying a configuration (model, distributions, seed, horizon, replication, ...)."""
+    text = json.dumps(Describe(configuration), sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Cache:
+    """On-disk store of summaries, one JSON file per configuration.
+
+    :param path: Directory holding the cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def File(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def Get(self, key):
+        """The summary stored under key, if any."""
+        try:
+            with open(self.File(key)) as f:
+                return json.load(f)["summary"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def Put(self, key, configuration, summary):
+        temporary = self.File(key) + f".{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"configuration": Describe(configuration), "summary": summary}, f, default=repr)
+        os.replace(temporary, self.File(key))  # Atomic; a crash never leaves a partial entry.
+
+
+def Points(grid):
+    """Every combination of the grid's values, as dicts."""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in product(*(grid[k] for k in keys))]
+
+
+def Sweep(model, grid, cache=".parallelqueue", workers=None, replications=1, quantiles=QUANTILES, **fixed):
+    """Runs a model over every point of a grid, returning a tidy :code:`pandas.DataFrame` with one row per
+    (point, replication). Points whose summary is already cached are not run again.
+
+    :param model: A model builder of `base_models` (e.g. :code:`JSQd`), or :code:`None` if the grid has a
+        :code:`"model"` key.
+    :param grid: Dict from argument names to the values to sweep.
+    :param cache: Directory of the on-disk cache; :code:`None` disables caching.
+    :param workers: Number of processes. Defaults to the number of CPUs; with 1, points run in this process.
+    :param replications: Replications run per grid point (seeded as in `replications.ReplicationRunner`).
+    :param quantiles: Response time quantiles to report.
+    :param fixed: Arguments shared by all points (e.g. seed, maxTime, Arrival, Service).
+
+    Example
+    -------
+    .. code-block:: python
+
+        df = Sweep(None, {"model": [JSQd, RedundancyQueueSystem], "d": [1, 2, 4], "AArgs": [50, 90]},
+                   parallelism=100, seed=1234, maxTime=1000.0,
+                   Arrival=random.expovariate, Service=random.expovariate, SArgs=1)
+    """
+    store = Cache(cache) if cache is not None else None
+    rows, tasks, summaries = [], {}, {}
+    for point in Points(grid):
+        build = point.get("model", model)
+        arguments = {**fixed, **{k: v for k, v in point.items() if k != "model"}}
+        specification = Specification(build(Monitors=[], **arguments))
+        row = {"model": build.__name__}
+        row.update({k: Describe(v) if callable(v) else v for k, v in point.items() if k != "model"})
+        for replication, seed in enumerate(Seeds(arguments["seed"], replications)):
+            configuration = {"model": build, **specification, "seed": seed, "replication": replication,
+                             "quantiles": quantiles}
+            key = Key(configuration)
+            rows.append((row, key))
+            cached = store.Get(key) if store is not None else None
+            if cached is not None:
+                summaries[key] = cached
+            elif key not in tasks:
+                tasks[key] = (configuration, (specification, replication, seed, quantiles))
+
+    workers = workers if workers is not None else cpu_count()
+    if workers <= 1 or len(tasks) <= 1:
+        for key, (configuration, args) in tasks.items():
+            summaries[key] = Replicate(*args)
+            if store is not None:
+                store.Put(key, configuration, summaries[key])
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=workers, initializer=Prepare) as executor:
+            futures = {executor.submit(Replicate, *args): key for key, (_, args) in tasks.items()}
+            for future in as_completed(futures):  # Cache each point as soon as it is done
+                key = futures[future]
+                summaries[key] = future.result()
+                if store is not None:
+                    store.Put(key, tasks[key][0], summaries[key])
+
+    import pandas as pd
+    return pd.DataFrame([{**row, **summaries[key]} for row, key in rows])
@@ -0,0 +1,225 @@
+"""
+Trace-driven arrivals. A `Trace` passed as :code:`Arrival` replays the records of a file (e.g. timestamps and job sizes
+from production logs) instead of drawing interarrival times: each record gives a job's arrival (as a timestamp or as
+the time since the previous record) and, optionally, its size, which is then its service requirement at every queue
+(in place of :code:`Service`). The file is read a chunk of records at a time, memory-mapped where the format allows,
+so a run holds at most a couple of chunks whatever the length of the trace. The replay ends with the trace.
+
+Supported files are NumPy :code:`.npy` arrays (structured, or 2-D with columns given by position), Arrow IPC files
+(:code:`.arrow`/:code:`.feather`, requires :code:`pyarrow`) and CSV files (read by pandas).
+
+Example
+-------
+.. code-block:: python
+
+    # Jobs from the millionth record on, arriving twice as fast as logged
+    trace = Trace("requests.arrow", time="timestamp", size="cpu_seconds", offset=10 ** 6, speedup=2.0)
+    sim = JSQd(parallelism=100, seed=1234, d=2, Arrival=trace, AArgs=None, Service=None, SArgs=None)
+    sim.RunSim()
+"""
+import os
+from functools import partial
+from itertools import chain, repeat, tee
+from operator import itemgetter
+
+import numpy as np
+
+from parallelqueue.columns import Arrow
+from parallelqueue.distributions import Block, JobSizes
+
+CHUNK = 65536  # Records read at once.
+FORMATS = {".npy": "numpy", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow", ".csv": "csv"}
+
+
+class Trace:
+    """A file of job records to replay as arrivals (see the module description).
+
+    :param path: The file.
+    :param time: Column of arrival timestamps (or of interarrival times, see :code:`interarrival`), by name or, for
+        2-D arrays and CSV files without a header, by position.
+    :param size: Column of job sizes, or :code:`None` if sizes are drawn from :code:`Service`.
+    :param interarrival: If true, :code:`time` holds the time since the previous record rather than timestamps.
+    :param offset: Number of records to skip; the first record replayed arrives at time 0.
+    :param speedup: Factor by which time is sped up: every interarrival time is divided by it (e.g. 0.5 replays the
+        trace at half speed). Sizes are left as they are.
+    :param chunk: Number of records read at once.
+    :param format: :code:`"numpy"`, :code:`"arrow"` or :code:`"csv"`; by default given by the file's extension.
+    """
+
+    def __init__(self, path, time="time", size="size", interarrival=False, offset=0, speedup=1.0, chunk=CHUNK,
+                 format=None):
+        format = format or FORMATS.get(os.path.splitext(str(path))[1].lower())
+        if format not in READERS:
+            raise ValueError(f"Unknown trace format for '{path}'; expected one of {', '.join(READERS)}.")
+        if offset < 0 or offset != int(offset):
+            raise ValueError("offset must be a nonnegative integer.")
+        if speedup <= 0:
+            raise ValueError("speedup must be positive.")
+        if chunk < 1:
+            raise ValueError("chunk must be positive.")
+        self.path = str(path)
+        self.time = time
+        self.size = size
+        self.interarrival = interarrival
+        self.offset = int(offset)
+        self.speedup = speedup
+        self.chunk = int(chunk)
+        self.format = format
+
+    def Records(self):
+        """Yields the time column and size column (:code:`None` without sizes) of consecutive records from
+        :code:`offset` on, a chunk at a time, as read from the file."""
+        return READERS[self.format](self)
+
+    def Chunks(self):
+        """Yields the interarrival times (in replayed time) and sizes of consecutive records, a chunk at a time. The
+        first record's interarrival time is 0."""
+        last = None
+        for times, sizes in self.Records():
+            if not len(times):
+                continue
+            if self.interarrival:
+                gaps = np.array(times, dtype=float)
+                if last is None:
+                    gaps[0] = 0.0
+                last = 0.0
+            else:
+                times = np.asarray(times, dtype=float)
+                gaps = np.diff(times, prepend=times[0] if last is None else last)
+                last = times[-1]
+            if (gaps < 0).any():
+                raise ValueError(f"The trace '{self.path}' has negative interarrival times (unsorted timestamps?).")
+            if self.speedup != 1:
+                gaps /= self.speedup
+            yield gaps, None if sizes is None else np.asarray(sizes, dtype=float)
+
+    def __repr__(self):
+        return (f"Trace(path={self.path!r}, time={self.time!r}, size={self.size!r}, interarrival={self.interarrival},"
+                f" offset={self.offset}, speedup={self.speedup})")
+
+
+def Column(table, column, path):
+    """A column of a structured array or 2-D array (or an Arrow record batch), by name or position."""
+    try:
+        return table[:, column] if isinstance(table, np.ndarray) and table.dtype.names is None else table[column]
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"The trace '{path}' has no column {column!r}.") from e
+
+
+def ReadNumpy(trace):
+    """Records of a memory-mapped :code:`.npy` file."""
+    records = np.load(trace.path, mmap_mode="r")
+    for start in range(trace.offset, len(records), trace.chunk):
+        block = records[start:start + trace.chunk]
+        sizes = None if trace.size is None else Column(block, trace.size, trace.path)
+        yield Column(block, trace.time, trace.path), sizes
+
+
+def ReadArrow(trace):
+    """Records of a memory-mapped Arrow IPC file (or stream), a slice of each record batch at a time."""
+    pyarrow = Arrow()
+    import pyarrow.ipc
+    source = pyarrow.memory_map(trace.path)
+    try:
+        reader = pyarrow.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pyarrow.ArrowInvalid:
+        source.seek(0)
+        batches = pyarrow.ipc.open_stream(source)
+    skip = trace.offset
+    for batch in batches:
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        for start in range(skip, batch.num_rows, trace.chunk):
+            block = batch.slice(start, trace.chunk)
+            times = Column(block, trace.time, trace.path).to_numpy(zero_copy_only=False)
+            sizes = None if trace.size is None else Column(block, trace.size, trace.path).to_numpy(
+                zero_copy_only=False)
+            yield times, sizes
+        skip = 0
+
+
+def ReadCSV(trace):
+    """Records of a CSV file, parsed a chunk at a time by pandas (with a header unless columns are positions)."""
+    import pandas as pd
+    columns = [c for c in (trace.time, trace.size) if c is not None]
+    header = None if all(isinstance(c, int) for c in columns) else "infer"
+    first = 0 if header is None else 1  # Rows before the records
+    skip = partial(SkipRows, first, first + trace.offset)
+    reader = pd.read_csv(trace.path, header=header, usecols=columns, skiprows=skip, chunksize=trace.chunk)
+    with reader:
+        for block in reader:
+            try:
+                yield (block[trace.time].to_numpy(),
+                       None if trace.size is None else block[trace.size].to_numpy())
+            except KeyError as e:
+                raise ValueError(f"The trace '{trace.path}' has no column {e.args[0]!r}.") from e
+
+
+def SkipRows(start, stop, row):
+    """Whether a CSV row (by line number) is skipped: those in :code:`[start, stop)`."""
+    return start <= row < stop
+
+
+READERS = {"numpy": ReadNumpy, "arrow": ReadArrow, "csv": ReadCSV}
+
+
+class TraceSizes(JobSizes):
+    """The sizes of a `Trace`, handed out (in the order jobs arrive) as `distributions.JobSizes` hands out drawn
+    sizes: every replica of a job is served for the job's size.
+
+    :param sizes: Iterator of arrays of consecutive sizes.
+    """
+
+    def __init__(self, sizes):
+        self.distribution = None
+        self.Streams = [Block(partial(next, sizes))]
+        self.rows = {}
+
+    def Assign(self, name, choices):
+        self.rows[name] = self.Streams[0]()
+
+    def Size(self, name, queue):
+        return self.rows[name]
+
+
+class Replay(Block):
+    """The interarrival times of a `Trace`, a `distributions.Block` drawn (by any arrival process) after each
+    arrival for the time to the next. Once the trace is exhausted, the next arrival is at infinity. Its sizes, if
+    any, are held by :code:`Sizes`.
+
+    :param trace: The trace.
+    :type trace: Trace
+    """
+
+    __slots__ = ("Sizes",)
+
+    def __init__(self, trace):
+        chunks = trace.Chunks()
+        if trace.size is not None:
+            chunks, sized = tee(chunks)  # The sizes lag the interarrival times by at most a chunk
+            self.Sizes = TraceSizes(map(itemgetter(1), sized))
+        else:
+            self.Sizes = None
+        super().__init__(partial(next, chain(map(itemgetter(0), chunks), repeat(np.array([np.inf])))))
+        if self() == np.inf:  # The first job arrives at time 0
+            raise ValueError(f"The trace '{trace.path}' has no records after offset {trace.offset}.")
+
+
+def Open(kwargs):
+    """The model arguments with a `Trace` given as :code:`Arrival` opened for a run: :code:`Arrival` becomes its
+    `Replay` and, if it has sizes, :code:`Service` its `TraceSizes`. Other arguments are returned as they are.
+
+    :param kwargs: The model arguments.
+    """
+    trace = kwargs.get("Arrival")
+    if not isinstance(trace, Trace):
+        return kwargs
+    kwargs = dict(kwargs)
+    kwargs["Arrival"] = replay = Replay(trace)
+    if replay.Sizes is not None:
+        kwargs["Service"] = replay.Sizes
+    elif kwargs.get("Service") is None:
+        raise ValueError("A trace without sizes needs a Service distribution.")
+    return kwargs
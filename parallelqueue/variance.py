@@ -0,0 +1,117 @@
+"""
+Variance reduction, for comparing policies (or estimating one) with fewer simulated events.
+
+- Common random numbers (:code:`crn=True` in `base_models`): arrivals, job sizes and routing samples are drawn from
+  separate streams, one draw (or row) per arriving job. Two systems with the same seed then see the same arrival
+  times and job sizes (the size of a job's k-th replica coming from the k-th size stream, see
+  `distributions.JobSizes`), and policies with the same d sample the same queues; the difference of their estimates
+  has a far smaller variance than that of independent runs. Distributions are then drawn by inversion from these
+  streams, so they must be `distributions.Distribution` types (or :code:`random.expovariate`); other functions of the
+  `random` module are rejected.
+- Antithetic replications (:code:`ReplicationRunner(..., antithetic=True)`): replications come in pairs sharing a
+  seed, the second drawing every interarrival time and job size from mirrored uniforms (see
+  `distributions.Inversion`).
+- Control variates (:code:`ReplicationRunner(..., control=True)`): each replication also reports the mean response
+  time of an M/M/1 baseline fed the same arrivals and job sizes (see `Baseline`), whose expectation is known, and
+  the estimate is corrected by its regression on it (see `ControlVariate`).
+
+Example
+-------
+.. code-block:: python
+
+    jsq = JSQd(maxTime=1000.0, parallelism=100, seed=1234, d=2, Arrival=random.expovariate, AArgs=90,
+               Service=random.expovariate, SArgs=1, Monitors=[Summary], crn=True)
+    red = RedundancyQueueSystem(maxTime=1000.0, parallelism=100, seed=1234, d=2, Arrival=random.expovariate,
+                                AArgs=90, Service=random.expovariate, SArgs=1, Monitors=[Summary], crn=True)
+"""
+from functools import partial
+from statistics import NormalDist
+
+import numpy as np
+
+from parallelqueue.distributions import BLOCK, Block, Exponential, Sampler, Streams
+from parallelqueue.fast import DrawChoices
+
+
+class Routing:
+    """Routing samples for common random numbers, drawn from the routing stream as the fast engine draws them: each
+    arriving job takes one uniform (to break ties, whether or not there are any) and then, unless d is the
+    parallelism, one row of d sampled queues.
+
+    :param rng: The routing stream.
+    :type rng: numpy.random.Generator
+    :param parallelism: Number of servers.
+    :param d: Number of queues sampled.
+    """
+
+    def __init__(self, rng, parallelism, d):
+        self.Choices = Block(partial(DrawChoices, rng, parallelism, d))
+        self.Uniform = Block(partial(rng.random, BLOCK))
+
+
+def Baseline(system):
+    """The mean response time of the jobs departing (by :code:`system.maxTime`) from an M/M/1 baseline fed the
+    arrivals and job sizes of a run of :code:`system` with common random numbers: a single FCFS server as fast as all
+    of the system's servers pooled, whose expectation is given by `BaselineMean`. The run's streams are drawn again
+    (with the Lindley recursion in NumPy), so the system need not be run first.
+
+    :param system: The system.
+    :type system: base_models.ParallelQueueSystem
+    """
+    BaselineMean(system)  # Checks the baseline applies
+    if system.maxTime is None:
+        raise ValueError("The M/M/1 baseline needs a run ending at maxTime.")
+    streams = Streams(system.seed, system.parallelism, True, system.antithetic)
+    kwargs = streams.Bind(system.kwargs, system.d if system.ReplicaDict is not None else 1)
+    arrival, size = kwargs["Arrival"], kwargs["Service"].Streams[0]
+    arrivals, sizes, now = [], [], 0.0
+    while now < system.maxTime:  # The first job arrives at time 0
+        arrivals.append(now)
+        sizes.append(size())
+        now += arrival()
+    arrivals = np.asarray(arrivals)
+    sizes = np.asarray(sizes) / system.parallelism
+    steps = np.concatenate(([0.0], np.cumsum(sizes[:-1] - np.diff(arrivals))))
+    response = steps - np.minimum.accumulate(steps) + sizes  # Waiting (by Lindley's recursion) and service
+    done = arrivals + response <= system.maxTime
+    return float(response[done].mean()) if done.any() else np.nan
+
+
+def BaselineMean(system):
+    """The stationary mean response time of the M/M/1 baseline of `Baseline`: 1 / (Nμ - λ) for N servers of rate μ
+    and arrivals of rate λ.
+
+    :param system: The system, with exponential interarrival and service times.
+    :type system: base_models.ParallelQueueSystem
+    """
+    arrival = Sampler(system.kwargs["Arrival"], system.kwargs.get("AArgs"))
+    service = Sampler(system.kwargs["Service"], system.kwargs.get("SArgs"))
+    if not (isinstance(arrival, Exponential) and isinstance(service, Exponential)):
+        raise ValueError("The M/M/1 baseline needs exponential interarrival and service times.")
+    rate = system.parallelism * service.rate
+    if arrival.rate >= rate:
+        raise ValueError("The M/M/1 baseline is unstable at this load.")
+    return 1 / (rate - arrival.rate)
+
+
+def ControlVariate(values, controls, mean, confidence=0.95):
+    """Mean and confidence half-width of a sample of replication statistics, corrected by their regression on
+    control variates of known mean: :code:`values - β (controls - mean)`, with β estimated from the sample.
+
+    :param values: The statistic of each replication.
+    :param controls: The control variate of each replication.
+    :param mean: Expectation of the control variate.
+    :param confidence: Confidence level of the interval.
+    """
+    values = np.asarray(values, dtype=float)
+    controls = np.asarray(controls, dtype=float)
+    n = len(values)
+    centred = controls - controls.mean()
+    if n < 3 or not centred.any():
+        return float(values.mean()), np.inf
+    beta = (centred @ (values - values.mean())) / (centred @ centred)
+    adjusted = values - beta * (controls - mean)
+    residual = values - values.mean() - beta * centred
+    variance = (residual @ residual) / (n - 2) * (1 / n + (controls.mean() - mean) ** 2 / (centred @ centred))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return float(adjusted.mean()), float(z * np.sqrt(variance))
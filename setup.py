@@ -9,4 +9,5 @@ with open(path.join(this_directory, 'README.md'), encoding='utf-8') as f:
 setup(name='ParallelQueue', version='1.0.0', packages=['parallelqueue'],
       url='https://github.com/aarjaneiro/ParallelQueue', license='MIT', author='Aaron Janeiro Stone',
       author_email='ajstone@uwaterloo.ca', description='Parallel queueing models for SimPy',
-      long_description=long_description, long_description_content_type='text/markdown')
+      long_description=long_description, long_description_content_type='text/markdown',
+      extras_require={'parquet': ['pyarrow']})
@@ -1,6 +1,20 @@
 from unittest import TestCase
 
-from parallelqueue import base_models, monitors
+from parallelqueue import base_models, columns, convergence, distributions, jobs, live, meanfield, monitors, \
+    network, processes, queues, replications, routers, shards, sweep, traces
+
+
+class Preempt(monitors.Monitor):
+    """Stops a run at time 65 while armed (standing in for a crash). Picklable, so it can be checkpointed."""
+    armed = True
+
+    def on_arrival(self, system, now, job):
+        if now >= 65 and Preempt.armed:
+            system.Stop()
+
+    @property
+    def Name(self):
+        return "Preempt"
 
 
 class TestModels(TestCase):
@@ -73,6 +87,594 @@ class TestModels(TestCase):
         df = sim.MonitorOutput
         assert len(df) == 4
 
+    def test_replica_records(self):
+        # Finished replica sets should leave nothing behind
+        sim = base_models.RedundancyQueueSystem(numberJobs=500, infiniteJobs=False, parallelism=20, seed=1234, d=3,
+                                                Arrival=random.expovariate, AArgs=15,
+                                                Service=random.expovariate, SArgs=1,
+                                                Monitors=[monitors.JobTotal])
+        sim.RunSim()
+        assert len(sim.ReplicaDict) == 0
+        assert sim.QueueState.Total == 0
+        assert set(sim.MonitorOutput["JobTotal"]) == {jobs.JobName(job) for job in range(1, 501)}
+
+    def test_columns(self):
+        # Column buffers should rebuild the snapshots and stream chunks to Parquet
+        sim = base_models.JSQd(maxTime=100.0, parallelism=20, seed=1234, d=2,
+                               Arrival=random.expovariate, AArgs=10,
+                               Service=random.expovariate, SArgs=1,
+                               Monitors=[monitors.TimeQueueSize, monitors.JobTime])
+        sim.RunSim()
+        df = sim.DataFrame
+        snapshots = sim.MonitorOutput["TimeQueueSize"]
+        assert list(df.index) == list(snapshots)
+        assert all(list(df.loc[t].values) == list(sizes.values()) for t, sizes in snapshots.items())
+        assert list(snapshots[df.index[-1]]) == list(range(20))
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return
+        store = columns.ColumnStore({"time": float, "queue": "int32"}, chunk=16)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "trace.parquet")
+            store.Spill(path)
+            store.Extend(np.arange(100.0), np.arange(100))
+            assert len(store.chunks) == 0 and store.spilled == 96
+            with self.assertRaises(ValueError):  # The spilled rows would be missing
+                store.to_parquet(os.path.join(folder, "other.parquet"))
+            store.to_parquet(path)
+            assert list(pd.read_parquet(path)["queue"]) == list(range(100))
+            # Event times are rows too, so that a spilled trace is whole
+            sim = base_models.JSQd(maxTime=100.0, parallelism=20, seed=1234, d=2, Arrival=random.expovariate,
+                                   AArgs=10, Service=random.expovariate, SArgs=1, Monitors=[monitors.TimeQueueSize])
+            monitor = sim.MonitorHolder["TimeQueueSize"]
+            monitor.Store = columns.ColumnStore(monitor.Store.columns, chunk=64)
+            monitor.Spill(path)
+            sim.RunSim()
+            monitor.to_parquet(path)
+            rows = pd.read_parquet(path)
+            assert monitor.Store.spilled == len(rows) > 64 and list(rows["time"].unique()) == list(df.index)
+            changed = rows[rows["queue"] >= 0]
+            assert (changed.groupby("queue")["size"].last().values == df.iloc[-1].values).all()
+
+    def test_streaming_monitors(self):
+        # Running accumulators should agree with the stored job totals
+        sim = base_models.RedundancyQueueSystem(maxTime=100.0, parallelism=20, seed=1234, d=2,
+                                                Arrival=random.expovariate, AArgs=10,
+                                                Service=random.expovariate, SArgs=1,
+                                                Monitors=[monitors.JobTotal, monitors.JobTotalStats,
+                                                          monitors.JobTotalQuantiles, monitors.TimeAverageQueueSize])
+        sim.RunSim()
+        df = sim.MonitorOutput
+        totals = list(df["JobTotal"].values())
+        mean = sum(totals) / len(totals)
+        assert df["JobTotalStats"]["count"] == len(totals)
+        assert abs(df["JobTotalStats"]["mean"] - mean) < 1e-9
+        assert abs(df["JobTotalQuantiles"][0.5] - sorted(totals)[len(totals) // 2]) / mean < 0.1
+        assert abs(df["TimeAverageQueueSize"]["mean"].sum() - df["TimeAverageQueueSize"]["total_mean"]) < 1e-9
+
+    def test_event_hooks(self):
+        # A monitor implementing only Add should see the same departures as one using hooks, on both engines
+        class Legacy(monitors.Monitor):
+            def __init__(self):
+                super().__init__()
+                self.Totals = {}
+
+            def Add(self, MonitorInputs: dict):
+                if "finish" in MonitorInputs:
+                    self.Totals[MonitorInputs["name"]] = MonitorInputs["finish"]
+
+            @property
+            def Name(self):
+                return "Legacy"
+
+            @property
+            def Data(self):
+                return self.Totals
+
+        for engine in ["simpy", "fast"]:
+            sim = base_models.RedundancyQueueSystem(maxTime=50.0, parallelism=10, seed=1234, d=2,
+                                                    Arrival=random.expovariate, AArgs=5,
+                                                    Service=random.expovariate, SArgs=1,
+                                                    Monitors=[Legacy, monitors.JobTotal], engine=engine)
+            assert sim.Events.on_departure and not sim.Events.on_service_start
+            sim.RunSim()
+            assert sim.MonitorOutput["Legacy"] == sim.MonitorOutput["JobTotal"]
+
+    def test_distributions(self):
+        # Block samplers should match their means, and the arrival stream should not depend on routing
+        rng = np.random.default_rng(1)
+        for dist in [distributions.Exponential(2), distributions.Deterministic(0.5), distributions.Erlang(3, 6),
+                     distributions.HyperExponential([0.9, 0.1], [10, 0.2]), distributions.LogNormal(-1, 0.5),
+                     distributions.Pareto(3.5, 0.5), distributions.Empirical([0.2, 0.4, 0.9])]:
+            sample = dist.Draw(rng, 200000)
+            assert abs(sample.mean() - dist.Mean) / dist.Mean < 0.05, dist
+            bound, again = dist.Bind(np.random.default_rng(2), block=16), np.random.default_rng(2)
+            drawn = np.concatenate([dist.Draw(again, 16) for _ in range(3)])[:40]
+            assert [bound() for _ in range(40)] == drawn.tolist()
+        for engine in ["simpy", "fast"]:
+            entries = []
+            for d in [1, 3]:
+                sim = base_models.JSQd(maxTime=50.0, parallelism=10, seed=1234, d=d,
+                                       Arrival=distributions.Exponential(5), AArgs=None,
+                                       Service=distributions.Erlang(2, 2), SArgs=None,
+                                       Monitors=[monitors.JobTime], engine=engine)
+                sim.RunSim()
+                entries.append(np.sort(sim.MonitorHolder["JobTime"].DataFrame["entry"].to_numpy()))
+            n = min(map(len, entries))
+            assert n > 100 and np.array_equal(entries[0][:n // 2], entries[1][:n // 2])
+
+    def test_instrumentation(self):
+        # Instrumented runs should retrace the same sample path and count every event
+        totals = []
+        for instrument in [False, True]:
+            sim = base_models.RedundancyQueueSystem(maxTime=50.0, parallelism=10, seed=1234, d=2,
+                                                    Arrival=random.expovariate, AArgs=5,
+                                                    Service=random.expovariate, SArgs=1,
+                                                    Monitors=[monitors.JobTotal], instrument=instrument)
+            sim.RunSim()
+            totals.append(sim.MonitorOutput["JobTotal"])
+        report = sim.Instrumentation.Report()
+        assert totals[0] == totals[1]
+        assert report["events"]["departure"] == report["events"]["cancel"] == len(totals[1])
+        assert report["monitors"]["JobTotal"]["calls"] == len(totals[1])
+        assert report["network"]["Router"]["calls"] > 0 and report["event_queue"]["max"] > 0
+        assert report["simulated"] == 50.0
+
+    def test_convergence(self):
+        # MSER should cut off an initial transient, and runs should stop once precise enough
+        rng = np.random.default_rng(1)
+        series = np.concatenate([np.linspace(10, 1, 100), 1 + rng.normal(0, 0.1, 900)])
+        assert 80 <= convergence.MSER(series) <= 120
+        for engine in ["simpy", "fast"]:
+            sim = base_models.JSQd(parallelism=10, seed=1234, d=2, Arrival=random.expovariate, AArgs=5,
+                                   Service=random.expovariate, SArgs=1, Monitors=[monitors.JobTotalStats],
+                                   engine=engine)
+            estimate = sim.RunToPrecision(0.05)
+            assert estimate["converged"] and estimate["relative"] <= 0.05
+            assert sim.MonitorOutput["JobTotalStats"]["count"] == estimate["jobs"]
+            assert abs(estimate["mean"] - sim.MonitorOutput["JobTotalStats"]["mean"]) < 2 * estimate["halfwidth"]
+            assert not sim.Events.on_departure[1:]  # No longer subscribed
+
+    def test_checkpoint(self):
+        # A run preempted after a checkpoint and resumed from it should match an uninterrupted run exactly
+        def Build(model):
+            return model(maxTime=100.0, parallelism=20, seed=99, d=2, Arrival=random.expovariate, AArgs=18,
+                         Service=distributions.HyperExponential([0.5, 0.5], [2, 0.67]), SArgs=None,
+                         Monitors=[monitors.TimeQueueSize, monitors.JobTime, monitors.JobTotalStats, Preempt],
+                         engine="fast")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.ckpt")
+            for model in [base_models.JSQd, base_models.RedundancyQueueSystem]:
+                Preempt.armed = False
+                uninterrupted = Build(model)
+                uninterrupted.RunSim()
+                Preempt.armed = True
+                Build(model).RunSim(checkpoint=path, every=25.0)
+                Preempt.armed = False
+                resumed = Build(model)
+                resumed.Resume(path)
+                for name in ["TimeQueueSize", "JobTime"]:
+                    assert uninterrupted.MonitorHolder[name].DataFrame.equals(resumed.MonitorHolder[name].DataFrame)
+                assert uninterrupted.MonitorOutput["JobTotalStats"] == resumed.MonitorOutput["JobTotalStats"]
+            with self.assertRaises(ValueError):
+                base_models.JSQd(maxTime=100.0, parallelism=20, seed=98, d=2, Arrival=random.expovariate, AArgs=18,
+                                 Service=random.expovariate, SArgs=1, engine="fast").Resume(path)
+
+    def test_fast(self):
+        # The fast engine should repeat itself for 1 seed and agree with SimPy in distribution
+        means = {}
+        for model in [base_models.JSQd, base_models.RedundancyQueueSystem]:
+            for engine in ["simpy", "fast", "fast"]:
+                sim = model(maxTime=500.0, parallelism=50, seed=1234, d=2,
+                            Arrival=random.expovariate, AArgs=25,
+                            Service=random.expovariate, SArgs=1,
+                            Monitors=[monitors.JobTotal, monitors.TimeQueueSize], engine=engine)
+                sim.RunSim()
+                totals = sim.MonitorOutput["JobTotal"]
+                means.setdefault(model, []).append(sum(totals.values()) / len(totals))
+        for simpy, fast, again in means.values():
+            assert fast == again
+            assert abs(fast - simpy) / simpy < 0.05
+
+    def test_queue_index(self):
+        # Buckets should always hold the shortest queues, in order
+        rng = random.Random(1234)
+        state = queues.QueueIndex(10, buckets=True)
+        for _ in range(1000):
+            queue = rng.randrange(10)
+            if state.InSystem[queue] and rng.random() < 0.5:
+                state.Leave(queue)
+                if state.InSystem[queue]:
+                    state.Start(queue)
+            else:
+                state.Enqueue(queue)
+                if state.InSystem[queue] == 1:
+                    state.Start(queue)
+            least = state.InSystem.min()
+            assert state.Buckets.Shortest == [i for i in range(10) if state.InSystem[i] == least]
+        assert state.Total == state.InSystem.sum()
+        assert ((state.Busy == 1) == (state.InSystem > 0)).all()
+
+    def test_replications(self):
+        # Replications should not depend on the number of workers
+        sim = base_models.JSQd(maxTime=50.0, parallelism=20, seed=1234, d=2,
+                               Arrival=random.expovariate, AArgs=10,
+                               Service=random.expovariate, SArgs=1)
+        serial = sim.RunReplications(4, workers=1)
+        pooled = sim.RunReplications(4, workers=2)
+        assert serial == pooled
+        assert len({summary["seed"] for summary in serial}) == 4
+
+    def test_sweep(self):
+        # A widened grid should only run its new points
+        with tempfile.TemporaryDirectory() as cache:
+            kwargs = dict(parallelism=20, seed=1234, maxTime=50.0, Arrival=random.expovariate,
+                          Service=random.expovariate, SArgs=1, cache=cache, workers=1)
+            df1 = sweep.Sweep(base_models.JSQd, {"d": [1, 2], "AArgs": [5, 10]}, **kwargs)
+            assert len(os.listdir(cache)) == 4
+            df2 = sweep.Sweep(base_models.JSQd, {"d": [1, 2, 3], "AArgs": [5, 10]}, **kwargs)
+            assert len(os.listdir(cache)) == 6
+            assert df1.equals(df2[df2.d < 3].reset_index(drop=True))
+
+    def test_cancellation(self):
+        # Every replica routed is either served, cancelled or still in the system; under cancel-on-start, each job
+        # starts service exactly once
+        class Replicas(monitors.Monitor):
+            def __init__(self):
+                super().__init__()
+                self.Counts = {"route": 0, "start": 0, "cancel": 0, "departure": 0}
+                self.Starts = {}
+
+            def on_route(self, system, now, job, choices):
+                self.Counts["route"] += len(choices)
+
+            def on_service_start(self, system, now, job, queue, arrive):
+                self.Counts["start"] += 1
+                self.Starts[job] = self.Starts.get(job, 0) + 1
+
+            def on_cancel(self, system, now, job, queue):
+                self.Counts["cancel"] += 1
+
+            def on_departure(self, system, now, job, queue, arrive, start):
+                self.Counts["departure"] += 1
+
+            @property
+            def Name(self):
+                return "Replicas"
+
+        for cancel in ["complete", "start"]:
+            for engine in ["simpy", "fast"]:
+                sim = base_models.RedundancyQueueSystem(maxTime=100.0, parallelism=10, seed=1234, d=3,
+                                                        Arrival=random.expovariate, AArgs=5,
+                                                        Service=random.expovariate, SArgs=1, Monitors=[Replicas],
+                                                        engine=engine, cancel=cancel)
+                sim.RunSim()
+                counts, starts = sim.MonitorHolder["Replicas"].Counts, sim.MonitorHolder["Replicas"].Starts
+                assert counts["route"] - counts["departure"] - counts["cancel"] == sim.QueueState.Total
+                if cancel == "start":
+                    assert set(starts.values()) == {1}
+        with self.assertRaises(ValueError):
+            base_models.RedundancyQueueSystem(maxTime=1.0, parallelism=2, seed=1, d=2, Arrival=random.expovariate,
+                                              AArgs=1, Service=random.expovariate, SArgs=1, cancel="never")
+
+    def test_lazy_network(self):
+        # Without processes per job, the same streams should give the same sample path, and only busy servers (and
+        # replicas cancelled in service) should have events scheduled
+        for kwargs in [{"Replicas": False}, {"Replicas": True, "r": 2}, {"Replicas": True, "cancel": "start"}]:
+            totals = []
+            for net in [network.Network, network.LazyNetwork]:
+                sim = base_models.ParallelQueueSystem(maxTime=50.0, parallelism=20, seed=1234, d=3,
+                                                      Arrival=distributions.Exponential(18), AArgs=None,
+                                                      Service=distributions.Exponential(1), SArgs=None,
+                                                      Monitors=[monitors.JobTotal], network=net, instrument=True,
+                                                      **kwargs)
+                sim.RunSim()
+                totals.append(sim.MonitorOutput["JobTotal"])
+            assert totals[0] == totals[1]
+            assert sim.Instrumentation.Report()["event_queue"]["max"] <= 3 * 20 + 1
+
+    def test_meanfield(self):
+        # The fixed point should match the closed forms and agree with a large simulation, taking the same arguments
+        kwargs = dict(parallelism=1000, seed=1234, d=2, Arrival=random.expovariate, AArgs=700,
+                      Service=random.expovariate, SArgs=1)
+        jsq = meanfield.JSQd(**kwargs)
+        assert abs(jsq["mean"] - sum(0.7 ** (2 ** k - 1) for k in range(1, 30)) / 0.7) < 1e-9
+        assert abs(jsq["distribution"].sum() - 1) < 1e-9
+        erlang = meanfield.JSQd(**{**kwargs, "Service": distributions.Erlang(1, 1)})  # Solved as phase-type
+        assert abs(erlang["mean"] - jsq["mean"]) < 1e-6
+        assert abs(meanfield.RedundancyQueueSystem(**kwargs)["mean"] - (np.log(1 / 0.3) / 0.49 - 1 / 0.7)) < 1e-9
+        for model, r in [(base_models.JSQd, None), (base_models.RedundancyQueueSystem, 1)]:
+            estimate = getattr(meanfield, model.__name__)(**kwargs, r=r)
+            sim = model(maxTime=100.0, Monitors=[monitors.JobTotal], engine="fast", r=r, **kwargs)
+            sim.RunSim()
+            totals = list(sim.MonitorOutput["JobTotal"].values())[len(sim.MonitorOutput["JobTotal"]) // 4:]
+            assert abs(np.mean(totals) - estimate["mean"]) / estimate["mean"] < 0.05
+        with self.assertRaises(ValueError):
+            meanfield.JSQd(**{**kwargs, "AArgs": 1000})
+
+    def test_variance_reduction(self):
+        # With common random numbers every engine retraces the same path; antithetic pairs and the control variate
+        # should narrow the interval
+        kwargs = dict(maxTime=100.0, parallelism=20, seed=7, d=2, Arrival=random.expovariate, AArgs=17,
+                      Service=random.expovariate, SArgs=1, Monitors=[replications.Summary], crn=True)
+        for model in [base_models.JSQd, base_models.RedundancyQueueSystem]:
+            means = set()
+            for options in [{}, {"engine": "fast"}, {"network": network.LazyNetwork}]:
+                sim = model(**kwargs, **options)
+                sim.RunSim()
+                means.add(sim.MonitorHolder["Summary"].Report(sim)["mean"])
+            assert len(means) == 1
+        sim = base_models.JSQd(**{**kwargs, "engine": "fast", "Monitors": []})
+        plain = replications.ReplicationRunner(sim, workers=1)
+        reduced = replications.ReplicationRunner(sim, workers=1, antithetic=True, control=True)
+        assert reduced.Estimate(reduced.Run(20))[1] < plain.Estimate(plain.Run(20))[1]
+        uniforms = np.random.default_rng(1)
+        u = distributions.Inversion(np.random.default_rng(1)).random(1000)
+        assert (u + distributions.Inversion(uniforms, antithetic=True).random(1000) == 1).all()
+        with self.assertRaises(ValueError):
+            replications.ReplicationRunner(base_models.JSQd(**{**kwargs, "crn": False}), control=True)
+        with self.assertRaises(ValueError):  # Not drawn from the streams, so neither common nor mirrored
+            base_models.JSQd(**{**kwargs, "Service": random.paretovariate, "SArgs": 3})
+
+    def test_heterogeneous_servers(self):
+        # The tracked work should match the jobs actually present, and routing on speed or work should beat JSQ(d)
+        class Work(monitors.Monitor):
+            error = 0.0
+
+            def on_arrival(self, system, now, job):
+                state = system.QueueState
+                for queue, resource in system.Queues.items() if state.Work is not None else ():
+                    assigned = [r.finish - now for r in resource.users if r.finish is not None]
+                    waiting = len(resource.put_queue) + len(resource.users) - len(assigned)
+                    Work.error = max(Work.error, abs(sum(assigned) + waiting * state.Expected[queue]
+                                                     - state.Remaining(queue)))
+
+            @property
+            def Name(self):
+                return "Work"
+
+        kwargs = dict(maxTime=200.0, parallelism=10, seed=5, d=2, Arrival=random.expovariate, AArgs=13,
+                      Service=random.expovariate, SArgs=1, speeds=[1] * 5 + [2] * 5, capacities=[1] * 5 + [2] * 5)
+        means = {}
+        for router in ["jsq", "speed", "work"]:
+            sim = base_models.JSQd(**kwargs, router=router, Monitors=[replications.Summary, Work])
+            sim.RunSim()
+            means[router] = sim.MonitorHolder["Summary"].Report(sim)["mean"]
+        assert Work.error < 1e-9
+        assert means["speed"] < means["jsq"] and means["work"] < means["jsq"]
+        for model in [base_models.JSQd, base_models.RedundancyQueueSystem]:  # Speeds apply in both engines alike
+            sims = [model(**{**kwargs, "capacities": None}, Monitors=[monitors.JobTotal], crn=True, engine=engine)
+                    for engine in ["simpy", "fast"]]
+            for sim in sims:
+                sim.RunSim()
+            assert sims[0].MonitorOutput["JobTotal"] == sims[1].MonitorOutput["JobTotal"]
+        with self.assertRaises(ValueError):
+            base_models.JSQd(**kwargs, engine="fast")
+
+    def test_routing_policies(self):
+        # Every policy should run on both networks; JIQ should find an idle queue and LWL the least work whenever
+        # there is one, and the policy objects should route as their names do
+        class Check(monitors.Monitor):
+            violations = 0
+
+            def on_route(self, system, now, job, choices):
+                state, queue = system.QueueState, choices[0]
+                if system.router == "jiq":
+                    Check.violations += (state.InSystem < state.Capacity).any() and state.InSystem[queue] > 0
+                elif system.router == "lwl":
+                    least = min(state.Remaining(i) for i in range(system.parallelism))
+                    Check.violations += state.Remaining(queue) > least + 1e-9
+                elif system.router == "round-robin":
+                    Check.violations += queue != (job - 1) % system.parallelism
+
+            @property
+            def Name(self):
+                return "Check"
+
+        kwargs = dict(maxTime=50.0, parallelism=20, seed=5, d=2, Arrival=random.expovariate,
+                      Service=random.expovariate, SArgs=1, Monitors=[monitors.JobTotal, Check])
+        for router in routers.POLICIES:
+            batch = 4 if router.startswith("batch") else 1
+            for net in [network.Network, network.LazyNetwork]:
+                sim = base_models.JSQd(**kwargs, AArgs=18 / batch, router=router, batch=batch, network=net)
+                sim.RunSim()
+                assert len(sim.MonitorOutput["JobTotal"]) > 500
+        assert Check.violations == 0
+        totals = []
+        for router in ["jsq", "speed", routers.ShortestQueue]:  # Equal speeds: the same as JSQ(d)
+            sim = base_models.JSQd(**kwargs, AArgs=18, router=router)
+            sim.RunSim()
+            totals.append(sim.MonitorOutput["JobTotal"])
+        assert totals[0] == totals[1] == totals[2]
+        with self.assertRaises(ValueError):  # Replicas join every sampled queue
+            base_models.ParallelQueueSystem(**kwargs, AArgs=18, router="jiq")
+
+    def test_traces(self):
+        # Every format should replay the same jobs, one queue should match Lindley's recursion in every engine, and
+        # the offset and speedup should shift and scale the arrivals
+        rng = np.random.default_rng(1)
+        times, sizes = np.cumsum(rng.exponential(1 / 0.9, 2000)), rng.exponential(1, 2000)
+        response, free = [], 0.0
+        for arrive, size in zip(times - times[0], sizes):
+            free = max(arrive, free) + size
+            response.append(free - arrive)
+        with tempfile.TemporaryDirectory() as folder:
+            records = np.zeros(2000, dtype=[("time", float), ("size", float)])
+            records["time"], records["size"] = times, sizes
+            np.save(os.path.join(folder, "trace.npy"), records)
+            np.save(os.path.join(folder, "columns.npy"), np.c_[times, sizes])
+            pd.DataFrame({"time": times, "size": sizes}).to_csv(os.path.join(folder, "trace.csv"), index=False)
+            pyarrow = columns.Arrow()
+            import pyarrow.feather
+            pyarrow.feather.write_feather(pyarrow.table({"time": times, "size": sizes}),
+                                          os.path.join(folder, "trace.arrow"), chunksize=300)
+            sources = [traces.Trace(os.path.join(folder, "trace.npy"), chunk=333),
+                       traces.Trace(os.path.join(folder, "columns.npy"), time=0, size=1),
+                       traces.Trace(os.path.join(folder, "trace.csv"), chunk=500),
+                       traces.Trace(os.path.join(folder, "trace.arrow"), chunk=128)]
+            for trace in sources:
+                gaps = np.concatenate([gap for gap, _ in trace.Chunks()])
+                assert np.allclose(np.cumsum(gaps), times - times[0])
+                for engine, net in [("simpy", network.Network), ("simpy", network.LazyNetwork),
+                                    ("fast", network.Network)]:
+                    sim = base_models.JSQd(parallelism=1, seed=1, d=1, Arrival=trace, AArgs=None, Service=None,
+                                           SArgs=None, Monitors=[monitors.JobTotal], engine=engine, network=net)
+                    sim.RunSim()
+                    totals = sim.MonitorOutput["JobTotal"]
+                    assert np.allclose([totals[jobs.JobName(job)] for job in range(1, 2001)], response)
+            trace = traces.Trace(os.path.join(folder, "trace.npy"), offset=1000, speedup=2.0)
+            gaps = np.concatenate([gap for gap, _ in trace.Chunks()])
+            assert len(gaps) == 1000 and np.allclose(np.cumsum(gaps), (times[1000:] - times[1000]) / 2)
+            sim = base_models.RedundancyQueueSystem(parallelism=10, seed=1, d=2, Arrival=traces.Trace(
+                os.path.join(folder, "trace.csv"), size=None), AArgs=None, Service=random.expovariate, SArgs=1,
+                Monitors=[monitors.JobTotal])
+            sim.RunSim()
+            assert len(sim.MonitorOutput["JobTotal"]) == 2000
+            with self.assertRaises(ValueError):
+                traces.Replay(traces.Trace(os.path.join(folder, "trace.npy"), offset=2000))
+
+    def test_staged_network(self):
+        # Tandem and feedback queues should match their product-form means, a fork-join stage should wait for the
+        # last of its tasks, and every policy should run at a stage of a pipeline
+        for stages, transitions, rate, expected in [
+                ([network.Stage(1, random.expovariate, 1.5, d=1), network.Stage(1, random.expovariate, 2, d=1)], None,
+                 1, 1 / 0.5 + 1 / 1),  # Tandem M/M/1 queues
+                ([network.Stage(1, random.expovariate, 2, d=1)], [[0.5]], 0.5, 2 * 1 / (2 - 1)),  # Two visits
+                ([network.Stage(2, random.expovariate, 1, d=2, fork=2)], None, 0.01, 1.5)]:  # Max of two services
+            sim = base_models.StagedQueueSystem(stages, seed=2, Arrival=random.expovariate, AArgs=rate,
+                                                transitions=transitions, maxTime=20000.0,
+                                                Monitors=[replications.Summary])
+            sim.RunSim()
+            assert abs(sim.MonitorHolder["Summary"].Report(sim)["mean"] / expected - 1) < 0.1
+        for router in routers.POLICIES:
+            stages = [network.Stage(10, random.expovariate, 2, d=2),
+                      network.Stage(20, distributions.Exponential(4), d=4, router=router, fork=3),
+                      network.Stage(5, random.expovariate, 4, router="jiq", capacities=[2] * 5)]
+            sim = base_models.StagedQueueSystem(stages, seed=2, Arrival=random.expovariate, AArgs=10, maxTime=50.0,
+                                                transitions=[[0, 1, 0], [0, 0, 1], [0, 0.5, 0]],
+                                                Monitors=[monitors.JobTotal])
+            sim.RunSim()
+            assert len(sim.MonitorOutput["JobTotal"]) > 300
+        with self.assertRaises(ValueError):
+            base_models.StagedQueueSystem(stages, seed=2, Arrival=random.expovariate, AArgs=10, transitions=[[1, 1]])
+
+    def test_shards(self):
+        # A sharded run should not depend on the number of shards, and should agree with a single process
+        kwargs = dict(maxTime=100.0, parallelism=200, seed=3, d=2, Arrival=random.expovariate, AArgs=180,
+                      Service=random.expovariate, SArgs=1)
+        sim = base_models.JSQd(**kwargs, Monitors=[replications.Summary], engine="fast")
+        sim.RunSim()
+        single = sim.MonitorHolder["Summary"].Report(sim)
+        reports = [base_models.JSQd(**kwargs, Monitors=[]).RunSharded(n) for n in [1, 3]]
+        assert reports[0]["jobs"] == reports[1]["jobs"] and np.isclose(reports[0]["mean"], reports[1]["mean"])
+        for key in ["mean", "q0.9", "queue"]:
+            assert abs(reports[1][key] / single[key] - 1) < 0.05
+        assert abs(reports[1]["jobs"] / single["jobs"] - 1) < 0.01
+        with self.assertRaises(ValueError):
+            shards.ShardedRunner(base_models.RedundancyQueueSystem(**kwargs))
+
+    def test_shard_failure(self):
+        # A shard's error should stop the run and be raised, rather than leave the other processes waiting
+        sim = base_models.JSQd(maxTime=10.0, parallelism=20, seed=3, d=2, Arrival=random.expovariate, AArgs=18,
+                               Service=distributions.Exponential(-1.0), SArgs=None, Monitors=[])
+        segments = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+        start = time.time()
+        with self.assertRaises(ValueError):
+            sim.RunSharded(2, window=0.1, timeout=30)
+        assert time.time() - start < 30
+        if os.path.isdir("/dev/shm"):
+            assert set(os.listdir("/dev/shm")) <= segments
+
+    def test_live_export(self):
+        # Snapshots should tile the run and account for every arrival, however far behind the sink falls
+        class Slow(live.CSVFile):
+            def Write(self, snapshot):
+                time.sleep(0.01)
+                super().Write(snapshot)
+
+        kwargs = dict(maxTime=200.0, parallelism=20, seed=5, d=2, Arrival=random.expovariate, AArgs=18,
+                      Service=random.expovariate, SArgs=1, Monitors=[])
+        with tempfile.TemporaryDirectory() as tmp:
+            for engine in ["simpy", "fast"]:
+                path = os.path.join(tmp, f"{engine}.jsonl")
+                base_models.JSQd(**kwargs, engine=engine).RunSim(export=live.LiveExport(live.JsonLines(path), 20.0))
+                with open(path) as file:
+                    rows = [json.loads(line) for line in file]
+                assert [row["end"] for row in rows] == [20.0 * (k + 1) for k in range(10)]
+                assert all(sum(row["lengths"]) == 20 for row in rows) and 1 < rows[-1]["mean"] < 10
+            path = os.path.join(tmp, "slow.csv")
+            export = live.LiveExport(Slow(path), 0.1, capacity=2)
+            base_models.JSQd(**kwargs, engine="fast").RunSim(export=export)
+            frame = pd.read_csv(path)
+            assert export.Coalesced > 0 and len(frame) < 2000 and frame["end"].iloc[-1] == 200.0
+            assert (frame["start"].iloc[1:].values == frame["end"].iloc[:-1].values).all()
+            assert frame["arrivals"].sum() == sum(row["arrivals"] for row in rows)  # Those of the same fast run
+
+        # A failing sink should neither block the run nor go unnoticed
+        class Full(live.JsonLines):
+            def Write(self, snapshot):
+                raise OSError("No space left on device")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            export = live.LiveExport(Full(os.path.join(tmp, "full.jsonl")), 0.1, capacity=2)
+            start = time.time()
+            with self.assertRaises(OSError):
+                base_models.JSQd(**kwargs, engine="fast").RunSim(export=export)
+            assert time.time() - start < 30 and not export.thread.is_alive()
+        with self.assertRaises(ValueError):
+            live.LiveExport(None, 0)
+
+    def test_startup(self):
+        # Importing the models should not import the dependencies of optional features, and replications run from a
+        # prepared template should match those given their specification
+        code = "import sys, parallelqueue.base_models; print(' '.join(sorted(sys.modules)))"
+        loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+        assert not set(loaded) & {"pandas", "pyarrow", "multiprocessing", "concurrent.futures", "http.server"}
+        sim = base_models.JSQd(maxTime=50.0, parallelism=10, seed=2, d=2, Arrival=random.expovariate, AArgs=8,
+                               Service=random.expovariate, SArgs=1, Monitors=[], engine="fast", crn=True)
+        runner = replications.ReplicationRunner(sim, workers=1, antithetic=True)
+        assert runner.Run(4) == replications.ReplicationRunner(sim, workers=2, antithetic=True).Run(4)
+        specification = replications.Specification(sim)
+        try:
+            replications.Prepare(specification)
+            assert replications.Replicate(None, 0, 5, antithetic=True) == \
+                   replications.Replicate(specification, 0, 5, antithetic=True)
+        finally:
+            replications.TEMPLATE = None
+
+    def test_arrival_processes(self):
+        # Piecewise rates are followed, a callable rate is thinned against its bound and batches are whole jobs
+        rng = np.random.default_rng(1)
+        daily = processes.NHPP([2, 20, 50, 2], times=[0, 7, 18, 21], period=24)
+        sample = daily.Bind(rng)
+        times = np.cumsum([sample() for _ in range(40000)])
+        hours = np.bincount((times % 24).astype(int), minlength=24) / (times[-1] / 24)
+        assert abs(hours[:7].mean() / 2 - 1) < 0.1 and abs(hours[7:18].mean() / 20 - 1) < 0.05
+        assert abs(hours[18:21].mean() / 50 - 1) < 0.05 and abs(daily.Mean - 24 / 390) < 1e-12
+        wave = processes.NHPP(lambda t: 10 + 9 * np.sin(t), bound=19)
+        sample = wave.Bind(rng)
+        assert abs(sum(sample() for _ in range(20000)) / 20000 * 10 - 1) < 0.05
+        with self.assertRaises(ValueError):
+            processes.NHPP(lambda t: 10 + 9 * np.sin(t), bound=5).Bind(rng)()
+        mmpp = processes.MMPP([[-1, 1], [6, -6]], [10, 100])
+        sample = mmpp.Bind(rng)
+        assert abs(sum(sample() for _ in range(50000)) / 50000 / mmpp.Mean - 1) < 0.05
+        for options in ({}, {"engine": "fast"}, {"router": "batch-filling"}):
+            sim = base_models.JSQd(maxTime=200.0, parallelism=20, seed=3, d=2, Arrival=mmpp, AArgs=None,
+                                   Service=distributions.Exponential(3), SArgs=None, batch=distributions.Geometric(2),
+                                   Monitors=[replications.Summary], **options)
+            sim.RunSim()
+            assert abs(sim.MonitorHolder["Summary"].Report(sim)["jobs"] / (400 / mmpp.Mean) - 1) < 0.15
+        with self.assertRaises(ValueError):
+            base_models.JSQd(maxTime=10.0, parallelism=5, seed=3, d=2, Arrival=daily, AArgs=None,
+                             Service=random.expovariate, SArgs=1, engine="fast").RunSim(
+                checkpoint=os.path.join(tempfile.mkdtemp(), "run.ckpt"), every=1.0)
+        with self.assertRaises(ValueError):
+            base_models.JSQd(maxTime=10.0, parallelism=5, seed=3, d=2, Arrival=daily, AArgs=None,
+                             Service=random.expovariate, SArgs=1, batch=0)
+
 
 #   For test_simpy
 """
@@ -91,9 +693,18 @@ By Aaron Janeiro Stone -- Modified from my Medium Article:
 https://medium.com/swlh/simulating-a-parallel-queueing-system-with-simpy-6b7fcb6b1ca1
 """
 import io
+import json
+import os
 import random
+import subprocess
+import sys
+import tempfile
+import time
 from contextlib import redirect_stdout
 
+import numpy as np
+import pandas as pd
+
 from simpy import *
 
 